@@ -0,0 +1,1111 @@
+'''
+Created on 18 Oct 2016
+
+@author: Filip Lindau
+'''
+
+#     "$Name:  $";
+#     "$Header:  $";
+#=============================================================================
+#
+# file :        ZaberChainDS.py
+#
+# description : Python source for the ZaberChainDS and its commands.
+#                The class is derived from Device. It represents the
+#                CORBA servant object which will be accessed from the
+#                network. All commands which can be executed on the
+#                ZaberChainDS are implemented in this file.
+#
+# project :     TANGO Device Server
+#
+# $Author:  $
+#
+# $Revision:  $
+#
+# $Log:  $
+#
+# copyleft :    European Synchrotron Radiation Facility
+#               BP 220, Grenoble 38043
+#               FRANCE
+#
+#=============================================================================
+#          This file is generated by POGO
+#     (Program Obviously used to Generate tango Object)
+#
+#         (c) - Software Engineering Group - ESRF
+#=============================================================================
+#
+
+
+import PyTango
+import sys
+import zaber_control as zc
+import zaber_trace as zt
+import zaber_state as zst
+import threading
+import Queue
+import time
+import numpy as np
+
+#==================================================================
+#   ZaberChainDS Class Description:
+#
+#         Controls all axes of a chain of Zaber T series motors on one
+#         port, with one state thread and one serial handle. Each axis
+#         gets the dynamic attributes Position_<n>, State_<n>, Status_<n>
+#         and Homed_<n>, n being the device number. The spectrum
+#         attributes Positions and States give all axes in one read.
+#
+#==================================================================
+#     Device States Description:
+#
+#   DevState.ON :       Connected to the chain, all axes idle
+#   DevState.MOVING :   At least one axis is moving
+#   DevState.FAULT :    An error was detected. Probably communication.
+#   DevState.ALARM :    Some axes of the chain did not answer
+#   DevState.UNKNOWN :  Disconnected from motor controller
+#==================================================================
+
+
+class ZaberChainDS(PyTango.Device_4Impl):
+
+#--------- Add you global variables here --------------------------
+
+#------------------------------------------------------------------
+#     Device constructor
+#------------------------------------------------------------------
+    def __init__(self, cl, name):
+        PyTango.Device_4Impl.__init__(self, cl, name)
+        ZaberChainDS.init_device(self)
+
+#------------------------------------------------------------------
+#     Device destructor
+#------------------------------------------------------------------
+    def delete_device(self):
+        with self.streamLock:
+            self.info_stream(''.join(("[Device delete_device method] for device", self.get_name())))
+        self.stopThread()
+
+
+#------------------------------------------------------------------
+#     Device initialization
+#------------------------------------------------------------------
+    def init_device(self):
+
+        # Try stopping the stateThread if it was started before. Will fail if this
+        # is the initial start.
+        try:
+            self.stopThread()
+        except Exception, e:
+            pass
+
+        self.streamLock = threading.Lock()
+        with self.streamLock:
+            self.info_stream(''.join(("In ", self.get_name(), "::init_device()")))
+        self.set_state(PyTango.DevState.UNKNOWN)
+        self.get_device_properties(self.get_device_class())
+        self.trace = zt.TraceBuffer(self.TraceCapacity)
+
+        self.stateThread = threading.Thread()
+        threading.Thread.__init__(self.stateThread, target=self.stateHandlerDispatcher)
+
+        self.commandQueue = zst.ZaberCommandQueue(100)
+        # Device numbers of the axes on the chain, sorted
+        self.motors = []
+        # dict of device number: MotorData snapshot of the axis. The dict is
+        # replaced as a whole by updateAxes, never changed.
+        self.axisData = {}
+        # Names of the dynamic attributes added so far
+        self.axisAttributes = set()
+        # dict of device number: ZaberMoveRequest of the move in progress
+        self.moveRequests = {}
+        # ZaberBroadcastMoveRequest of the chain-wide homing in progress, None
+        # when there is none
+        self.groupMove = None
+
+        self.stateHandlerDict = {PyTango.DevState.ON: self.onHandler,
+                                PyTango.DevState.MOVING: self.onHandler,
+                                PyTango.DevState.ALARM: self.onHandler,
+                                PyTango.DevState.FAULT: self.faultHandler,
+                                PyTango.DevState.INIT: self.initHandler,
+                                PyTango.DevState.UNKNOWN: self.unknownHandler}
+
+        self.stopStateThreadFlag = False
+
+        self.stateThread.start()
+
+
+    def stateHandlerDispatcher(self):
+        """Handles switch of states in the state machine thread.
+        Each state handled method should exit by setting the next state,
+        going back to this method. The previous state is also included when
+        calling the next state handler method.
+        The thread is stopped by setting the stopStateThreadFlag.
+        """
+        prevState = self.get_state()
+        while self.stopStateThreadFlag == False:
+            try:
+                self.stateHandlerDict[self.get_state()](prevState)
+                prevState = self.get_state()
+            except KeyError:
+                self.stateHandlerDict[PyTango.DevState.UNKNOWN](prevState)
+                prevState = self.get_state()
+
+    def stopThread(self):
+        """Stops the state handler thread by setting the stopStateThreadFlag
+        """
+        self.stopStateThreadFlag = True
+        self.stateThread.join(3)
+        try:
+            self.device.close()
+        except Exception:
+            pass
+
+
+    def unknownHandler(self, prevState):
+        """Handles the UNKNOWN state, before communication with the hardware devices
+        has been established.
+        """
+        with self.streamLock:
+            self.info_stream('Entering unknownHandler')
+        connectionTimeout = 1.0
+        self.set_status('Connecting to motor controller')
+
+        while self.stopStateThreadFlag == False:
+            try:
+                self.device.close()
+            except Exception:
+                pass
+            try:
+                self.device = zc.ZaberControl(self.Port, self.Protocol.lower())
+                if self.SettingsMaxAge > 0:
+                    self.device.settingsMaxAge = self.SettingsMaxAge
+                self.device.connect(self.Port)
+            except Exception, e:
+                self.error_stream(''.join(('Error creating ZaberControl object: ', str(e))))
+                self.device = None
+                time.sleep(connectionTimeout)
+                continue
+
+            self.set_state(PyTango.DevState.INIT)
+            break
+
+    def initHandler(self, prevState):
+        """Handles the INIT state. Finds the axes on the chain, from the Motors
+        property or by a broadcast position read if it is empty, and reads the
+        initial parameters of each axis with one pipelined write. Then adds the
+        dynamic attributes of the axes.
+        """
+        with self.streamLock:
+            self.info_stream('Entering initHandler')
+        waitTime = 1.0
+        self.set_status('Initializing chain')
+        retries = 0
+        maxTries = 5
+
+        items = ['deviceId', 'microstepResolution', 'position', 'targetSpeed', 'acceleration',
+                 'runningCurrent', 'holdCurrent', 'status']
+
+        while self.stopStateThreadFlag == False:
+            retries += 1
+            if retries > maxTries:
+                self.set_state(PyTango.DevState.UNKNOWN)
+                break
+            try:
+                with self.streamLock:
+                    self.info_stream('Trying to connect...')
+                if list(self.Motors).__len__() > 0:
+                    motors = sorted([int(m) for m in self.Motors])
+                else:
+                    motors = sorted(self.device.getAllPositions().keys())
+                if motors.__len__() == 0:
+                    with self.streamLock:
+                        self.error_stream('No axes found on the chain')
+                    self.checkCommands(blockTime=waitTime)
+                    continue
+                axisData = {}
+                for i, motor in enumerate(motors):
+                    data = self.device.readDevice(items, motor)
+                    missing = [name for name in items if name not in data]
+                    if missing.__len__() > 0:
+                        raise ValueError(''.join(('No reply from axis ', str(motor), ' when initializing ',
+                                                  ', '.join(missing))))
+                    old = self.axisData.get(motor, zst.MotorData())
+                    md = zst.MotorData()
+                    cal = self.stepPerUnit(i)
+                    res = data['microstepResolution']
+                    md.stepPerUnit = [cal]
+                    md.deviceId = [data['deviceId']]
+                    md.microstepResolution = [res]
+                    md.position = [np.double(data['position'])/cal/res]
+                    md.speed = [np.double(data['targetSpeed'])/res]
+                    md.acceleration = [np.double(data['acceleration'])/res]
+                    # Converted by ZaberControl, from the settings cache
+                    md.runningCurrent = [self.device.getRunningCurrent(motor)*100]
+                    md.holdCurrent = [self.device.getHoldCurrent(motor)*100]
+                    md.status = [zc.decodeStatus(data['status'])]
+                    md.homed = old.homed
+                    axisData[motor] = md
+                self.motors = motors
+                self.axisData = axisData
+                self.addAxisAttributes(motors)
+                with self.streamLock:
+                    self.info_stream(''.join(('Axes: ', str(motors))))
+
+            except Exception, e:
+                with self.streamLock:
+                    self.error_stream(''.join(('Error when initializing chain')))
+                    self.error_stream(str(e))
+                self.checkCommands(blockTime=waitTime)
+                continue
+
+            self.set_state(PyTango.DevState.ON)
+            break
+
+    def onHandler(self, prevState):
+        """Handles the ON state. Connected to the Zaber controller COM port.
+        Waits in a loop checking commands.
+        """
+        with self.streamLock:
+            self.info_stream('Entering onHandler')
+        handledStates = [PyTango.DevState.ON, PyTango.DevState.ALARM, PyTango.DevState.MOVING]
+
+        # The position and status of all axes are read together with one
+        # pipelined write, fast while an axis is moving. The microstep
+        # resolution, speed, acceleration and currents are checked at their
+        # own slow period, like in ZaberMotorDS.
+        scheduler = zst.PollScheduler({'readAxes': (self.MovingPollPeriod, self.IdlePollPeriod),
+                                      'readSettings': (self.SettingsPollPeriod, self.SettingsPollPeriod)})
+        # The settings were just read by initHandler
+        scheduler.stagger(['readSettings'], time.time())
+        # Longest time between checks of the state
+        maxWaitTime = 1.0
+        self.set_status('On')
+
+        while self.stopStateThreadFlag == False:
+            state = self.get_state()
+            if state not in handledStates:
+                break
+            waitTime = 0
+            if self.commandQueue.empty() == True:
+                try:
+                    moving = state == PyTango.DevState.MOVING
+                    t = time.time()
+                    # A poll is a position and a status read of every axis
+                    minInterval = 2*self.motors.__len__()*self.device.pollInterval()
+                    cmdName, waitTime = scheduler.nextCommand(moving, t, minInterval)
+                    if cmdName != None:
+                        scheduler.polled(cmdName, t, moving)
+                        self.trace.record(zt.TRACE_IO, 'poll', cmdName)
+                        self.commandQueue.put(zst.ZaberCommand(cmdName))
+                except Exception, e:
+                    with self.streamLock:
+                        self.error_stream(''.join(('Error reading zaber: ', str(e))))
+                    self.set_state(PyTango.DevState.FAULT)
+                    break
+
+            self.checkCommands(blockTime=min(waitTime, maxWaitTime))
+            if self.get_state() in handledStates:
+                # Not after a fault, which is left for faultHandler
+                try:
+                    self.adjust_State()
+                except Exception, e:
+                    with self.streamLock:
+                        self.error_stream(''.join(('Error adjusting state: ', str(e))))
+                    self.set_state(PyTango.DevState.FAULT)
+                    break
+
+
+    def faultHandler(self, prevState):
+        """Handles the FAULT state. A problem has been detected.
+        Recovery is tried in steps like in ZaberMotorDS: resync the reply
+        framing on the open port and probe the axes, then close and reopen the
+        port and probe again, and last go to UNKNOWN.
+        """
+        with self.streamLock:
+            self.info_stream('Entering faultHandler from')
+            self.info_stream(str(prevState))
+        handledStates = [PyTango.DevState.FAULT]
+        waitTime = 0.1
+        retries = 0
+        maxTries = 5
+        # Probes on the open port before reopening it
+        warmTries = 2
+
+        s = ''.join(('Fault condition. Processing...\n'))
+        t0 = time.time()
+
+        self.set_status(''.join((s, 'Resynchronizing')))
+        for i in range(warmTries):
+            if self.stopStateThreadFlag == True or self.get_state() not in handledStates:
+                return
+            try:
+                if self.device.resync() == False:
+                    # Not open, reopen it
+                    break
+                if self.probeAxes() == True:
+                    with self.streamLock:
+                        self.info_stream(''.join(('Fault condition cleared by resync after ', str(time.time() - t0), ' s')))
+                    self.set_state(PyTango.DevState.ON)
+                    return
+            except Exception, e:
+                with self.streamLock:
+                    self.error_stream(''.join(('Resync...', str(e))))
+
+        while self.stopStateThreadFlag == False:
+            if self.get_state() not in handledStates:
+                break
+            retries += 1
+            try:
+                with self.streamLock:
+                    self.info_stream('Reconnecting to device...')
+                self.device.close()
+                self.device.connect(self.Port)
+                if self.probeAxes() == True:
+                    with self.streamLock:
+                        self.info_stream('Fault condition cleared, going back')
+                    self.set_state(PyTango.DevState.ON)
+                    break
+                self.set_status(''.join((s, 'Error receiving response')))
+            except Exception, e:
+                with self.streamLock:
+                    self.error_stream(''.join(('Reconnect...', str(e))))
+                self.set_status(''.join((s, 'Error connecting')))
+            if retries >= maxTries or time.time() - t0 > 10:
+                with self.streamLock:
+                    self.info_stream('Cannot clear fault, going to UNKNOWN state')
+                self.set_state(PyTango.DevState.UNKNOWN)
+                break
+            time.sleep(waitTime)
+
+
+    def checkCommands(self, blockTime=0):
+        """Checks the commandQueue for new commands. Must be called regularly.
+        If the queue is empty the method exits immediately.
+        """
+        try:
+            if blockTime == 0:
+                cmd = self.commandQueue.get(block=False)
+            else:
+                cmd = self.commandQueue.get(block=True, timeout=blockTime)
+            self.trace.record(zt.TRACE_IO, cmd.command, cmd.data)
+            # The serial I/O is done without locks. The results are published
+            # as new axis snapshots with updateAxes.
+            if cmd.command.startswith('writePosition_') == True:
+                motor = int(cmd.command.rsplit('_', 1)[1])
+                md = self.axisData[motor]
+                data = np.int(np.double(cmd.data*md.stepPerUnit[0])*md.microstepResolution[0])
+                self.trackMove(motor, self.device.startPositionAbsolute(data, motor))
+                self.updateAxes({motor: {'targetPosition': [cmd.data]}})
+                self.trace.record(zt.TRACE_EVENTS, 'startPositionAbsolute', (motor, data))
+
+            elif cmd.command == 'writePositions':
+                steps = {}
+                updates = {}
+                for motor, position in cmd.data.items():
+                    md = self.axisData[motor]
+                    steps[motor] = np.int(np.double(position*md.stepPerUnit[0])*md.microstepResolution[0])
+                    updates[motor] = {'targetPosition': [position]}
+                group = self.device.startMoveMulti(steps)
+                for req in group.requests:
+                    self.trackMove(req.cmd.motor, req)
+                self.updateAxes(updates)
+                self.trace.record(zt.TRACE_EVENTS, 'startMoveMulti', steps)
+
+            elif cmd.command == 'readAxes':
+                self.readAxes()
+
+            elif cmd.command == 'readSettings':
+                updates = {}
+                for motor in self.motors:
+                    # From the settings cache unless it is older than SettingsMaxAge
+                    res = self.device.getMicrostepResolution(motor)
+                    if res == None:
+                        continue
+                    update = {'microstepResolution': [res]}
+                    speed = self.device.getTargetSpeed(motor)
+                    if speed != None:
+                        update['speed'] = [np.double(speed)/res]
+                    acceleration = self.device.getAcceleration(motor)
+                    if acceleration != None:
+                        update['acceleration'] = [np.double(acceleration)/res]
+                    current = self.device.getRunningCurrent(motor)
+                    if current != None:
+                        update['runningCurrent'] = [current*100]
+                    current = self.device.getHoldCurrent(motor)
+                    if current != None:
+                        update['holdCurrent'] = [current*100]
+                    updates[motor] = update
+                self.updateAxes(updates)
+
+            elif cmd.command == 'stop':
+                if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
+                    self.device.stop(cmd.data)
+
+            elif cmd.command == 'home':
+                if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
+                    self.trackMove(cmd.data, self.device.startHome(cmd.data))
+                    self.updateAxes({cmd.data: {'targetPosition': [0.0]}})
+
+            elif cmd.command == 'homeAll':
+                if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
+                    group = self.device.startHomeAll(self.motors)
+                    self.groupMove = group
+                    self.updateAxes(dict([(motor, {'targetPosition': [0.0]}) for motor in self.motors]))
+                    self.set_state(PyTango.DevState.MOVING)
+                    self.set_status('Homing all axes')
+                    group.addDoneCallback(self.groupMoveDoneCallback)
+
+            elif cmd.command == 'moveDone':
+                req = cmd.data
+                motor = req.cmd.motor
+                # Ignore moves that were superseded by a newer one
+                if self.moveRequests.get(motor) is req:
+                    del self.moveRequests[motor]
+                    reply = self.device.checkReply(req.reply)
+                    if reply != None:
+                        md = self.axisData[motor]
+                        homed = md.homed[0] or (req.cmd.command == 1 and req.interrupted == False)
+                        self.updateAxes({motor: {'position': [np.double(reply.data)/md.stepPerUnit[0]/md.microstepResolution[0]],
+                                                 'status': [(0, 'idle')], 'homed': [homed]}})
+
+            elif cmd.command == 'groupMoveDone':
+                if cmd.data is self.groupMove:
+                    self.groupMove = None
+                    updates = {}
+                    # The group is a home all. Axes stopped before reaching home keep their homed flag.
+                    completed = cmd.data.completed()
+                    for motor, pos in cmd.data.positions().items():
+                        md = self.axisData.get(motor)
+                        if pos != None and md != None:
+                            updates[motor] = {'position': [np.double(pos)/md.stepPerUnit[0]/md.microstepResolution[0]],
+                                              'status': [(0, 'idle')], 'homed': [md.homed[0] or motor in completed]}
+                    self.updateAxes(updates)
+
+            elif cmd.command == 'init':
+                if self.get_state() not in [PyTango.DevState.UNKNOWN]:
+                    self.set_state(PyTango.DevState.UNKNOWN)
+
+        except Queue.Empty:
+            self.trace.record(zt.TRACE_DEBUG, 'queue empty')
+
+        except Exception, e:
+            with self.streamLock:
+                self.error_stream(''.join(('Error in checkCommands: ', str(e))))
+            self.set_state(PyTango.DevState.FAULT)
+
+
+    def readAxes(self):
+        '''
+        Reads the position and status of every axis with one pipelined write
+        and publishes them. Axes that do not answer get status unknown.
+        Raises ValueError if no axis answered.
+        '''
+        motors = self.motors
+        cmdList = []
+        for motor in motors:
+            cmdList.append(zc.queryCommand(60, 0, motor))
+            cmdList.append(zc.queryCommand(54, 0, motor))
+        replies = self.device.sendReceivePipelined(cmdList)
+        updates = {}
+        answered = 0
+        for i, motor in enumerate(motors):
+            posRep = replies[2*i]
+            statRep = replies[2*i + 1]
+            kwargs = {'status': [(None, None)]}
+            if isinstance(statRep, zc.MotorCommand) == True:
+                kwargs['status'] = [zc.decodeStatus(statRep.data)]
+                answered += 1
+            if isinstance(posRep, zc.MotorCommand) == True:
+                md = self.axisData[motor]
+                kwargs['position'] = [np.double(posRep.data)/md.stepPerUnit[0]/md.microstepResolution[0]]
+                answered += 1
+            updates[motor] = kwargs
+        self.updateAxes(updates)
+        if answered == 0 and motors.__len__() > 0:
+            raise ValueError('No reply from any axis')
+
+    def probeAxes(self):
+        '''
+        Reads the status of all axes as a check of the link. Returns True if
+        any axis answered.
+        '''
+        try:
+            self.readAxes()
+        except ValueError:
+            return False
+        return True
+
+    def updateAxes(self, updates):
+        '''
+        Publishes new snapshots of the axes in updates, a dict of device
+        number: dict of the fields to replace. Only the state thread
+        publishes, and the axisData dict is replaced as a whole, so the
+        aggregate attributes always read the axes of one generation.
+        '''
+        if updates.__len__() == 0:
+            return
+        axisData = dict(self.axisData)
+        for motor, kwargs in updates.items():
+            md = axisData.get(motor)
+            if md != None:
+                axisData[motor] = md.replace(**kwargs)
+        self.axisData = axisData
+
+    def stepPerUnit(self, index):
+        '''
+        Calibration of the index:th axis from the StepPerUnit property, which
+        has one value per axis or one for all.
+        '''
+        cal = list(self.StepPerUnit)
+        if cal.__len__() == 0:
+            return 1.0
+        if cal.__len__() == 1:
+            return cal[0]
+        if index < cal.__len__():
+            return cal[index]
+        return 1.0
+
+    def trackMove(self, motor, moveRequest):
+        '''
+        Tracks a move started on axis motor. The axis is MOVING until the
+        completion reply of moveRequest arrives.
+        '''
+        self.moveRequests[motor] = moveRequest
+        self.set_state(PyTango.DevState.MOVING)
+        moveRequest.addDoneCallback(self.moveDoneCallback)
+
+    def moveDoneCallback(self, moveRequest):
+        '''
+        Called from the port reader thread when a move is completed. Hands the
+        request over to the state thread through the command queue.
+        '''
+        try:
+            self.commandQueue.put(zst.ZaberCommand('moveDone', moveRequest), block=False)
+        except Queue.Full:
+            # The status polling will notice the move is done
+            self.moveRequests.pop(moveRequest.cmd.motor, None)
+
+    def groupMoveDoneCallback(self, group):
+        '''
+        Called from the port reader thread when all axes of a chain-wide
+        homing are done.
+        '''
+        try:
+            self.commandQueue.put(zst.ZaberCommand('groupMoveDone', group), block=False)
+        except Queue.Full:
+            self.groupMove = None
+
+    def axisState(self, motor):
+        '''
+        Returns the state of axis motor: the device state if it is not
+        connected, MOVING while a move on it is tracked or the status says so,
+        ON if idle, UNKNOWN if the axis did not answer.
+        '''
+        state = self.get_state()
+        if state in [PyTango.DevState.UNKNOWN, PyTango.DevState.INIT, PyTango.DevState.FAULT]:
+            return state
+        md = self.axisData.get(motor)
+        if md == None:
+            return PyTango.DevState.UNKNOWN
+        group = self.groupMove
+        if motor in self.moveRequests or (group != None and motor in group.motors):
+            return PyTango.DevState.MOVING
+        status = md.status[0]
+        if status == None or status[0] == None:
+            return PyTango.DevState.UNKNOWN
+        if status[0] == 0:
+            return PyTango.DevState.ON
+        return PyTango.DevState.MOVING
+
+    def adjust_State(self):
+        '''
+        Updates the state from the states of the axes: MOVING if any axis is
+        moving, ALARM if any axis did not answer, else ON.
+        '''
+        states = [(motor, self.axisState(motor)) for motor in self.motors]
+        moving = [str(motor) for motor, state in states if state == PyTango.DevState.MOVING]
+        lost = [str(motor) for motor, state in states if state == PyTango.DevState.UNKNOWN]
+        if moving.__len__() > 0:
+            self.set_state(PyTango.DevState.MOVING)
+            self.set_status(''.join(('Moving axes ', ', '.join(moving))))
+        elif lost.__len__() > 0:
+            self.set_state(PyTango.DevState.ALARM)
+            self.set_status(''.join(('No reply from axes ', ', '.join(lost))))
+        else:
+            self.set_state(PyTango.DevState.ON)
+            self.set_status('Idle')
+
+    def addAxisAttributes(self, motors):
+        '''
+        Adds the dynamic attributes of the axes in motors that do not have
+        them yet.
+        '''
+        for motor in motors:
+            n = str(motor)
+            attrs = [(PyTango.Attr(''.join(('Position_', n)), PyTango.DevDouble, PyTango.READ_WRITE),
+                      self.read_Position_n, self.write_Position_n),
+                     (PyTango.Attr(''.join(('State_', n)), PyTango.DevState, PyTango.READ),
+                      self.read_State_n, None),
+                     (PyTango.Attr(''.join(('Status_', n)), PyTango.DevString, PyTango.READ),
+                      self.read_Status_n, None),
+                     (PyTango.Attr(''.join(('Homed_', n)), PyTango.DevBoolean, PyTango.READ),
+                      self.read_Homed_n, None)]
+            for attr, readMethod, writeMethod in attrs:
+                name = attr.get_name()
+                if name in self.axisAttributes:
+                    continue
+                self.add_attribute(attr, readMethod, writeMethod, self.is_Axis_allowed)
+                self.axisAttributes.add(name)
+
+    def axisOf(self, attr):
+        '''
+        Device number of the axis of the dynamic attribute attr.
+        '''
+        return int(attr.get_name().rsplit('_', 1)[1])
+
+
+#------------------------------------------------------------------
+#     Always excuted hook method
+#------------------------------------------------------------------
+    def always_executed_hook(self):
+        pass
+
+#==================================================================
+#
+#     ZaberChainDS read/write attribute methods
+#
+#==================================================================
+
+#------------------------------------------------------------------
+#     Read Position_<n> attribute
+#------------------------------------------------------------------
+    def read_Position_n(self, attr):
+        md = self.axisData.get(self.axisOf(attr))
+        if md == None or md.position[0] == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0.0)
+            return
+        attr.set_value(md.position[0])
+
+#------------------------------------------------------------------
+#     Write Position_<n> attribute
+#------------------------------------------------------------------
+    def write_Position_n(self, attr):
+        data = attr.get_write_value()
+        motor = self.axisOf(attr)
+        self.trace.record(zt.TRACE_EVENTS, 'write_Position', (motor, data))
+        # One queued write per axis, a newer write to the axis replaces it
+        self.commandQueue.put(zst.ZaberCommand(''.join(('writePosition_', str(motor))), data))
+
+#------------------------------------------------------------------
+#     Read State_<n>, Status_<n> and Homed_<n> attributes
+#------------------------------------------------------------------
+    def read_State_n(self, attr):
+        attr.set_value(self.axisState(self.axisOf(attr)))
+
+    def read_Status_n(self, attr):
+        md = self.axisData.get(self.axisOf(attr))
+        if md == None or md.status[0] == None or md.status[0][0] == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value('unknown')
+            return
+        attr.set_value(md.status[0][1])
+
+    def read_Homed_n(self, attr):
+        md = self.axisData.get(self.axisOf(attr))
+        if md == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(False)
+            return
+        attr.set_value(bool(md.homed[0]))
+
+#---- Axis attributes State Machine -----------------
+    def is_Axis_allowed(self, req_type):
+        if self.get_state() in [PyTango.DevState.FAULT,
+                                PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     Read Motors attribute
+#------------------------------------------------------------------
+    def read_Motors(self, attr):
+        attr.set_value(self.motors)
+
+#------------------------------------------------------------------
+#     Read/Write Positions attribute
+#------------------------------------------------------------------
+    def read_Positions(self, attr):
+        axisData = self.axisData
+        positions = []
+        for motor in self.motors:
+            md = axisData.get(motor)
+            if md == None or md.position[0] == None:
+                positions.append(np.nan)
+            else:
+                positions.append(md.position[0])
+        attr.set_value(positions)
+
+    def write_Positions(self, attr):
+        data = attr.get_write_value()
+        self.trace.record(zt.TRACE_EVENTS, 'write_Positions', data)
+        motors = self.motors
+        if data.__len__() != motors.__len__():
+            PyTango.Except.throw_exception('Invalid move', 'Give one position per axis in Motors', 'write_Positions')
+        # NaN leaves the axis where it is
+        positions = dict([(motor, pos) for motor, pos in zip(motors, data) if np.isnan(pos) == False])
+        if positions.__len__() > 0:
+            self.commandQueue.put(zst.ZaberCommand('writePositions', positions))
+
+#---- Positions attribute State Machine -----------------
+    def is_Positions_allowed(self, req_type):
+        if self.get_state() in [PyTango.DevState.FAULT,
+                                PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     Read TargetPositions attribute
+#------------------------------------------------------------------
+    def read_TargetPositions(self, attr):
+        axisData = self.axisData
+        positions = []
+        for motor in self.motors:
+            md = axisData.get(motor)
+            if md == None or md.targetPosition[0] == None:
+                positions.append(np.nan)
+            else:
+                positions.append(md.targetPosition[0])
+        attr.set_value(positions)
+
+#------------------------------------------------------------------
+#     Read Speeds, Accelerations, RunningCurrents and HoldCurrents attributes
+#------------------------------------------------------------------
+    def axisValues(self, field):
+        '''
+        Returns the value of the MotorData field of each axis in Motors, NaN
+        if unknown.
+        '''
+        axisData = self.axisData
+        values = []
+        for motor in self.motors:
+            md = axisData.get(motor)
+            if md == None or getattr(md, field)[0] == None:
+                values.append(np.nan)
+            else:
+                values.append(getattr(md, field)[0])
+        return values
+
+    def read_Speeds(self, attr):
+        attr.set_value(self.axisValues('speed'))
+
+    def read_Accelerations(self, attr):
+        attr.set_value(self.axisValues('acceleration'))
+
+    def read_RunningCurrents(self, attr):
+        attr.set_value(self.axisValues('runningCurrent'))
+
+    def read_HoldCurrents(self, attr):
+        attr.set_value(self.axisValues('holdCurrent'))
+
+#------------------------------------------------------------------
+#     Read States attribute
+#------------------------------------------------------------------
+    def read_States(self, attr):
+        attr.set_value([str(self.axisState(motor)) for motor in self.motors])
+
+#------------------------------------------------------------------
+#     Read TraceLevel attribute
+#------------------------------------------------------------------
+    def read_TraceLevel(self, attr):
+        attr.set_value(self.trace.level)
+
+#------------------------------------------------------------------
+#     Write TraceLevel attribute
+#------------------------------------------------------------------
+    def write_TraceLevel(self, attr):
+        self.trace.level = attr.get_write_value()
+
+#------------------------------------------------------------------
+#     Read Trace attribute
+#------------------------------------------------------------------
+    def read_Trace(self, attr):
+        attr.set_value(self.trace.lines(4096))
+
+#==================================================================
+#
+#     ZaberChainDS command methods
+#
+#==================================================================
+
+#------------------------------------------------------------------
+#     Stop command:
+#
+#     Description: Stops all axes of the chain with one broadcast frame
+#------------------------------------------------------------------
+    def Stop(self):
+        self.trace.record(zt.TRACE_EVENTS, 'Stop')
+        # Stop goes straight to the wire instead of waiting for the queue.
+        # Queued moves are dropped.
+        try:
+            self.device.stopNow(0)
+        except Exception:
+            self.commandQueue.put(zst.ZaberCommand('stop', 0))
+        self.commandQueue.purge(['writePositions', 'home', 'homeAll'] +
+                                [''.join(('writePosition_', str(motor))) for motor in self.motors])
+
+#---- Stop command State Machine -----------------
+    def is_Stop_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     StopAxis command:
+#
+#     Description: Stops one axis, given by device number
+#------------------------------------------------------------------
+    def StopAxis(self, argin):
+        self.trace.record(zt.TRACE_EVENTS, 'StopAxis', argin)
+        try:
+            self.device.stopNow(argin)
+        except Exception:
+            self.commandQueue.put(zst.ZaberCommand('stop', argin))
+        self.commandQueue.purge([''.join(('writePosition_', str(argin)))])
+
+#---- StopAxis command State Machine -----------------
+    def is_StopAxis_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     Home command:
+#
+#     Description: Homes all axes of the chain with one broadcast frame
+#------------------------------------------------------------------
+    def Home(self):
+        self.trace.record(zt.TRACE_EVENTS, 'Home')
+        self.commandQueue.put(zst.ZaberCommand('homeAll'))
+
+#---- Home command State Machine -----------------
+    def is_Home_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.FAULT,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     HomeAxis command:
+#
+#     Description: Homes one axis, given by device number
+#------------------------------------------------------------------
+    def HomeAxis(self, argin):
+        self.trace.record(zt.TRACE_EVENTS, 'HomeAxis', argin)
+        if argin not in self.motors:
+            PyTango.Except.throw_exception('Invalid axis', ''.join(('No axis ', str(argin), ' on the chain')), 'HomeAxis')
+        self.commandQueue.put(zst.ZaberCommand('home', argin))
+
+#---- HomeAxis command State Machine -----------------
+    def is_HomeAxis_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.FAULT,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     DumpTrace command:
+#
+#     Description: Writes the trace ring buffer to a text file
+#------------------------------------------------------------------
+    def DumpTrace(self, filename):
+        self.trace.dump(filename)
+
+
+#==================================================================
+#
+#     ZaberChainDSClass class definition
+#
+#==================================================================
+class ZaberChainDSClass(PyTango.DeviceClass):
+
+    #     Class Properties
+    class_property_list = {
+        }
+
+
+    #     Device Properties
+    device_property_list = {
+        'Port':
+            [PyTango.DevString,
+            "Serial port that the motor controller chain is connected to. Devices with the same Port share one serial handle.",
+            [ "COM0" ] ],
+        'Protocol':
+            [PyTango.DevString,
+            "Zaber protocol: binary (9600 baud) or ascii (115200 baud).",
+            [ "binary" ] ],
+        'Motors':
+            [PyTango.DevVarLongArray,
+            "Device numbers of the axes to control. Empty to control every device that answers on the chain.",
+            [ ] ],
+        'StepPerUnit':
+            [PyTango.DevVarDoubleArray,
+            "Steps per position unit of each axis, in the order of increasing device number, or one value for all axes.",
+            [ 1.0 ] ],
+        'MovingPollPeriod':
+            [PyTango.DevDouble,
+            "Position and status poll period in s while an axis is moving.",
+            [ 0.1 ] ],
+        'IdlePollPeriod':
+            [PyTango.DevDouble,
+            "Longest position and status poll period in s when idle. The period backs off to this after a move.",
+            [ 2.0 ] ],
+        'SettingsPollPeriod':
+            [PyTango.DevDouble,
+            "Poll period in s of the microstep resolution, speed, acceleration and currents of the axes. 0 disables polling.",
+            [ 30.0 ] ],
+        'SettingsMaxAge':
+            [PyTango.DevDouble,
+            "Time in s a setting is served from the settings cache before it is read from the device again. 0 keeps it until it is written, the device is reset or the port is reconnected.",
+            [ 300.0 ] ],
+        'TraceCapacity':
+            [PyTango.DevLong,
+            "Number of events kept in the trace ring buffer.",
+            [ 4096 ] ],
+        }
+
+
+    #     Command definitions
+    cmd_list = {
+        'Stop':
+            [[PyTango.DevVoid, ""],
+            [PyTango.DevVoid, ""]],
+        'StopAxis':
+            [[PyTango.DevLong, "Device number of the axis"],
+            [PyTango.DevVoid, ""]],
+        'Home':
+            [[PyTango.DevVoid, ""],
+            [PyTango.DevVoid, ""]],
+        'HomeAxis':
+            [[PyTango.DevLong, "Device number of the axis"],
+            [PyTango.DevVoid, ""]],
+        'DumpTrace':
+            [[PyTango.DevString, "file name"],
+            [PyTango.DevVoid, ""]],
+        }
+
+
+    #     Attribute definitions. Position_<n>, State_<n>, Status_<n> and
+    #     Homed_<n> are added for each axis when the chain is initialized.
+    attr_list = {
+        'Motors':
+            [[PyTango.DevLong,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'description':"Device numbers of the axes, in the order of the other spectrum attributes",
+            } ],
+        'Positions':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ_WRITE, 256],
+            {
+                'description':"Position of each axis in Motors, NaN if unknown. Writing moves the axes with minimum skew, NaN leaves an axis where it is.",
+            } ],
+        'TargetPositions':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'description':"Target position of the last move of each axis in Motors, NaN if none",
+            } ],
+        'Speeds':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'unit':"steps/s",
+                'description':"Target speed of each axis in Motors, NaN if unknown",
+            } ],
+        'Accelerations':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'unit':"steps/s^2",
+                'description':"Acceleration of each axis in Motors, NaN if unknown",
+            } ],
+        'RunningCurrents':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'unit':"%",
+                'description':"Running current of each axis in Motors, NaN if unknown",
+            } ],
+        'HoldCurrents':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'unit':"%",
+                'description':"Hold current of each axis in Motors, NaN if unknown",
+            } ],
+        'States':
+            [[PyTango.DevString,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'description':"State of each axis in Motors",
+            } ],
+        'TraceLevel':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ_WRITE],
+            {
+                'description':"Trace level: 0 off, 1 commands and moves, 2 hardware I/O, 3 attribute reads",
+                'max value':3,
+                'min value':0,
+                'Memorized':"true",
+            } ],
+        'Trace':
+            [[PyTango.DevString,
+            PyTango.SPECTRUM,
+            PyTango.READ, 4096],
+            {
+                'description':"Last entries of the trace ring buffer, oldest first",
+            } ],
+        }
+
+
+#------------------------------------------------------------------
+#     ZaberChainDSClass Constructor
+#------------------------------------------------------------------
+    def __init__(self, name):
+        PyTango.DeviceClass.__init__(self, name)
+        self.set_type(name);
+        print "In ZaberChainDSClass  constructor"
+
+#==================================================================
+#
+#     ZaberChainDS class main method
+#
+#==================================================================
+if __name__ == '__main__':
+    try:
+        py = PyTango.Util(sys.argv)
+        py.add_TgClass(ZaberChainDSClass, ZaberChainDS, 'ZaberChainDS')
+
+        U = PyTango.Util.instance()
+        U.server_init()
+        U.server_run()
+
+    except PyTango.DevFailed, e:
+        print '-------> Received a DevFailed exception:', e
+    except Exception, e:
+        print '-------> An unforeseen exception occured....', e
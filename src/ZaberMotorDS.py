@@ -40,29 +40,16 @@ Created on 16 Dec 2015
 import PyTango
 import sys
 import zaber_control as zc
+import zaber_trace as zt
+import zaber_history as zh
+import zaber_identity as zi
+import zaber_snapshot as zs
+from zaber_state import ZaberCommand, ZaberCommandQueue, MotorData, ScanSequence, PollScheduler
 import threading
 import Queue
 import time
 import numpy as np
-
-class ZaberCommand:
-    def __init__(self, command, data=None):
-        self.command = command
-        self.data = data
-
-class MotorData():
-    def __init__(self):
-            self.position = [None]
-            self.speed = [None]
-            self.acceleration = [None]
-            self.runningCurrent = [None]
-            self.holdCurrent = [None]
-            self.microstepResolution = [None]
-            self.deviceId = [None]    
-            self.firmwareVersion = [None]
-            self.serial = [None]
-            self.status = [None,None]
-            self.stepPerUnit = [1.0]
+import collections
 
 #==================================================================
 #   ZaberMotorDS Class Description:
@@ -117,14 +104,51 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             self.info_stream(''.join(("In ", self.get_name(), "::init_device()")))
         self.set_state(PyTango.DevState.UNKNOWN)
         self.get_device_properties(self.get_device_class())
+        self.trace = zt.TraceBuffer(self.TraceCapacity)
+        if self.HistoryFile == '':
+            self.history = zh.PositionHistory(self.HistoryCapacity)
+        else:
+            self.history = zh.PositionHistory(self.HistoryCapacity, self.HistoryFile)
+        if self.IdentityCacheFile == '':
+            self.identityCache = None
+        else:
+            self.identityCache = zi.IdentityCache(self.IdentityCacheFile)
+        # Samples returned by the history attributes, selected once per read request
+        self.historySamples = self.history.last(0)
+        self.historyLength = 1000
+        self.historySince = 0.0
 
         
-        self.attrLock = threading.Lock()
         self.stateThread = threading.Thread()
         threading.Thread.__init__(self.stateThread, target=self.stateHandlerDispatcher)
 
-        self.commandQueue = Queue.Queue(100)
+        self.commandQueue = ZaberCommandQueue(100)
+        # Lateness in s of the last state loop wake-ups, for the LoopJitter attributes
+        self.loopLateness = collections.deque(maxlen=100)
         self.motorData = MotorData()
+        # The last known state is served from the snapshot until initHandler
+        # has verified it against the hardware
+        self.snapshot = None
+        if self.SnapshotFile != '':
+            try:
+                self.snapshot = zs.StateSnapshot(self.SnapshotFile)
+                self.restoreSnapshot()
+            except (IOError, OSError, ValueError), e:
+                with self.streamLock:
+                    self.error_stream(''.join(('Could not open the state snapshot: ', str(e))))
+                self.snapshot = None
+        # ZaberMoveRequest of the move in progress, None when no move is tracked
+        self.moveRequest = None
+        # ZaberMoveGroup or ZaberBroadcastMoveRequest of the multi-axis move
+        # in progress, None when there is none
+        self.groupMove = None
+        # True if groupMove is homing
+        self.groupHoming = False
+        # Final positions of the last multi-axis move: dict of device number: position
+        self.groupPositions = {}
+        # ScanSequence of the running or last scan
+        self.scan = None
+        self.scanDwell = [0.0]
 
         self.stateHandlerDict = {PyTango.DevState.ON: self.onHandler,
                                 PyTango.DevState.MOVING: self.onHandler,
@@ -166,6 +190,8 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             self.device.close()
         except Exception:
             pass
+        if getattr(self, 'snapshot', None) != None:
+            self.snapshot.flush()
 
 
     def unknownHandler(self, prevState):
@@ -183,7 +209,9 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             except Exception:
                 pass
             try:
-                self.device = zc.ZaberControl(self.Port)
+                self.device = zc.ZaberControl(self.Port, self.Protocol.lower())
+                if self.SettingsMaxAge > 0:
+                    self.device.settingsMaxAge = self.SettingsMaxAge
                 self.device.connect(self.Port)
             except Exception, e:
                 self.error_stream(''.join(('Error creating ZaberControl object: ', str(e))))
@@ -196,7 +224,9 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 
     def initHandler(self, prevState):
         """Handles the INIT state. Query zaber device to see if it is alive. 
-        Set initial parameters
+        Set initial parameters. All parameters are read with one pipelined
+        write, and only the ones that failed are read again. The device id
+        and firmware version are taken from the identity cache if it has them.
         """
         with self.streamLock:
             self.info_stream('Entering initHandler')
@@ -205,6 +235,18 @@ class ZaberMotorDS(PyTango.Device_4Impl):
         retries = 0
         maxTries = 5
 
+        items = ['microstepResolution', 'position', 'targetSpeed', 'acceleration',
+                 'holdCurrent', 'runningCurrent', 'status']
+        data = {}
+        identity = None
+        if self.identityCache != None:
+            identity = self.identityCache.get(self.Port, self.Motor)
+        if identity == None:
+            items = ['deviceId', 'firmwareVersion'] + items
+        else:
+            data['deviceId'], data['firmwareVersion'] = identity
+        missing = items
+
         while self.stopStateThreadFlag == False:
             retries += 1
             if retries > maxTries:
@@ -213,27 +255,53 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             try:
                 with self.streamLock:
                     self.info_stream('Trying to connect...')     
-                # Initial read of all parameters               
-                self.motorData.deviceId = [self.device.getDeviceId(self.Motor)]
-                self.motorData.firmwareVersion = [self.device.getFirmwareVersion(self.Motor)/100.0]
-                self.motorData.microstepResolution = [self.device.getMicrostepResolution(self.Motor)]
-                self.motorData.position = [self.device.getPosition(self.Motor)/self.motorData.microstepResolution[0]]
-                self.motorData.speed = [self.device.getTargetSpeed(self.Motor)/self.motorData.microstepResolution[0]]
-                self.motorData.acceleration = [self.device.getAcceleration(self.Motor)/self.motorData.microstepResolution[0]]
-                self.motorData.holdCurrent = [self.device.getHoldCurrent(self.Motor)*100]
-                self.motorData.runningCurrent = [self.device.getRunningCurrent(self.Motor)*100]
-                self.motorData.status = [self.device.getStatus(self.Motor)]
-                
+                data.update(self.device.readDevice(missing, self.Motor))
+                missing = [name for name in items if name not in data]
+                if missing.__len__() > 0:
+                    with self.streamLock:
+                        self.error_stream(''.join(('No reply when initializing ', ', '.join(missing))))
+                    self.checkCommands(blockTime=waitTime)
+                    continue
+                # Initial read of all parameters, published as one snapshot
+                md = MotorData()
                 attrs = self.get_device_attr()
                 cal = attrs.get_w_attr_by_name('Step_per_unit').get_write_value()
-                self.motorData.stepPerUnit = [cal]
+                md.stepPerUnit = [cal]
+                res = data['microstepResolution']
+                md.deviceId = [data['deviceId']]
+                md.firmwareVersion = [data['firmwareVersion']/100.0]
+                md.microstepResolution = [res]
+                md.position = [np.double(data['position'])/cal/res]
+                md.speed = [np.double(data['targetSpeed'])/res]
+                md.acceleration = [np.double(data['acceleration'])/res]
+                # The currents are converted by the getters, from the settings cache
+                md.holdCurrent = [self.device.getHoldCurrent(self.Motor)*100]
+                md.runningCurrent = [self.device.getRunningCurrent(self.Motor)*100]
+                md.status = [zc.decodeStatus(data['status'])]
+                if identity == None and self.identityCache != None:
+                    try:
+                        self.identityCache.put(self.Port, self.Motor, data['deviceId'], data['firmwareVersion'])
+                    except (IOError, OSError), e:
+                        with self.streamLock:
+                            self.warn_stream(''.join(('Could not write the identity cache: ', str(e))))
+                restored = self.motorData
+                if restored.restored == True:
+                    # The homed flag holds if the hardware is where it was left
+                    md.homed = [restored.homed[0] and self.snapshotMatches(restored, md)]
+                    if md.homed[0] == False and restored.homed[0] == True:
+                        with self.streamLock:
+                            self.warn_stream('Position differs from the restored state, homing needed')
+                else:
+                    md.homed = restored.homed
+                self.motorData = md
+                self.saveSnapshot()
                 
                 with self.streamLock:
-                    self.info_stream(''.join(('Position: ', str(self.motorData.position))))
-                    self.info_stream(''.join(('Firmware: ', str(self.motorData.firmwareVersion))))
-                    self.info_stream(''.join(('Device id: ', str(self.motorData.deviceId))))
-                    self.info_stream(''.join(('Running current: ', str(self.motorData.runningCurrent))))
-                    self.info_stream(''.join(('Hold current: ', str(self.motorData.holdCurrent))))
+                    self.info_stream(''.join(('Position: ', str(md.position))))
+                    self.info_stream(''.join(('Firmware: ', str(md.firmwareVersion))))
+                    self.info_stream(''.join(('Device id: ', str(md.deviceId))))
+                    self.info_stream(''.join(('Running current: ', str(md.runningCurrent))))
+                    self.info_stream(''.join(('Hold current: ', str(md.holdCurrent))))
 
             except Exception, e:
                 with self.streamLock:
@@ -253,41 +321,78 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             self.info_stream('Entering onHandler')
         handledStates = [PyTango.DevState.ON, PyTango.DevState.ALARM, PyTango.DevState.MOVING, PyTango.DevState.DISABLE, PyTango.DevState.STANDBY, PyTango.DevState.OFF]
         
-        # We will cycle through these commands, populating the motorData structure.
-        # The device is rather slow, so only one command at a time before checking 
-        # if something has happened
-        commandList = ['readPosition', 'readStatus']        
-        nextCommand = 0
-        waitTime = 0.2
+        # Polling populates the motorData structure. The device is rather slow,
+        # so only one command at a time before checking if something has happened.
+        # Position and status are polled fast while moving, the settings at their
+        # own slow period.
+        settingsCommands = ['readSpeed', 'readAcceleration', 'readMicrostepResolution', 'readRunningCurrent', 'readHoldCurrent']
+        periods = {'readPosition': (self.MovingPollPeriod, self.IdlePollPeriod),
+                   'readStatus': (self.MovingPollPeriod, self.IdlePollPeriod)}
+        for cmd in settingsCommands:
+            periods[cmd] = (self.SettingsPollPeriod, self.SettingsPollPeriod)
+        scheduler = PollScheduler(periods)
+        # The settings were just read by initHandler
+        scheduler.stagger(settingsCommands, time.time())
+        # Longest time between checks of the state
+        maxWaitTime = 1.0
+        # Time after the modelled arrival of a move that the completion reply
+        # is waited for before the status is polled
+        arrivalMargin = 0.5
         self.set_status('On')
 
         while self.stopStateThreadFlag == False:
 #            self.info_stream('onhandler loop')
-            with self.attrLock:
-                state = self.get_state()
+            state = self.get_state()
             if state not in handledStates:
                 break
             # Read laser parameters
-            with self.attrLock:
-                if self.commandQueue.empty() == True:
-                    try:
-                        cmdMsg = ZaberCommand(commandList[nextCommand])
-                        self.info_stream(''.join(('Issuing command ', commandList[nextCommand])))
-                        nextCommand = (nextCommand + 1) % commandList.__len__()
+            waitTime = 0
+            if self.commandQueue.empty() == True:
+                try:
+                    moving = state == PyTango.DevState.MOVING
+                    t = time.time()
+                    profile = self.motorData.profile
+                    skip = ()
+                    if self.moveRequest != None:
+                        # The end of the move is signalled by its reply, so the
+                        # status needs no polling until the expected arrival
+                        if profile == None or t < profile.tArrival + arrivalMargin:
+                            skip = ('readStatus',)
+                    cmdName, waitTime = scheduler.nextCommand(moving, t, self.device.pollInterval(), skip)
+                    if cmdName == None and skip != () and profile != None:
+                        # Wake up for the status check after the arrival
+                        waitTime = min(waitTime, max(0.0, profile.tArrival + arrivalMargin - t))
+                    scan = self.scan
+                    if scan != None and scan.running == True and scan.nextTime != None:
+                        # Dwelling at a scan point
+                        if t >= scan.nextTime:
+                            scan.nextTime = None
+                            self.commandQueue.put(ZaberCommand('scanStep'))
+                        else:
+                            waitTime = min(waitTime, scan.nextTime - t)
+                    if cmdName != None:
+                        scheduler.polled(cmdName, t, moving)
+                        cmdMsg = ZaberCommand(cmdName)
+                        self.trace.record(zt.TRACE_IO, 'poll', cmdName)
                         self.commandQueue.put(cmdMsg)
-                    except Exception, e:
-                        with self.streamLock:
-                            self.error_stream(''.join(('Error reading zaber: ', str(e))))
-                            self.set_state(PyTango.DevState.FAULT)
-                            print e
-                            break                
+                except Exception, e:
+                    with self.streamLock:
+                        self.error_stream(''.join(('Error reading zaber: ', str(e))))
+                        self.set_state(PyTango.DevState.FAULT)
+                        break                
                         
-            self.checkCommands(blockTime=waitTime)
-            self.adjust_State()
+            self.checkCommands(blockTime=min(waitTime, maxWaitTime))
+            if self.get_state() in handledStates:
+                # Not after a fault, which is left for faultHandler
+                self.adjust_State()
             
             
     def faultHandler(self, prevState):
         """Handles the FAULT state. A problem has been detected.
+        Recovery is tried in steps, each one only if the one before failed:
+        resync the reply framing on the open port and probe the device, then
+        close and reopen the port and probe again, and last go to UNKNOWN,
+        where the connection is built from scratch.
         """
         with self.streamLock:
             self.info_stream('Entering faultHandler from')
@@ -296,10 +401,29 @@ class ZaberMotorDS(PyTango.Device_4Impl):
         waitTime = 0.1
         retries = 0
         maxTries = 5
+        # Probes on the open port before reopening it
+        warmTries = 2
 
         faultProcessFlag = True
         s = ''.join(('Fault condition. Processing...\n'))
         t0 = time.time()
+
+        self.set_status(''.join((s, 'Resynchronizing')))
+        for i in range(warmTries):
+            if self.stopStateThreadFlag == True or self.get_state() not in handledStates:
+                return
+            try:
+                if self.device.resync() == False:
+                    # Not open, reopen it
+                    break
+                if self.probeDevice() == True:
+                    with self.streamLock:
+                        self.info_stream(''.join(('Fault condition cleared by resync after ', str(time.time() - t0), ' s')))
+                    self.set_state(PyTango.DevState.ON)
+                    return
+            except Exception, e:
+                with self.streamLock:
+                    self.error_stream(''.join(('Resync...', str(e))))
         
         while self.stopStateThreadFlag == False:
             if self.get_state() not in handledStates:
@@ -331,10 +455,10 @@ class ZaberMotorDS(PyTango.Device_4Impl):
                 try:
                     with self.streamLock:
                         self.info_stream('Getting device status...')
-                    stat = self.device.getStatus()
+                    if self.probeDevice() == False:
+                        raise ValueError('No reply to Return Status')
                     with self.streamLock:
-                        self.info_stream(stat[1]) 
-                    self.motorData.status = [stat]                   
+                        self.info_stream(self.motorData.status[0][1])
                     faultProcessFlag = False
                 except Exception, e:
                     with self.streamLock:
@@ -361,6 +485,7 @@ class ZaberMotorDS(PyTango.Device_4Impl):
         """
 #         with self.streamLock:
 #             self.debug_stream('Entering checkCommands')
+        t0 = time.time()
         try:
             if blockTime == 0:
 #                 with self.streamLock:
@@ -370,114 +495,159 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #                 with self.streamLock:
 #                     self.debug_stream('checkCommands: blockTime != 0')
                 cmd = self.commandQueue.get(block=True, timeout=blockTime)
-#             with self.streamLock:
-#                 self.info_stream(str(cmd.command))
+            self.trace.record(zt.TRACE_IO, cmd.command, cmd.data)
+            # The serial I/O is done without locks. The results are published
+            # as a new motorData snapshot with updateMotorData.
             if cmd.command == 'writePosition':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write position ', str(cmd.data))))
-                with self.attrLock:
-                    data = np.int(np.double(cmd.data*self.motorData.stepPerUnit[0])*self.motorData.microstepResolution[0])                    
-                    self.device.setPositionAbsolute(data, self.Motor)
-                self.info_stream(''.join(('Setting position ', str(data))))
+                self.endScan('Scan aborted by a move')
+                md = self.motorData
+                data = np.int(np.double(cmd.data*md.stepPerUnit[0])*md.microstepResolution[0])                    
+                t = time.time()
+                self.startMove(self.device.startPositionAbsolute(data, self.Motor), 'Moving to absolute position')
+                self.updateMotorData(targetPosition=[cmd.data], profile=self.newProfile(data, t))
+                self.trace.record(zt.TRACE_EVENTS, 'startPositionAbsolute', data)
             elif cmd.command == 'readPosition':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read position ')))
-                with self.attrLock:
-                    data = self.device.getPosition(self.Motor)
-                    self.motorData.position = [np.double(data)/self.motorData.stepPerUnit[0]/self.motorData.microstepResolution[0]]
+                t0 = time.time()
+                data = self.device.getPosition(self.Motor)
+                # The position is taken about half way through the round trip
+                t = 0.5*(t0 + time.time())
+                md = self.motorData
+                profile = md.profile
+                if profile != None and data != None:
+                    # Align the model with the readback
+                    profile = profile.corrected(data, t)
+                self.updateMotorData(position=[np.double(data)/md.stepPerUnit[0]/md.microstepResolution[0]],
+                                     profile=profile)
+                if data != None:
+                    self.recordPosition(data, t)
             elif cmd.command == 'writeStepPerUnit':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write steps per unit')))
-                with self.attrLock:
-                    self.motorData.stepPerUnit = [cmd.data]
+                self.updateMotorData(stepPerUnit=[cmd.data])
                     
             elif cmd.command == 'writeSpeed':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write speed ')))
-                with self.attrLock:
-                    data = self.device.setTargetSpeed(cmd.data*self.motorData.microstepResolution[0], self.Motor)
-                    self.motorData.speed = [np.double(data)/self.motorData.microstepResolution[0]]
+                res = self.motorData.microstepResolution[0]
+                data = self.device.setTargetSpeed(cmd.data*res, self.Motor)
+                self.updateMotorData(speed=[np.double(data)/res])
             elif cmd.command == 'readSpeed':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read speed ')))
-                with self.attrLock:
-                    data = self.device.getTargetSpeed(self.Motor)
-                    self.motorData.speed = [np.double(data)/self.motorData.microstepResolution[0]]
+                data = self.device.getTargetSpeed(self.Motor)
+                self.updateMotorData(speed=[np.double(data)/self.motorData.microstepResolution[0]])
 
             elif cmd.command == 'writeAcceleration':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write acceleration ')))
-                with self.attrLock:
-                    data = self.device.setAcceleration(cmd.data*self.motorData.microstepResolution[0], self.Motor)
-                    self.motorData.acceleration = [np.double(data)/self.motorData.microstepResolution[0]]
+                res = self.motorData.microstepResolution[0]
+                data = self.device.setAcceleration(cmd.data*res, self.Motor)
+                self.updateMotorData(acceleration=[np.double(data)/res])
             elif cmd.command == 'readAcceleration':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read acceleration ')))
-                with self.attrLock:
-                    data = self.device.getAcceleration(self.Motor)
-                    self.motorData.acceleration = [np.double(data)/self.motorData.microstepResolution[0]]
+                data = self.device.getAcceleration(self.Motor)
+                self.updateMotorData(acceleration=[np.double(data)/self.motorData.microstepResolution[0]])
 
             elif cmd.command == 'writeMicrostepResolution':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write microstep resolution ')))
-                with self.attrLock:
-                    data = self.device.setMicrostepResolution(cmd.data, self.Motor)
-                    self.motorData.microstepResolution = [data]
+                data = self.device.setMicrostepResolution(cmd.data, self.Motor)
+                self.updateMotorData(microstepResolution=[data])
             elif cmd.command == 'readMicrostepResolution':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read microstep resolution ')))
-                with self.attrLock:
-                    data = self.device.getMicrostepResolution(self.Motor)
-                    self.motorData.microstepResolution = [data]
+                data = self.device.getMicrostepResolution(self.Motor)
+                self.updateMotorData(microstepResolution=[data])
                 
             elif cmd.command == 'writeRunningCurrent':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write running current ')))
-                with self.attrLock:
-                    print "write running current", cmd.data
-                    data = self.device.setRunningCurrent(cmd.data/100.0, self.Motor)
-                    print "read running current", data
-                    self.motorData.runningCurrent = [data*100]
-                    cmdRead = ZaberCommand('readRunningCurrent')
-                    self.commandQueue.put(cmdRead)
+                data = self.device.setRunningCurrent(cmd.data/100.0, self.Motor)
+                self.updateMotorData(runningCurrent=[data*100])
             elif cmd.command == 'readRunningCurrent':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read running current ')))
-                with self.attrLock:
-                    data = self.device.getRunningCurrent(self.Motor)                    
-                    self.motorData.runningCurrent = [data*100]
+                data = self.device.getRunningCurrent(self.Motor)                    
+                self.updateMotorData(runningCurrent=[data*100])
 
             elif cmd.command == 'writeHoldCurrent':
-                with self.streamLock:
-                    self.info_stream(''.join(('Write hold current ')))
-                with self.attrLock:
-                    data = self.device.setHoldCurrent(cmd.data/100.0, self.Motor)
-                    self.motorData.holdCurrent = [data*100]
+                data = self.device.setHoldCurrent(cmd.data/100.0, self.Motor)
+                self.updateMotorData(holdCurrent=[data*100])
             elif cmd.command == 'readHoldCurrent':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read hold current ')))
-                with self.attrLock:
-                    data = self.device.getHoldCurrent(self.Motor)
-                    self.motorData.holdCurrent = [data*100]
+                data = self.device.getHoldCurrent(self.Motor)
+                self.updateMotorData(holdCurrent=[data*100])
 
 
             elif cmd.command == 'readStatus':
-                with self.streamLock:
-                    self.info_stream(''.join(('Read Status')))
-                with self.attrLock:
-                    data = self.device.getStatus(self.Motor)
-                    self.motorData.status = [data]
+                data = self.device.getStatus(self.Motor)
+                self.updateMotorData(status=[data])
+                profile = self.motorData.profile
+                if data[0] == 0 and self.moveRequest != None and profile != None and time.time() > profile.tArrival:
+                    # Idle after the expected arrival, but the completion
+                    # reply never came. Stop tracking the move.
+                    with self.streamLock:
+                        self.warn_stream('Move completion reply missing')
+                    self.moveRequest = None
+                    self.updateMotorData(profile=None)
                     
 
             elif cmd.command == 'stop' or cmd.command == 'standby':
                 if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
-                    with self.attrLock:
-                        self.device.stop(self.Motor)
+                    self.device.stop(self.Motor)
 
             elif cmd.command == 'home':
                 if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
-                    with self.attrLock:
-                        self.device.homeMotor(self.Motor)
+                    self.endScan('Scan aborted by homing')
+                    self.startMove(self.device.startHome(self.Motor), 'Homing')
+                    # Homing runs at the home speed until the sensor, it is not modelled
+                    self.updateMotorData(targetPosition=[0.0], profile=None)
+
+            elif cmd.command == 'moveDone':
+                scan = self.scan
+                scanMove = scan != None and cmd.data is scan.moveRequest
+                if scanMove == True:
+                    scan.moveRequest = None
+                    reply = cmd.data.reply
+                    if cmd.data.interrupted == True or reply == None or reply.command == 255:
+                        self.endScan('Scan aborted')
+                # Completion of a move started with startMove. Ignore moves
+                # that were superseded by a newer one.
+                if cmd.data is self.moveRequest:
+                    self.moveRequest = None
+                    reply = self.device.checkReply(cmd.data.reply)
+                    if reply != None:
+                        md = self.motorData
+                        homed = md.homed[0] or (cmd.data.cmd.command == 1 and cmd.data.interrupted == False)
+                        self.updateMotorData(position=[np.double(reply.data)/md.stepPerUnit[0]/md.microstepResolution[0]],
+                                             status=[(0, 'idle')], profile=None, homed=[homed])
+                        self.recordPosition(reply.data, time.time())
+                    else:
+                        self.updateMotorData(profile=None)
+                if scanMove == True and scan.running == True:
+                    scan.arrived(self.motorData.position[0], cmd.data.tReply)
+                    if scan.nextTime <= time.time():
+                        self.scanStep()
+
+            elif cmd.command == 'moveMultiple' or cmd.command == 'homeAll':
+                if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
+                    self.endScan('Scan aborted by a multi-axis move')
+                    if cmd.command == 'moveMultiple':
+                        group = self.device.startMoveMulti(cmd.data)
+                        status = ''.join(('Moving ', str(cmd.data.__len__()), ' axes'))
+                    else:
+                        group = self.device.startHomeAll()
+                        status = 'Homing all axes'
+                    self.groupMove = group
+                    self.groupHoming = cmd.command == 'homeAll'
+                    self.set_state(PyTango.DevState.MOVING)
+                    self.set_status(status)
+                    group.addDoneCallback(self.groupMoveDoneCallback)
+
+            elif cmd.command == 'groupMoveDone':
+                if cmd.data is self.groupMove:
+                    self.groupMove = None
+                    self.groupPositions = cmd.data.positions()
+                    pos = self.groupPositions.get(self.Motor)
+                    if pos != None:
+                        md = self.motorData
+                        # A home all stopped before the axis reached home leaves homed as it was
+                        homed = md.homed[0] or (self.groupHoming == True and self.Motor in cmd.data.completed())
+                        self.updateMotorData(position=[np.double(pos)/md.stepPerUnit[0]/md.microstepResolution[0]],
+                                             profile=None, homed=[homed])
+                        self.recordPosition(pos, time.time())
+
+            elif cmd.command == 'scan':
+                if self.get_state() not in [PyTango.DevState.INIT, PyTango.DevState.UNKNOWN]:
+                    self.endScan('Scan aborted by a new scan')
+                    self.scan = cmd.data
+                    self.scanStep()
+
+            elif cmd.command == 'scanStep':
+                if self.scan != None and self.scan.running == True:
+                    self.scanStep()
 
 
 
@@ -490,8 +660,9 @@ class ZaberMotorDS(PyTango.Device_4Impl):
                     self.set_state(PyTango.DevState.ON)
                     
         except Queue.Empty:
-            with self.streamLock:
-                self.info_stream('checkCommands: queue empty')
+            self.trace.record(zt.TRACE_DEBUG, 'queue empty')
+            if blockTime > 0:
+                self.loopLateness.append(time.time() - t0 - blockTime)
                 
         except Exception, e:
             with self.streamLock:
@@ -503,14 +674,215 @@ class ZaberMotorDS(PyTango.Device_4Impl):
                 self.set_state(PyTango.DevState.FAULT)
                 
 
+    def probeDevice(self):
+        '''
+        Reads the status of the axis as a check of the link. Returns True if
+        the device answered.
+        '''
+        stat = self.device.getStatus(self.Motor)
+        if stat[0] == None:
+            return False
+        self.updateMotorData(status=[stat])
+        return True
+
+    def updateMotorData(self, **kwargs):
+        '''
+        Publishes a new motorData snapshot with the given fields replaced.
+        Only the state thread publishes, and replacing the reference is atomic,
+        so attribute reads just take the current snapshot without locking.
+        '''
+        self.motorData = self.motorData.replace(**kwargs)
+        self.saveSnapshot()
+
+    def saveSnapshot(self):
+        '''
+        Writes motorData to the state snapshot file, if there is one.
+        '''
+        if self.snapshot == None:
+            return
+        md = self.motorData
+        status = md.status[0]
+        if status != None:
+            status = status[0]
+        self.snapshot.save(self.Port, self.Motor,
+                           {'time': time.time(), 'position': md.position[0], 'targetPosition': md.targetPosition[0],
+                            'status': status, 'homed': int(md.homed[0]), 'stepPerUnit': md.stepPerUnit[0],
+                            'microstepResolution': md.microstepResolution[0], 'speed': md.speed[0],
+                            'acceleration': md.acceleration[0], 'runningCurrent': md.runningCurrent[0],
+                            'holdCurrent': md.holdCurrent[0], 'deviceId': md.deviceId[0],
+                            'firmwareVersion': md.firmwareVersion[0]})
+
+    def restoreSnapshot(self):
+        '''
+        Publishes the values in the state snapshot file as motorData, marked
+        restored, if it has a snapshot of this axis.
+        '''
+        values = self.snapshot.load(self.Port, self.Motor)
+        if values == None:
+            return
+        kwargs = {'restored': True, 'homed': [values['homed'] == 1]}
+        for name in ('position', 'targetPosition', 'stepPerUnit', 'speed', 'acceleration',
+                     'runningCurrent', 'holdCurrent', 'firmwareVersion'):
+            if values[name] != None:
+                kwargs[name] = [values[name]]
+        for name in ('microstepResolution', 'deviceId'):
+            if values[name] != None:
+                kwargs[name] = [int(values[name])]
+        if values['status'] != None:
+            kwargs['status'] = [zc.decodeStatus(int(values['status']))]
+        self.motorData = self.motorData.replace(**kwargs)
+        with self.streamLock:
+            self.info_stream(''.join(('Restored position ', str(values['position']), ' saved at ',
+                                      time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(values['time'])))))
+
+    def snapshotMatches(self, restored, md):
+        '''
+        Returns True if the hardware state read in md agrees with the restored
+        motorData: the same device, at the restored position, or between it and
+        the target if it was moving.
+        '''
+        if restored.deviceId[0] != md.deviceId[0] or restored.microstepResolution[0] != md.microstepResolution[0]:
+            return False
+        if restored.position[0] == None:
+            return False
+        res = md.microstepResolution[0]
+        before = restored.position[0]*restored.stepPerUnit[0]*res
+        now = md.position[0]*md.stepPerUnit[0]*res
+        if abs(now - before) <= 1:
+            return True
+        status = restored.status[0]
+        target = restored.targetPosition[0]
+        if status == None or status[0] in (0, None) or target == None:
+            return False
+        target = target*restored.stepPerUnit[0]*res
+        return min(before, target) - 1 <= now <= max(before, target) + 1
+
+    def scanStep(self):
+        '''
+        Starts the move to the next point of the running scan, or ends the
+        scan if it is finished or aborted.
+        '''
+        scan = self.scan
+        scan.nextTime = None
+        if scan.aborted == True:
+            self.endScan('Scan aborted')
+            return
+        if scan.finished() == True:
+            self.endScan('Scan done')
+            return
+        target = scan.positions[scan.index]
+        md = self.motorData
+        data = np.int(np.double(target*md.stepPerUnit[0])*md.microstepResolution[0])
+        t = time.time()
+        status = ''.join(('Scanning point ', str(scan.index + 1), ' of ', str(scan.positions.shape[0])))
+        scan.moveRequest = self.device.startPositionAbsolute(data, self.Motor)
+        scan.index += 1
+        self.startMove(scan.moveRequest, status)
+        self.updateMotorData(targetPosition=[target], profile=self.newProfile(data, t))
+        self.trace.record(zt.TRACE_EVENTS, 'scanStep', data)
+
+    def endScan(self, status):
+        '''
+        Ends the running scan, if any. Its results are kept.
+        '''
+        scan = self.scan
+        if scan == None or scan.running == False:
+            return
+        scan.running = False
+        scan.nextTime = None
+        self.trace.record(zt.TRACE_EVENTS, 'endScan', status)
+        with self.streamLock:
+            self.info_stream(status)
+
+    def recordPosition(self, steps, t):
+        '''
+        Adds a position readback in microsteps, read at time t, to the history.
+        '''
+        md = self.motorData
+        status = md.status[0]
+        if status == None or status[0] == None:
+            code = -1
+        else:
+            code = status[0]
+        self.history.append(t, steps, md.position[0], code)
+
+    def newProfile(self, target, t):
+        '''
+        Returns the MotionProfile of a move to target in microsteps started at
+        time t, from the modelled position if a move is in progress. None if
+        the speed and acceleration are not known.
+        '''
+        md = self.motorData
+        try:
+            res = md.microstepResolution[0]
+            if md.profile != None:
+                start = md.profile.position(t)
+            else:
+                start = md.position[0]*md.stepPerUnit[0]*res
+            speed = md.speed[0]*res*zc.SPEED_UNIT
+            acceleration = md.acceleration[0]*res*zc.ACCELERATION_UNIT
+        except TypeError:
+            return None
+        if speed <= 0 or acceleration <= 0:
+            return None
+        return zc.MotionProfile(start, target, speed, acceleration, t)
+
+    def linkStatistics(self):
+        '''
+        Returns the LinkStatistics of the port, None if not connected.
+        '''
+        device = getattr(self, 'device', None)
+        if device == None:
+            return None
+        return device.getStatistics()
+
+    def startMove(self, moveRequest, status):
+        '''
+        Tracks a move started on the hardware. The state goes to MOVING now and
+        back to ON when the completion reply of moveRequest arrives.
+        '''
+        self.moveRequest = moveRequest
+        self.set_state(PyTango.DevState.MOVING)
+        self.set_status(status)
+        moveRequest.addDoneCallback(self.moveDoneCallback)
+
+    def moveDoneCallback(self, moveRequest):
+        '''
+        Called from the port reader thread when a move is completed. Hands the
+        request over to the state thread through the command queue.
+        '''
+        try:
+            self.commandQueue.put(ZaberCommand('moveDone', moveRequest), block=False)
+        except Queue.Full:
+            # The status polling will notice the move is done
+            self.moveRequest = None
+
+    def groupMoveDoneCallback(self, group):
+        '''
+        Called from the port reader thread when all axes of a multi-axis move
+        are done.
+        '''
+        try:
+            self.commandQueue.put(ZaberCommand('groupMoveDone', group), block=False)
+        except Queue.Full:
+            self.groupMove = None
+
     def adjust_State(self):
         '''
         Updates the state based on the information in the motorData variable.
+        While a move is tracked the state is set by its completion reply.
         '''
+        if self.moveRequest != None or self.groupMove != None:
+            return
+        scan = self.scan
+        if scan != None and scan.running == True:
+            self.set_state(PyTango.DevState.MOVING)
+            self.set_status(''.join(('Scan dwelling at point ', str(scan.pointsDone), ' of ', str(scan.positions.shape[0]))))
+            return
         
 #         if self.get_state() != PyTango.DevState.ALARM:
 #             # Do not change state if we are in ALARM
-        self.debug_stream(''.join(('Adjust state status data: ', str(self.motorData.status[0]))))
+        self.trace.record(zt.TRACE_DEBUG, 'adjust_State', self.motorData.status[0])
         if self.motorData.status[0][0] == 0:
             self.set_state(PyTango.DevState.ON)
             self.set_status('Idle')
@@ -553,7 +925,15 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #------------------------------------------------------------------
     def read_attr_hardware(self, data):
 #         print "In ", self.get_name(), "::read_attr_hardware()"
-        pass
+        # The history spectra read in one request show the same samples
+        attrs = self.get_device_attr()
+        for ind in data:
+            if attrs.get_attr_by_ind(ind).get_name().startswith('History') == True:
+                if self.historySince > 0:
+                    self.historySamples = self.history.since(self.historySince)
+                else:
+                    self.historySamples = self.history.last(self.historyLength)
+                break
 
 #==================================================================
 #
@@ -565,29 +945,27 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read Position attribute
 #------------------------------------------------------------------
     def read_Position(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_Position()")))
-        with self.attrLock:
-            attr_read = self.motorData.position[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_Position')
+        md = self.motorData
+        attr_read = md.position[0]
+        if md.profile != None:
+            # Interpolated between position reads
+            attr_read = md.profile.position(time.time())/md.stepPerUnit[0]/md.microstepResolution[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        elif md.restored == True:
+            # Not verified against the hardware yet
+            attr.set_quality(PyTango.AttrQuality.ATTR_WARNING)
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write Position attribute
 #------------------------------------------------------------------
     def write_Position(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_Position()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_Position', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writePosition', data)
@@ -600,6 +978,9 @@ class ZaberMotorDS(PyTango.Device_4Impl):
                                 PyTango.DevState.UNKNOWN]:
             #     End of Generated Code
             #     Re-Start of Generated Code
+            # A restored position can be read before the hardware answers
+            if req_type == PyTango.AttReqType.READ_REQ and self.motorData.restored == True:
+                return True
             return False
         return True
 
@@ -607,29 +988,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read Step_per_unit attribute
 #------------------------------------------------------------------
     def read_Step_per_unit(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_Step_per_unit()")))
-        with self.attrLock:
-            attr_read = self.motorData.stepPerUnit[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_Step_per_unit')
+        attr_read = self.motorData.stepPerUnit[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write Step_per_unit attribute
 #------------------------------------------------------------------
     def write_Step_per_unit(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_Step_per_unit()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_Step_per_unit', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeStepPerUnit', data)
@@ -649,29 +1021,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read Speed attribute
 #------------------------------------------------------------------
     def read_Speed(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_Speed()")))
-        with self.attrLock:
-            attr_read = self.motorData.speed[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_Speed')
+        attr_read = self.motorData.speed[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write Speed attribute
 #------------------------------------------------------------------
     def write_Speed(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_Speed()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_Speed', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeSpeed', data)
@@ -693,29 +1056,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read Acceleration attribute
 #------------------------------------------------------------------
     def read_Acceleration(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_Acceleration()")))
-        with self.attrLock:
-            attr_read = self.motorData.acceleration[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_Acceleration')
+        attr_read = self.motorData.acceleration[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write Acceleration attribute
 #------------------------------------------------------------------
     def write_Acceleration(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_Acceleration()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_Acceleration', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeAcceleration', data)
@@ -736,30 +1090,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read RunningCurrent attribute
 #------------------------------------------------------------------
     def read_RunningCurrent(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_RunningCurrent()")))
-            self.info_stream(str(self.motorData.runningCurrent[0]))
-        with self.attrLock:
-            attr_read = self.motorData.runningCurrent[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_RunningCurrent')
+        attr_read = self.motorData.runningCurrent[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write RunningCurrent attribute
 #------------------------------------------------------------------
     def write_RunningCurrent(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_RunningCurrent()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_RunningCurrent', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeRunningCurrent', data)
@@ -781,29 +1125,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read HoldCurrent attribute
 #------------------------------------------------------------------
     def read_HoldCurrent(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_HoldCurrent()")))
-        with self.attrLock:
-            attr_read = self.motorData.holdCurrent[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_HoldCurrent')
+        attr_read = self.motorData.holdCurrent[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write HoldCurrent attribute
 #------------------------------------------------------------------
     def write_HoldCurrent(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_HoldCurrent()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_HoldCurrent', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeHoldCurrent', data)
@@ -824,29 +1159,20 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read MicrostepResolution attribute
 #------------------------------------------------------------------
     def read_MicrostepResolution(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_MicrostepResolution()")))
-        with self.attrLock:
-            attr_read = self.motorData.microstepResolution[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_MicrostepResolution')
+        attr_read = self.motorData.microstepResolution[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
 
 
 #------------------------------------------------------------------
 #     Write MicrostepResolution attribute
 #------------------------------------------------------------------
     def write_MicrostepResolution(self, attr):
-        with self.streamLock:
-            msg = ''.join(("In ", self.get_name(), "::write_MicrostepResolution()"))
-            self.info_stream(msg)
-        
         data = attr.get_write_value()
-        
-        with self.streamLock:
-            msg = ''.join(( "Attribute value = ", str(data)))
-            self.info_stream(msg)
+        self.trace.record(zt.TRACE_EVENTS, 'write_MicrostepResolution', data)
 
         #     Add your own code here
         cmdMsg = ZaberCommand('writeMicrostepResolution', data)
@@ -870,15 +1196,13 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read FirmwareVersion attribute
 #------------------------------------------------------------------
     def read_FirmwareVersion(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_FirmwareVersion()")))
-        with self.attrLock:
-            attr_read = self.motorData.firmwareVersion[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 'unknown'
-                
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_FirmwareVersion')
+        attr_read = self.motorData.firmwareVersion[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 'unknown'
+            
+        attr.set_value(attr_read)
 
 #---- FirmwareVersion attribute State Machine -----------------
     def is_FirmwareVersion_allowed(self, req_type):
@@ -892,15 +1216,13 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Read DeviceID attribute
 #------------------------------------------------------------------
     def read_DeviceID(self, attr):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::read_DeviceID()")))
-        with self.attrLock:
-            attr_read = self.motorData.deviceId[0]
-            if attr_read == None:
-                attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
-                attr_read = 0.0
-                
-            attr.set_value(attr_read)
+        self.trace.record(zt.TRACE_DEBUG, 'read_DeviceID')
+        attr_read = self.motorData.deviceId[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+            
+        attr.set_value(attr_read)
 
 #---- DeviceID attribute State Machine -----------------
     def is_DeviceID_allowed(self, req_type):
@@ -910,6 +1232,247 @@ class ZaberMotorDS(PyTango.Device_4Impl):
             return False
         return True
 
+#------------------------------------------------------------------
+#     Read TraceLevel attribute
+#------------------------------------------------------------------
+    def read_TraceLevel(self, attr):
+        attr.set_value(self.trace.level)
+
+#------------------------------------------------------------------
+#     Write TraceLevel attribute
+#------------------------------------------------------------------
+    def write_TraceLevel(self, attr):
+        self.trace.level = attr.get_write_value()
+
+#------------------------------------------------------------------
+#     Read Trace attribute
+#------------------------------------------------------------------
+    def read_Trace(self, attr):
+        attr.set_value(self.trace.lines(4096))
+
+#------------------------------------------------------------------
+#     Read TargetPosition attribute
+#------------------------------------------------------------------
+    def read_TargetPosition(self, attr):
+        attr_read = self.motorData.targetPosition[0]
+        if attr_read == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr_read = 0.0
+        attr.set_value(attr_read)
+
+#------------------------------------------------------------------
+#     Read EstimatedTimeToArrival attribute
+#------------------------------------------------------------------
+    def read_EstimatedTimeToArrival(self, attr):
+        md = self.motorData
+        if md.profile != None:
+            attr.set_value(md.profile.timeToArrival(time.time()))
+        elif self.moveRequest != None:
+            # Moving, but not modelled
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0.0)
+        else:
+            attr.set_value(0.0)
+
+#------------------------------------------------------------------
+#     Read state snapshot attributes
+#------------------------------------------------------------------
+    def read_Homed(self, attr):
+        attr.set_value(bool(self.motorData.homed[0]))
+
+    def read_Restored(self, attr):
+        attr.set_value(self.motorData.restored)
+
+#------------------------------------------------------------------
+#     Read multi-axis move result attributes
+#------------------------------------------------------------------
+    def read_MultiMoveMotors(self, attr):
+        attr.set_value(sorted(self.groupPositions.keys()))
+
+    def read_MultiMovePositions(self, attr):
+        positions = self.groupPositions
+        attr.set_value([np.nan if positions[m] == None else positions[m] for m in sorted(positions.keys())])
+
+#------------------------------------------------------------------
+#     Read/Write ScanDwell attribute
+#------------------------------------------------------------------
+    def read_ScanDwell(self, attr):
+        attr.set_value(self.scanDwell)
+
+    def write_ScanDwell(self, attr):
+        self.scanDwell = list(attr.get_write_value())
+
+#------------------------------------------------------------------
+#     Read scan result attributes
+#------------------------------------------------------------------
+    def read_ScanPositions(self, attr):
+        if self.scan == None:
+            attr.set_value([])
+        else:
+            attr.set_value(self.scan.positions)
+
+    def read_ScanArrivalPositions(self, attr):
+        if self.scan == None:
+            attr.set_value([])
+        else:
+            attr.set_value(self.scan.arrivalPositions.copy())
+
+    def read_ScanArrivalTimes(self, attr):
+        if self.scan == None:
+            attr.set_value([])
+        else:
+            attr.set_value(self.scan.arrivalTimes.copy())
+
+    def read_ScanPointsDone(self, attr):
+        if self.scan == None:
+            attr.set_value(0)
+        else:
+            attr.set_value(self.scan.pointsDone)
+
+#------------------------------------------------------------------
+#     Read/Write HistoryLength attribute
+#------------------------------------------------------------------
+    def read_HistoryLength(self, attr):
+        attr.set_value(self.historyLength)
+
+    def write_HistoryLength(self, attr):
+        self.historyLength = attr.get_write_value()
+
+#------------------------------------------------------------------
+#     Read/Write HistorySince attribute
+#------------------------------------------------------------------
+    def read_HistorySince(self, attr):
+        attr.set_value(self.historySince)
+
+    def write_HistorySince(self, attr):
+        self.historySince = attr.get_write_value()
+
+#------------------------------------------------------------------
+#     Read history spectrum attributes
+#------------------------------------------------------------------
+    def read_HistoryTime(self, attr):
+        attr.set_value(self.historySamples['time'])
+
+    def read_HistorySteps(self, attr):
+        attr.set_value(self.historySamples['steps'])
+
+    def read_HistoryPosition(self, attr):
+        attr.set_value(self.historySamples['position'])
+
+    def read_HistoryStatus(self, attr):
+        attr.set_value(self.historySamples['status'])
+
+#------------------------------------------------------------------
+#     Read link statistics attributes
+#------------------------------------------------------------------
+    def read_LatencyBins(self, attr):
+        attr.set_value(list(zc.LinkStatistics.latencyBins) + [float('inf')])
+
+    def read_LatencyHistogram(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value([])
+            return
+        attr.set_value(stats.histogram())
+
+    def read_LatencyCommands(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value([])
+            return
+        attr.set_value(stats.commands())
+
+    def read_LatencyHistograms(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(np.zeros((0, 0), dtype=np.int32))
+            return
+        rows = [stats.histogram(command) for command in stats.commands()]
+        if rows.__len__() == 0:
+            attr.set_value(np.zeros((0, 0), dtype=np.int32))
+        else:
+            attr.set_value(np.array(rows, dtype=np.int32))
+
+    def read_Timeouts(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0)
+            return
+        attr.set_value(stats.timeouts)
+
+    def read_ShortReads(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0)
+            return
+        attr.set_value(stats.shortReads)
+
+    def read_Resyncs(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0)
+            return
+        attr.set_value(stats.resyncs)
+
+    def read_DroppedBytes(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0)
+            return
+        attr.set_value(stats.droppedBytes)
+
+    def read_UnsolicitedReplies(self, attr):
+        device = getattr(self, 'device', None)
+        if device == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value([])
+            return
+        counts = device.getUnsolicitedCounts()
+        attr.set_value([''.join((kind, ': ', str(n))) for kind, n in sorted(counts.items())])
+
+    def read_ErrorReplies(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0)
+            return
+        attr.set_value(stats.errorReplies)
+
+    def read_CommandRate(self, attr):
+        stats = self.linkStatistics()
+        if stats == None:
+            attr.set_quality(PyTango.AttrQuality.ATTR_INVALID)
+            attr.set_value(0.0)
+            return
+        attr.set_value(stats.commandRate())
+
+    def read_QueueDepth(self, attr):
+        attr.set_value(self.commandQueue.qsize())
+
+    def read_QueueAge(self, attr):
+        attr.set_value(self.commandQueue.oldestAge())
+
+    def read_LoopJitter(self, attr):
+        lateness = list(self.loopLateness)
+        if lateness.__len__() == 0:
+            attr.set_value(0.0)
+        else:
+            attr.set_value(1e3*np.mean(np.abs(lateness)))
+
+    def read_LoopJitterMax(self, attr):
+        lateness = list(self.loopLateness)
+        if lateness.__len__() == 0:
+            attr.set_value(0.0)
+        else:
+            attr.set_value(1e3*np.max(np.abs(lateness)))
+
 #==================================================================
 #
 #     ZaberMotorDS command methods
@@ -924,8 +1487,7 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Description: 
 #------------------------------------------------------------------
     def Home(self):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::Home()")))
+        self.trace.record(zt.TRACE_EVENTS, 'Home')
         cmdMsg = ZaberCommand('home')
         self.commandQueue.put(cmdMsg)
 
@@ -944,10 +1506,18 @@ class ZaberMotorDS(PyTango.Device_4Impl):
 #     Description: 
 #------------------------------------------------------------------
     def Stop(self):
-        with self.streamLock:
-            self.info_stream(''.join(("In ", self.get_name(), "::Stop()")))
-        cmdMsg = ZaberCommand('stop')
-        self.commandQueue.put(cmdMsg)
+        self.trace.record(zt.TRACE_EVENTS, 'Stop')
+        # Stop goes straight to the wire instead of waiting for the queue.
+        # Queued moves are dropped.
+        try:
+            self.device.stopNow(self.Motor)
+        except Exception:
+            cmdMsg = ZaberCommand('stop')
+            self.commandQueue.put(cmdMsg)
+        scan = self.scan
+        if scan != None:
+            scan.aborted = True
+        self.commandQueue.purge(['writePosition', 'home', 'scan', 'moveMultiple', 'homeAll'])
 
 
 #---- Stop command State Machine -----------------
@@ -959,6 +1529,126 @@ class ZaberMotorDS(PyTango.Device_4Impl):
         return True
 
 
+#------------------------------------------------------------------
+#     DumpTrace command:
+#
+#     Description: Writes the trace ring buffer to a text file
+#------------------------------------------------------------------
+    def DumpTrace(self, filename):
+        self.trace.dump(filename)
+
+#------------------------------------------------------------------
+#     MoveMultiple command:
+#
+#     Description: Moves several axes of the chain with minimum skew. The
+#                  argument is pairs of device number and position in
+#                  microsteps. The final positions are in MultiMovePositions.
+#------------------------------------------------------------------
+    def MoveMultiple(self, argin):
+        self.trace.record(zt.TRACE_EVENTS, 'MoveMultiple', argin)
+        if argin.__len__() == 0 or argin.__len__() % 2 != 0:
+            PyTango.Except.throw_exception('Invalid move', 'Give pairs of device number and position', 'MoveMultiple')
+        positions = dict([(int(argin[i]), int(argin[i + 1])) for i in range(0, argin.__len__(), 2)])
+        self.commandQueue.put(ZaberCommand('moveMultiple', positions))
+
+#---- MoveMultiple command State Machine -----------------
+    def is_MoveMultiple_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.FAULT,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     HomeAll command:
+#
+#     Description: Homes all axes of the chain with one broadcast frame
+#------------------------------------------------------------------
+    def HomeAll(self):
+        self.trace.record(zt.TRACE_EVENTS, 'HomeAll')
+        self.commandQueue.put(ZaberCommand('homeAll'))
+
+#---- HomeAll command State Machine -----------------
+    def is_HomeAll_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.FAULT,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     StopAll command:
+#
+#     Description: Stops all axes of the chain with one broadcast frame
+#------------------------------------------------------------------
+    def StopAll(self):
+        self.trace.record(zt.TRACE_EVENTS, 'StopAll')
+        # Straight to the wire like Stop. The stop replies interrupt the
+        # moves in flight of every device on the chain.
+        try:
+            self.device.stopNow(0)
+        except Exception:
+            cmdMsg = ZaberCommand('stop')
+            self.commandQueue.put(cmdMsg)
+        scan = self.scan
+        if scan != None:
+            scan.aborted = True
+        self.commandQueue.purge(['writePosition', 'home', 'scan', 'moveMultiple', 'homeAll'])
+
+#---- StopAll command State Machine -----------------
+    def is_StopAll_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     RunScan command:
+#
+#     Description: Step scan over the target positions in the argument,
+#                  dwelling ScanDwell s at each point.
+#------------------------------------------------------------------
+    def RunScan(self, argin):
+        self.trace.record(zt.TRACE_EVENTS, 'RunScan', argin.__len__())
+        n = argin.__len__()
+        if n == 0:
+            PyTango.Except.throw_exception('Invalid scan', 'No scan positions given', 'RunScan')
+        dwell = self.scanDwell
+        if dwell.__len__() == 1:
+            dwellTimes = [dwell[0]] * n
+        elif dwell.__len__() == n:
+            dwellTimes = dwell
+        else:
+            PyTango.Except.throw_exception('Invalid scan', 'ScanDwell must have one value or one per scan position', 'RunScan')
+        self.commandQueue.put(ZaberCommand('scan', ScanSequence(argin, dwellTimes)))
+
+#---- RunScan command State Machine -----------------
+    def is_RunScan_allowed(self):
+        if self.get_state() in [PyTango.DevState.UNKNOWN,
+                                PyTango.DevState.FAULT,
+                                PyTango.DevState.INIT]:
+            return False
+        return True
+
+#------------------------------------------------------------------
+#     ExportHistory command:
+#
+#     Description: Writes the position history to a .npy file
+#------------------------------------------------------------------
+    def ExportHistory(self, filename):
+        self.history.save(filename)
+
+#------------------------------------------------------------------
+#     ResetStatistics command:
+#
+#     Description: Clears the link statistics of the port and the state loop jitter
+#------------------------------------------------------------------
+    def ResetStatistics(self):
+        self.loopLateness.clear()
+        stats = self.linkStatistics()
+        if stats != None:
+            stats.reset()
+
+
 #==================================================================
 #
 #     ZaberMotorDSClass class definition
@@ -975,12 +1665,52 @@ class ZaberMotorDSClass(PyTango.DeviceClass):
     device_property_list = {
         'Port':
             [PyTango.DevString,
-            "Serial port that the laser is connected to.",
+            "Serial port that the motor controller chain is connected to. Devices with the same Port share one serial handle.",
             [ "COM0" ] ],
         'Motor':
             [PyTango.DevLong,
             "Motor number to control.",
             [ 0 ] ],
+        'Protocol':
+            [PyTango.DevString,
+            "Zaber protocol: binary (9600 baud) or ascii (115200 baud).",
+            [ "binary" ] ],
+        'MovingPollPeriod':
+            [PyTango.DevDouble,
+            "Position and status poll period in s while moving.",
+            [ 0.1 ] ],
+        'IdlePollPeriod':
+            [PyTango.DevDouble,
+            "Longest position and status poll period in s when idle. The period backs off to this after a move.",
+            [ 2.0 ] ],
+        'SettingsPollPeriod':
+            [PyTango.DevDouble,
+            "Poll period in s of speed, acceleration, resolution and currents. 0 disables polling.",
+            [ 30.0 ] ],
+        'SettingsMaxAge':
+            [PyTango.DevDouble,
+            "Time in s a setting is served from the settings cache before it is read from the device again. 0 keeps it until it is written, the device is reset or the port is reconnected.",
+            [ 300.0 ] ],
+        'IdentityCacheFile':
+            [PyTango.DevString,
+            "Json file caching the device id and firmware version of the devices by port and device number, shared by the servers on the host. Empty to always read them from the device.",
+            [ "" ] ],
+        'TraceCapacity':
+            [PyTango.DevLong,
+            "Number of events kept in the trace ring buffer.",
+            [ 4096 ] ],
+        'HistoryCapacity':
+            [PyTango.DevLong,
+            "Number of position readbacks kept in the position history.",
+            [ 100000 ] ],
+        'HistoryFile':
+            [PyTango.DevString,
+            "If set, the position history is memory mapped to this .npy file, which is overwritten at init.",
+            [ "" ] ],
+        'SnapshotFile':
+            [PyTango.DevString,
+            "If set, the last known state is kept in this .npy file, one per axis, and served at startup until verified against the hardware.",
+            [ "" ] ],
                             
         }
 
@@ -993,6 +1723,27 @@ class ZaberMotorDSClass(PyTango.DeviceClass):
         'Stop':
             [[PyTango.DevVoid, ""],
             [PyTango.DevVoid, ""]],
+        'DumpTrace':
+            [[PyTango.DevString, "file name"],
+            [PyTango.DevVoid, ""]],
+        'ResetStatistics':
+            [[PyTango.DevVoid, ""],
+            [PyTango.DevVoid, ""]],
+        'ExportHistory':
+            [[PyTango.DevString, "file name"],
+            [PyTango.DevVoid, ""]],
+        'RunScan':
+            [[PyTango.DevVarDoubleArray, "Target positions in mm"],
+            [PyTango.DevVoid, ""]],
+        'MoveMultiple':
+            [[PyTango.DevVarDoubleArray, "Pairs of device number and position in microsteps"],
+            [PyTango.DevVoid, ""]],
+        'HomeAll':
+            [[PyTango.DevVoid, ""],
+            [PyTango.DevVoid, ""]],
+        'StopAll':
+            [[PyTango.DevVoid, ""],
+            [PyTango.DevVoid, ""]],
         }
 
 
@@ -1006,7 +1757,7 @@ class ZaberMotorDSClass(PyTango.DeviceClass):
                 'label':"position",
                 'unit':"mm",
                 'display unit':"mm",
-                'description':"Motor position in mm.",
+                'description':"Motor position in mm. Interpolated between reads during a move.",
                 'Memorized':"true_without_hard_applied",
                 'Polling period':100,
             } ],
@@ -1100,6 +1851,268 @@ class ZaberMotorDSClass(PyTango.DeviceClass):
             {
                 'description':"Firmware version of the Zaber controller",
             } ],                 
+        'TargetPosition':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'label':"target position",
+                'unit':"mm",
+                'display unit':"mm",
+                'description':"Target of the last move in mm.",
+            } ],
+        'EstimatedTimeToArrival':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'unit':"s",
+                'description':"Modelled time until the move in progress reaches its target. 0 when not moving.",
+            } ],
+        'Homed':
+            [[PyTango.DevBoolean,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"The axis has been homed since the device was powered, as far as known",
+            } ],
+        'Restored':
+            [[PyTango.DevBoolean,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"The values are restored from the state snapshot and not yet verified against the hardware",
+            } ],
+        'MultiMoveMotors':
+            [[PyTango.DevLong,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'description':"Device numbers of the last MoveMultiple or HomeAll.",
+            } ],
+        'MultiMovePositions':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'unit':"microsteps",
+                'description':"Final position of each device in MultiMoveMotors. NaN if not reached.",
+            } ],
+        'ScanDwell':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ_WRITE, 10000],
+            {
+                'unit':"s",
+                'description':"Dwell time at the scan points of RunScan. One value for all points, or one per point.",
+                'min value':0,
+            } ],
+        'ScanPositions':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 10000],
+            {
+                'unit':"mm",
+                'description':"Target positions of the last scan.",
+            } ],
+        'ScanArrivalPositions':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 10000],
+            {
+                'unit':"mm",
+                'description':"Position where the move to each point of the last scan completed. NaN if not reached.",
+            } ],
+        'ScanArrivalTimes':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 10000],
+            {
+                'unit':"s",
+                'description':"Host time the move to each point of the last scan completed, s since epoch. NaN if not reached.",
+            } ],
+        'ScanPointsDone':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Number of points of the last scan that have been reached.",
+            } ],
+        'HistoryLength':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ_WRITE],
+            {
+                'description':"Number of samples returned by the history attributes.",
+                'min value':0,
+                'Memorized':"true",
+            } ],
+        'HistorySince':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ_WRITE],
+            {
+                'unit':"s",
+                'description':"If > 0, the history attributes return the samples after this host time (s since epoch) instead of the last HistoryLength.",
+            } ],
+        'HistoryTime':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 100000],
+            {
+                'unit':"s",
+                'description':"Host time of the position history samples, s since epoch.",
+            } ],
+        'HistorySteps':
+            [[PyTango.DevLong,
+            PyTango.SPECTRUM,
+            PyTango.READ, 100000],
+            {
+                'unit':"microsteps",
+                'description':"Raw position of the position history samples.",
+            } ],
+        'HistoryPosition':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 100000],
+            {
+                'unit':"mm",
+                'description':"Calibrated position of the position history samples.",
+            } ],
+        'HistoryStatus':
+            [[PyTango.DevShort,
+            PyTango.SPECTRUM,
+            PyTango.READ, 100000],
+            {
+                'description':"Status code of the position history samples, -1 if unknown.",
+            } ],
+        'TraceLevel':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ_WRITE],
+            {
+                'description':"Trace level: 0 off, 1 commands and moves, 2 hardware I/O, 3 attribute reads",
+                'max value':3,
+                'min value':0,
+                'Memorized':"true",
+            } ],
+        'Trace':
+            [[PyTango.DevString,
+            PyTango.SPECTRUM,
+            PyTango.READ, 4096],
+            {
+                'description':"Last entries of the trace ring buffer, oldest first",
+            } ],
+        'LatencyBins':
+            [[PyTango.DevDouble,
+            PyTango.SPECTRUM,
+            PyTango.READ, 16],
+            {
+                'unit':"ms",
+                'description':"Upper edges of the latency histogram bins",
+            } ],
+        'LatencyHistogram':
+            [[PyTango.DevLong,
+            PyTango.SPECTRUM,
+            PyTango.READ, 16],
+            {
+                'description':"Round-trip latency histogram of all commands on the port",
+            } ],
+        'LatencyCommands':
+            [[PyTango.DevLong,
+            PyTango.SPECTRUM,
+            PyTango.READ, 256],
+            {
+                'description':"Command numbers of the rows of LatencyHistograms",
+            } ],
+        'LatencyHistograms':
+            [[PyTango.DevLong,
+            PyTango.IMAGE,
+            PyTango.READ, 16, 256],
+            {
+                'description':"Round-trip latency histogram of each command number in LatencyCommands, one per row",
+            } ],
+        'Timeouts':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Commands on the port that got no reply in time",
+            } ],
+        'ShortReads':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Serial reads on the port that timed out in the middle of a reply",
+            } ],
+        'Resyncs':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Times the reader lost the reply framing and resynchronized",
+            } ],
+        'DroppedBytes':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Bytes dropped by the reader to resynchronize the reply framing",
+            } ],
+        'UnsolicitedReplies':
+            [[PyTango.DevString,
+            PyTango.SPECTRUM,
+            PyTango.READ, 32],
+            {
+                'description':"Number of replies received without a request, per kind",
+            } ],
+        'ErrorReplies':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Error replies received on the port",
+            } ],
+        'CommandRate':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'unit':"1/s",
+                'description':"Commands written to the port per second",
+            } ],
+        'QueueDepth':
+            [[PyTango.DevLong,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'description':"Commands waiting in the command queue",
+            } ],
+        'QueueAge':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'unit':"s",
+                'description':"Time the oldest command in the command queue has been waiting",
+            } ],
+        'LoopJitter':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'unit':"ms",
+                'description':"Mean lateness of the last 100 state loop wake-ups",
+            } ],
+        'LoopJitterMax':
+            [[PyTango.DevDouble,
+            PyTango.SCALAR,
+            PyTango.READ],
+            {
+                'unit':"ms",
+                'description':"Largest lateness of the last 100 state loop wake-ups",
+            } ],
         }
 
 
@@ -0,0 +1,422 @@
+'''
+asyncio version of ZaberControl. The commands are coroutines running on an
+event loop, so one loop can drive many ports and axes, e.g. with
+asyncio.gather over the axes of a chain.
+
+Uses trollius, the asyncio backport for python 2.7, so coroutines are written
+with yield From(...) and return with raise Return(...). The serial port is
+read with loop.add_reader, which needs a selector event loop and a port with
+a file descriptor (posix). The replies are validated and routed by the
+ZaberPort code, see AsyncZaberPort.
+
+Example:
+    loop = asyncio.get_event_loop()
+    m = AsyncZaberControl('/dev/ttyUSB0', loop)
+    m.connect()
+    pos = loop.run_until_complete(asyncio.gather(m.getPosition(1), m.getPosition(2), loop = loop))
+
+@author: Filip Lindau
+'''
+
+import serial
+import time
+import trollius as asyncio
+from trollius import From, Return
+import zaber_control as zc
+from zaber_control import MotorCommand
+
+
+def resolve(future, reply):
+    if future.done() == False:
+        future.set_result(reply)
+
+
+class AsyncZaberRequest(zc.ZaberRequest):
+    ''' ZaberRequest that also resolves an asyncio future with the reply.
+    '''
+    def __init__(self, cmd, loop):
+        zc.ZaberRequest.__init__(self, cmd)
+        self.future = asyncio.Future(loop = loop)
+
+    def setReply(self, reply):
+        zc.ZaberRequest.setReply(self, reply)
+        resolve(self.future, reply)
+
+
+class AsyncZaberMoveRequest(zc.ZaberMoveRequest):
+    ''' ZaberMoveRequest that also resolves an asyncio future with the reply,
+    the completion or Stop reply.
+    '''
+    def __init__(self, cmd, loop):
+        zc.ZaberMoveRequest.__init__(self, cmd)
+        self.future = asyncio.Future(loop = loop)
+
+    def setReply(self, reply):
+        zc.ZaberMoveRequest.setReply(self, reply)
+        resolve(self.future, reply)
+
+
+class AsyncZaberBroadcastRequest(zc.ZaberBroadcastRequest):
+    ''' ZaberBroadcastRequest that also resolves an asyncio future with the
+    first reply.
+    '''
+    def __init__(self, cmd, loop):
+        zc.ZaberBroadcastRequest.__init__(self, cmd)
+        self.future = asyncio.Future(loop = loop)
+
+    def setReply(self, reply):
+        zc.ZaberBroadcastRequest.setReply(self, reply)
+        resolve(self.future, reply)
+
+
+class AsyncZaberPort(zc.ZaberPort):
+    ''' ZaberPort read by the event loop instead of a reader thread. The
+    frames are validated and routed by ZaberPort, so replies are matched,
+    moves interrupted by Stop and the framing resynced the same way. Reply
+    deadlines are kept by the waiting coroutines, there is no watchdog.
+    '''
+    def __init__(self, port, loop, baudrate = 9600):
+        zc.ZaberPort.__init__(self, port, baudrate)
+        self.loop = loop
+        self.rxBuffer = bytearray()
+
+    def open(self):
+        self.device = serial.Serial(self.port, self.baudrate, timeout = 0, parity = serial.PARITY_NONE, bytesize = 8, stopbits = serial.STOPBITS_ONE)
+        self.rxBuffer = bytearray()
+        self.loop.add_reader(self.device.fileno(), self.dataReceived)
+
+    def close(self):
+        if self.device != None:
+            self.loop.remove_reader(self.device.fileno())
+        # Wake up everybody waiting for a reply
+        with self.pendingLock:
+            pending = list(self.pending)
+        for req in pending:
+            if req.future.done() == False:
+                req.future.set_exception(serial.SerialException('Port closed'))
+        zc.ZaberPort.close(self)
+
+    def isOpen(self):
+        return self.device != None
+
+    def resync(self):
+        self.device.flushInput()
+        self.statistics.recordResync(self.rxBuffer.__len__())
+        self.rxBuffer = bytearray()
+
+    def dataReceived(self):
+        ''' Event loop callback when the serial port is readable.
+        '''
+        try:
+            data = self.device.read(max(1, self.device.inWaiting()))
+        except Exception, e:
+            print 'Serial error in dataReceived: error ', e
+            self.close()
+            return
+        self.rxBuffer.extend(data)
+        used = self.routeFrames(self.rxBuffer, self.rxBuffer.__len__())
+        if used > 0:
+            del self.rxBuffer[:used]
+
+
+class AsyncZaberControl(object):
+    def __init__(self, port, loop = None):
+        self.port = port
+        if loop == None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.device = None
+        self.timeout = 0.5
+        # Time without replies after which a broadcast is considered answered
+        self.quietTime = 0.05
+        # Move deadlines as in ZaberControl: modelled move time times
+        # moveTimeFactor plus moveTimeMargin s, or moveTimeout s if the move
+        # can not be modelled
+        self.moveTimeFactor = 1.5
+        self.moveTimeMargin = 1.0
+        self.moveTimeout = 120.0
+
+        self.errorDict = zc.errorDict
+
+    def connect(self, port = None):
+        if port != None:
+            self.port = port
+        if self.device != None:
+            self.close()
+        device = AsyncZaberPort(self.port, self.loop)
+        device.open()
+        self.device = device
+
+    def close(self):
+        if self.device != None:
+            try:
+                self.device.close()
+            finally:
+                self.device = None
+
+    def getStatistics(self):
+        ''' Returns the LinkStatistics of the port, or None if not connected.
+        '''
+        if self.device == None:
+            return None
+        return self.device.statistics
+
+    def sendCommand(self, cmd):
+        ''' Writes cmd and returns the AsyncZaberRequest waiting for its reply.
+        '''
+        if self.device == None:
+            self.connect()
+        return self.device.submitRequests([AsyncZaberRequest(cmd, self.loop)])[0]
+
+    def sendMove(self, cmd):
+        ''' Writes the move command cmd and returns the AsyncZaberMoveRequest
+        that completes when the move is done. Older moves in flight for the
+        device are interrupted.
+        '''
+        if self.device == None:
+            self.connect()
+        self.device.supersede([cmd.motor])
+        return self.device.submitRequests([AsyncZaberMoveRequest(cmd, self.loop)])[0]
+
+    @asyncio.coroutine
+    def waitReply(self, request, timeout):
+        ''' Waits for the reply to request, at most timeout s, or without
+        timeout if None. Returns the reply MotorCommand, or None on timeout.
+        Raises ValueError on an error reply. If the reply does not come, or the
+        waiting coroutine is cancelled, the request is expired, so its late
+        reply is recognized.
+        '''
+        try:
+            repCmd = yield From(asyncio.wait_for(request.future, timeout, loop = self.loop))
+        except asyncio.TimeoutError:
+            repCmd = None
+        finally:
+            if request.done() == False and self.device != None:
+                self.device.expire(request)
+        if repCmd != None and repCmd.command == 255:
+            errorMsg = self.errorDict[repCmd.data]
+            raise ValueError(''.join((errorMsg[0], ': ', errorMsg[1])))
+        raise Return(repCmd)
+
+    @asyncio.coroutine
+    def receiveData(self, request, timeout = None):
+        ''' Waits for the reply to request, at most timeout s or self.timeout
+        if None. Returns the reply MotorCommand, or None on timeout. Raises
+        ValueError on an error reply.
+        '''
+        if timeout == None:
+            timeout = self.timeout
+        repCmd = yield From(self.waitReply(request, timeout))
+        raise Return(repCmd)
+
+    @asyncio.coroutine
+    def sendReceive(self, cmd, timeout = None):
+        repCmd = yield From(self.receiveData(self.sendCommand(cmd), timeout))
+        raise Return(repCmd)
+
+    @asyncio.coroutine
+    def sendReceiveData(self, cmd, timeout = None):
+        ''' sendReceive returning the data of the reply, or None on timeout.
+        '''
+        repCmd = yield From(self.receiveData(self.sendCommand(cmd), timeout))
+        if repCmd == None:
+            raise Return(None)
+        raise Return(repCmd.data)
+
+    @asyncio.coroutine
+    def sendReceiveMove(self, cmd, timeout = None):
+        ''' Starts the move cmd and waits until it is done. Returns the data of
+        the completion reply, or of the Stop reply if it was stopped, None if
+        it timed out or was superseded. Without timeout the deadline is
+        modelled from the last known position and the speed and acceleration
+        known from earlier replies, as in ZaberControl.
+        '''
+        request = self.sendMove(cmd)
+        if timeout == None:
+            duration = zc.moveDuration(cmd, self.device.settings, self.device.lastPositions)
+            if duration == None:
+                timeout = self.moveTimeout
+            else:
+                timeout = self.moveTimeFactor*duration + self.moveTimeMargin
+        repCmd = yield From(self.waitReply(request, timeout))
+        if repCmd == None:
+            raise Return(None)
+        raise Return(repCmd.data)
+
+    @asyncio.coroutine
+    def broadcastReceive(self, cmd):
+        ''' Sends cmd to all devices on the chain and collects the replies until
+        the chain has been quiet for self.quietTime s, or self.timeout if nothing
+        answers. Returns a dict of device number: reply MotorCommand.
+        '''
+        cmd = MotorCommand(cmd.command, cmd.data, 0)
+        if self.device == None:
+            self.connect()
+        req = self.device.submitRequests([AsyncZaberBroadcastRequest(cmd, self.loop)])[0]
+        try:
+            # The first reply resolves the future
+            try:
+                yield From(asyncio.wait_for(req.future, max(0.0, req.t0 + self.timeout - time.time()), loop = self.loop))
+            except asyncio.TimeoutError:
+                pass
+            # Then wait until the chain has been quiet for quietTime, starting
+            # over whenever another reply arrives
+            while req.tLast != None:
+                waitTime = req.tLast + self.quietTime - time.time()
+                if waitTime <= 0:
+                    break
+                yield From(asyncio.sleep(waitTime, loop = self.loop))
+        finally:
+            if self.device != None:
+                self.device.cancel(req)
+        raise Return(dict(req.replies))
+
+    def cacheSetting(self, repCmd, setting):
+        ''' Keeps the speed and acceleration from the reply repCmd in the
+        settings cache of the port, for the move deadlines.
+        '''
+        if repCmd != None and self.device != None:
+            self.device.settings.put(repCmd.motor, setting, repCmd.data)
+
+    def currentFromData(self, repCmd):
+        if repCmd == None:
+            return None
+        if repCmd.data == 0:
+            return 0
+        return 10.0/repCmd.data
+
+    def currentToData(self, current):
+        if current > 10.0/127:
+            return int(10.0/current)
+        return 0
+
+#### Command list:
+    @asyncio.coroutine
+    def resetMotor(self, motor = 0):
+        yield From(self.sendReceive(MotorCommand(0, 0, motor)))
+
+    @asyncio.coroutine
+    def homeMotor(self, motor = 0, timeout = None):
+        ''' Homes the motor and waits until it is done, see sendReceiveMove.
+        '''
+        data = yield From(self.sendReceiveMove(MotorCommand(1, 0, motor), timeout))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def getDeviceId(self, motor = 0):
+        data = yield From(self.sendReceiveData(zc.queryCommand(50, 0, motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def getFirmwareVersion(self, motor = 0):
+        data = yield From(self.sendReceiveData(zc.queryCommand(51, 0, motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def getPosition(self, motor = 0):
+        data = yield From(self.sendReceiveData(zc.queryCommand(60, 0, motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def setPositionAbsolute(self, pos, motor = 0, timeout = None):
+        ''' Moves to pos and waits until the move is done, see sendReceiveMove.
+        '''
+        data = yield From(self.sendReceiveMove(MotorCommand(20, int(pos), motor), timeout))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def setPositionRelative(self, relPos, motor = 0, timeout = None):
+        data = yield From(self.sendReceiveMove(MotorCommand(21, int(relPos), motor), timeout))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def setTargetSpeed(self, speed, motor = 0):
+        repCmd = yield From(self.sendReceive(MotorCommand(42, int(speed), motor)))
+        self.cacheSetting(repCmd, 42)
+        raise Return(None if repCmd == None else repCmd.data)
+
+    @asyncio.coroutine
+    def getTargetSpeed(self, motor = 0):
+        repCmd = yield From(self.sendReceive(zc.queryCommand(53, 42, motor)))
+        self.cacheSetting(repCmd, 42)
+        raise Return(None if repCmd == None else repCmd.data)
+
+    @asyncio.coroutine
+    def setAcceleration(self, data, motor = 0):
+        repCmd = yield From(self.sendReceive(MotorCommand(43, int(data), motor)))
+        self.cacheSetting(repCmd, 43)
+        raise Return(None if repCmd == None else repCmd.data)
+
+    @asyncio.coroutine
+    def getAcceleration(self, motor = 0):
+        repCmd = yield From(self.sendReceive(zc.queryCommand(53, 43, motor)))
+        self.cacheSetting(repCmd, 43)
+        raise Return(None if repCmd == None else repCmd.data)
+
+    @asyncio.coroutine
+    def setCurrentPosition(self, data, motor = 0):
+        data = yield From(self.sendReceiveData(MotorCommand(45, int(data), motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def setMicrostepResolution(self, data, motor = 0):
+        data = yield From(self.sendReceiveData(MotorCommand(37, int(data), motor)))
+        # The device rescales the speeds with the resolution
+        if self.device != None:
+            self.device.settings.invalidate(motor, zc.SettingsCache.resolutionScaled)
+        raise Return(data)
+
+    @asyncio.coroutine
+    def getMicrostepResolution(self, motor = 0):
+        data = yield From(self.sendReceiveData(zc.queryCommand(53, 37, motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def stop(self, motor = 0):
+        ''' Stops motor and returns final postition
+        '''
+        data = yield From(self.sendReceiveData(MotorCommand(23, 0, motor)))
+        raise Return(data)
+
+    @asyncio.coroutine
+    def setRunningCurrent(self, data, motor = 0):
+        repCmd = yield From(self.sendReceive(MotorCommand(38, self.currentToData(data), motor)))
+        raise Return(self.currentFromData(repCmd))
+
+    @asyncio.coroutine
+    def getRunningCurrent(self, motor = 0):
+        repCmd = yield From(self.sendReceive(zc.queryCommand(53, 38, motor)))
+        raise Return(self.currentFromData(repCmd))
+
+    @asyncio.coroutine
+    def setHoldCurrent(self, data, motor = 0):
+        repCmd = yield From(self.sendReceive(MotorCommand(39, self.currentToData(data), motor)))
+        raise Return(self.currentFromData(repCmd))
+
+    @asyncio.coroutine
+    def getHoldCurrent(self, motor = 0):
+        repCmd = yield From(self.sendReceive(zc.queryCommand(53, 39, motor)))
+        raise Return(self.currentFromData(repCmd))
+
+    @asyncio.coroutine
+    def getStatus(self, motor = 0):
+        data = yield From(self.sendReceiveData(zc.queryCommand(54, 0, motor)))
+        if data == None:
+            raise Return((None, None))
+        raise Return(zc.decodeStatus(data))
+
+    @asyncio.coroutine
+    def getAllPositions(self):
+        ''' Reads the position of every device on the chain with one broadcast
+        frame. Returns a dict of device number: position.
+        '''
+        replies = yield From(self.broadcastReceive(MotorCommand(60, 0, 0)))
+        raise Return(dict([(motor, rep.data) for motor, rep in replies.items() if rep.command != 255]))
+
+    @asyncio.coroutine
+    def getAllStatus(self):
+        ''' Reads the status of every device on the chain with one broadcast
+        frame. Returns a dict of device number: status tuple as in getStatus.
+        '''
+        replies = yield From(self.broadcastReceive(MotorCommand(54, 0, 0)))
+        raise Return(dict([(motor, zc.decodeStatus(rep.data)) for motor, rep in replies.items() if rep.command != 255]))
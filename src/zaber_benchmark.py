@@ -0,0 +1,217 @@
+'''
+Link level benchmark of ZaberControl against the ZaberEmulator.
+
+Measures the round-trip latency (p50/p99) of every query and set command,
+queries per second per axis and per chain, and the time from the end of a
+move until it is detected, both with the move completion reply and with a
+status polling loop like the one in ZaberMotorDS.onHandler.
+
+The results are written as json. Given a baseline file from an earlier run,
+metrics that got worse than the tolerance are reported and the exit code is 1.
+
+    python zaber_benchmark.py -o results.json
+    python zaber_benchmark.py -o new.json --baseline results.json
+
+@author: Filip Lindau
+'''
+
+import sys
+import time
+import json
+import platform
+import argparse
+import numpy as np
+import zaber_control as zc
+from zaber_control import MotorCommand
+import zaber_emulator as ze
+
+# Commands timed in the latency benchmark: name: (command, data)
+latencyCommands = [('getPosition', (60, 0)),
+                   ('getStatus', (54, 0)),
+                   ('getDeviceId', (50, 0)),
+                   ('getFirmwareVersion', (51, 0)),
+                   ('getMicrostepResolution', (53, 37)),
+                   ('getRunningCurrent', (53, 38)),
+                   ('getHoldCurrent', (53, 39)),
+                   ('getTargetSpeed', (53, 42)),
+                   ('getAcceleration', (53, 43)),
+                   ('setMicrostepResolution', (37, 64)),
+                   ('setRunningCurrent', (38, 10)),
+                   ('setHoldCurrent', (39, 20)),
+                   ('setTargetSpeed', (42, 2000)),
+                   ('setAcceleration', (43, 4)),
+                   ('stop', (23, 0)),
+                   ]
+
+# Metrics where a larger value is better. For all others smaller is better.
+higherIsBetter = ('_qps',)
+
+
+def percentiles(samples):
+    ''' Returns p50, p99 and mean of the samples, in ms.
+    '''
+    a = np.array(samples)*1e3
+    return {'p50': np.percentile(a, 50), 'p99': np.percentile(a, 99), 'mean': a.mean()}
+
+
+class LinkBenchmark(object):
+    def __init__(self, devices = 2, baudrate = 9600, wireTiming = True, iterations = 100, duration = 2.0):
+        self.devices = devices
+        self.baudrate = baudrate
+        self.wireTiming = wireTiming
+        self.iterations = iterations
+        self.duration = duration
+        self.emulator = None
+        self.device = None
+        self.metrics = {}
+
+    def setUp(self):
+        self.emulator = ze.ZaberEmulator(self.devices, self.baudrate, self.wireTiming)
+        self.emulator.start()
+        self.device = zc.ZaberControl(self.emulator.port)
+        self.device.connect()
+
+    def tearDown(self):
+        self.device.close()
+        self.emulator.stop()
+
+    def addStats(self, name, samples):
+        for key, value in percentiles(samples).items():
+            self.metrics[''.join((name, '_', key, '_ms'))] = float(value)
+
+    def benchCommandLatency(self):
+        ''' Command to reply time of each command, on axis 1.
+        '''
+        for name, (command, data) in latencyCommands:
+            samples = []
+            for i in range(self.iterations):
+                cmd = MotorCommand(command, data, 1)
+                t0 = time.time()
+                self.device.sendReceive(cmd)
+                samples.append(time.time() - t0)
+            self.addStats(''.join(('latency_', name)), samples)
+
+    def benchThroughput(self):
+        ''' Position queries per second: sequential on one axis, pipelined over
+        all axes of the chain, and with broadcasts.
+        '''
+        n = 0
+        t0 = time.time()
+        while time.time() - t0 < self.duration:
+            self.device.getPosition(1)
+            n += 1
+        self.metrics['axis_sequential_qps'] = n/(time.time() - t0)
+
+        cmdList = [MotorCommand(60, 0, motor + 1) for motor in range(self.devices)]
+        n = 0
+        t0 = time.time()
+        while time.time() - t0 < self.duration:
+            self.device.sendReceivePipelined(cmdList)
+            n += cmdList.__len__()
+        self.metrics['chain_pipelined_qps'] = n/(time.time() - t0)
+
+        n = 0
+        t0 = time.time()
+        while time.time() - t0 < self.duration:
+            n += self.device.getAllPositions().__len__()
+        self.metrics['chain_broadcast_qps'] = n/(time.time() - t0)
+
+    def moveEnd(self, motor):
+        dev = self.emulator.getDevice(motor)
+        return dev.moveStart + dev.moveTime
+
+    def benchMoveCompletion(self, distance = 2000, waitTime = 0.2):
+        ''' Time from the end of a move until it is detected, with the move
+        completion reply and with the onHandler style polling loop that
+        alternates position and status reads every waitTime s.
+        '''
+        replySamples = []
+        pollSamples = []
+        moves = max(3, self.iterations/20)
+        target = 0
+        for i in range(moves):
+            target += distance
+            req = self.device.startPositionAbsolute(target, 1)
+            # The wait itself wakes up late on python 2, so the detection is
+            # timed from when the reader thread handed over the reply
+            req.wait(10.0)
+            if req.tReply != None:
+                replySamples.append(req.tReply - self.moveEnd(1))
+
+            target += distance
+            self.device.startPositionAbsolute(target, 1)
+            commandList = [self.device.getPosition, self.device.getStatus]
+            nextCommand = 0
+            while True:
+                out = commandList[nextCommand](1)
+                nextCommand = (nextCommand + 1) % commandList.__len__()
+                if nextCommand == 0 and out[0] == 0:
+                    break
+                time.sleep(waitTime)
+            pollSamples.append(time.time() - self.moveEnd(1))
+        self.addStats('move_detect_reply', replySamples)
+        self.addStats('move_detect_poll', pollSamples)
+
+    def run(self):
+        self.setUp()
+        try:
+            self.benchCommandLatency()
+            self.benchThroughput()
+            self.benchMoveCompletion()
+        finally:
+            self.tearDown()
+        return {'metadata': {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                             'host': platform.node(),
+                             'python': platform.python_version(),
+                             'devices': self.devices,
+                             'baudrate': self.baudrate,
+                             'wireTiming': self.wireTiming,
+                             'iterations': self.iterations},
+                'metrics': self.metrics}
+
+
+def compareBaseline(results, baseline, tolerance):
+    ''' Returns a list of (metric, baseline value, new value) for the metrics
+    that are worse than the baseline by more than the fraction tolerance.
+    '''
+    regressions = []
+    for name, old in sorted(baseline['metrics'].items()):
+        new = results['metrics'].get(name)
+        if new == None or old == 0:
+            continue
+        if name.endswith(higherIsBetter):
+            worse = new < old*(1 - tolerance)
+        else:
+            worse = new > old*(1 + tolerance)
+        if worse == True:
+            regressions.append((name, old, new))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the ZaberControl link against an emulated chain')
+    parser.add_argument('-o', '--output', default = 'zaber_benchmark.json', help = 'result file (json)')
+    parser.add_argument('--baseline', help = 'earlier result file to compare with')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed relative regression')
+    parser.add_argument('-n', '--devices', type = int, default = 2, help = 'number of devices on the chain')
+    parser.add_argument('-b', '--baudrate', type = int, default = 9600, help = 'baud rate for the wire timing')
+    parser.add_argument('--no-timing', action = 'store_true', help = 'do not simulate the wire timing')
+    parser.add_argument('-i', '--iterations', type = int, default = 100, help = 'samples per latency measurement')
+    parser.add_argument('-d', '--duration', type = float, default = 2.0, help = 'seconds per throughput measurement')
+    args = parser.parse_args()
+
+    bench = LinkBenchmark(args.devices, args.baudrate, args.no_timing == False, args.iterations, args.duration)
+    results = bench.run()
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+    for name, value in sorted(results['metrics'].items()):
+        print '%-45s %10.3f' % (name, value)
+
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareBaseline(results, baseline, args.tolerance)
+        for name, old, new in regressions:
+            print 'REGRESSION %-34s %10.3f -> %10.3f' % (name, old, new)
+        if regressions.__len__() > 0:
+            sys.exit(1)
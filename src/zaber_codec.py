@@ -0,0 +1,51 @@
+'''
+Codec of the 6 byte Zaber binary protocol frames: device number (u1),
+command number (u1) and data (<i4).
+
+Single frames are packed and unpacked with one precompiled struct.Struct,
+unpacking straight from the reader buffer. Many frames at a time, e.g. a pipelined burst, broadcast replies or a recorded byte stream
+for replay analysis, are encoded and decoded in one go as numpy structured
+arrays of frameDtype.
+
+@author: Filip Lindau
+'''
+
+import struct
+import numpy as np
+
+FRAME_SIZE = 6
+
+frameStruct = struct.Struct('<2Bi')
+
+frameDtype = np.dtype([('motor', 'u1'), ('command', 'u1'), ('data', '<i4')])
+
+
+def encodeFrame(motor, command, data):
+    return frameStruct.pack(motor, command, data)
+
+
+def decodeFrame(buf, offset = 0):
+    ''' Returns (motor, command, data) of the frame at offset in buf, which
+    may be a string, bytearray or memoryview.
+    '''
+    return frameStruct.unpack_from(buf, offset)
+
+
+def encodeFrames(motors, commands, data):
+    ''' Returns the bytes of the frames of the commands given as sequences
+    (or scalars, broadcast) of device numbers, command numbers and data.
+    '''
+    data = np.asarray(data)
+    n = max(np.size(motors), np.size(commands), data.size)
+    frames = np.empty(n, dtype = frameDtype)
+    frames['motor'] = motors
+    frames['command'] = commands
+    frames['data'] = data
+    return frames.tostring()
+
+
+def decodeFrames(buf):
+    ''' Returns the complete frames in buf as an array of frameDtype. The
+    array is a view of buf, copy it if buf is reused.
+    '''
+    return np.frombuffer(buf, dtype = frameDtype, count = len(buf)//FRAME_SIZE)
@@ -5,58 +5,1362 @@ Created on 10 Dec 2015
 '''
 
 import serial
-import struct
 import time
+import threading
+import collections
+import bisect
+import heapq
+import math
+import copy
+import zaber_codec as codec
+
+# T-series binary units: speed data * SPEED_UNIT is in microsteps/s and
+# acceleration data * ACCELERATION_UNIT is in microsteps/s^2
+SPEED_UNIT = 9.375
+ACCELERATION_UNIT = 11250.0
+# ASCII protocol maxspeed and accel units per microstep/s and microstep/s^2
+ASCII_SPEED_UNIT = 1.6384
+ASCII_ACCELERATION_UNIT = 1.6384e-4
+
+errorDict = {1: ['Cannot home', 'Home - Device has traveled a long distance without triggering the home sensor. Device may be stalling or slipping.'],
+             2: ['Device number invalid', 'Renumbering data out of range.'],
+             14: ['Voltage low', 'Power supply data too low.'],
+             15: ['Voltage high', 'Power supply data too high.'],
+             18: ['Stored position invalid', 'The position stored in the requested register is no longer valid. This is probably because the maximum range was reduced.'],
+             20: ['Absolute position invalid', 'Move Absolute - Target position out of range.'],
+             21: ['Relative position invalid', 'Move Relative - Target position out of range.'],
+             22: ['Velocity invalid', 'Constant velocity move. Velocity out of range.'],
+             36: ['Peripheral ID invalid', 'Restore Settings - peripheral id is invalid. Please use one of the peripheral ids listed in the user manual, or 0 for default.'],
+             37: ['Resolution invalid', 'Invalid microstep resolution. Resolution may only be 1, 2, 4, 8, 16, 32, 64, 128.'],
+             38: ['Run current invalid', 'Run current out of range. See command 38 for allowable values.'],
+             39: ['Hold current invalid', 'Hold current out of range. See command 39 for allowable values.'],
+             40: ['Mode invalid', 'Set Device Mode - one or more of the mode bits is invalid'],
+             41: ['Home speed invalid', 'Home speed out of range. The range of home speed is determined by the resolution.'],
+             42: ['Speed invalid', 'Target speed out of range. The range of target speed is determined by the resolution.'],
+             43: ['Acceleration invalid', 'Target acceleration out of range. The range of target acceleration is determined by the resolution'],
+             44: ['Maximum range invalid', 'The maximum range may only be set between 1 and the resolution limit of the stepper controller, which is 16,777,215.'],
+             45: ['Current position invalid', 'Current position out of range. Current position must be between 0 and the maximum range.'],
+             46: ['Maximum relative move invalid', 'Max relative move out of range. Must be between 0 and 16,777,215.'],
+             47: ['Offset invalid', 'Home offset out of range. Home offset must be between 0 and maximum range.'],
+             48: ['Alias invalid', 'Alias out of range.'],
+             49: ['Lock state invalid', 'Lock state must be 1 (locked) or 0 (unlocked).'],
+             53: ['Setting invalid', 'Return Setting - data entered is not a valid setting command number. Valid setting command numbers are the command numbers of any "Set ..." instructions.'],
+             64: ['Command invalid', 'Command number not valid in this firmware version.'],
+             255: ['Busy', 'Another command is executing and cannot be pre-empted. Either stop the previous command or wait until it finishes before trying again.'],
+             1600: ['Save position invalid', 'Save Current Position register out of range (must be 0-15).'],
+             1601: ['Save position not homed', 'Save Current Position is not allowed unless the device has been homed.'],
+             1700: ['Return position invalid', 'Return Stored Position register out of range (must be 0-15).'],
+             1800: ['Move position invalid', 'Move to Stored Position register out of range (must be 0-15).'],
+             1801: ['Move position not homed', 'Move to Stored Position is not allowed unless the device has been homed.'],
+             2146: ['Relative position limited', 'Move Relative (command 20) exceeded maximum relative move range. Either move a shorter distance, or change the maximum relative move (command 46).'],
+             3600: ['Settings locked', 'Must clear Lock State (command 49) first. See the Set Lock State command for details.'],
+             4008: ['Disable auto home invalid', 'Set Device Mode - this is a linear actuator; Disable Auto Home is used for rotary actuators only.'],
+             4010: ['Bit 10 invalid', 'Set Device Mode - bit 10 is reserved and must be 0.'],
+             4012: ['Home switch invalid', 'Set Device Mode - this device has integrated home sensor with preset polarity; mode bit 12 cannot be changed by the user.'],
+             4013: ['Bit 13 invalid', 'Set Device Mode - bit 13 is reserved and must be 0.']
+             }
+
+# Items of ZaberControl.readDevice: name: (command, data) of the query
+deviceQueries = {'deviceId': (50, 0),
+                 'firmwareVersion': (51, 0),
+                 'microstepResolution': (53, 37),
+                 'runningCurrent': (53, 38),
+                 'holdCurrent': (53, 39),
+                 'targetSpeed': (53, 42),
+                 'acceleration': (53, 43),
+                 'status': (54, 0),
+                 'position': (60, 0),
+                 }
 
 class MotorCommand(object):
     def __init__(self, command, data, motor = 0):
         self.command = command
         self.data = data
         self.motor = motor
-        self.cmd = struct.pack('<2Bi', motor, command, data)
+        self.cmd = codec.frameStruct.pack(motor, command, data)
+
+# Commands of the constant queries: device id, firmware version, return
+# setting, status and position
+queryCommands = (50, 51, 53, 54, 60)
+queryCache = {}
+
+def queryCommand(command, data, motor):
+    ''' Returns the MotorCommand of a constant query. They are made once and
+    reused, MotorCommands are never changed after they are made.
+    '''
+    key = (motor, command, data)
+    cmd = queryCache.get(key)
+    if cmd == None:
+        cmd = MotorCommand(command, data, motor)
+        queryCache[key] = cmd
+    return cmd
+
+class ZaberRequest(object):
+    ''' A command written to the chain that is waiting for its reply. The reply
+    is matched on the device number and the reply command number, which is the
+    command number except for Return Setting (53) where it is the setting number.
+    A request sent to device 0 is answered by any device.
+    '''
+    collect = False
+    isMove = False
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        if cmd.command == 53:
+            self.replyCommand = cmd.data
+        else:
+            self.replyCommand = cmd.command
+        self.reply = None
+        self.t0 = None
+        # Replies queued on the link ahead of this one when it was written
+        self.ahead = 0
+        # Time the reply arrived
+        self.tReply = None
+        self.event = threading.Event()
+        self.callbackLock = threading.Lock()
+        self.callbacks = []
+
+    def matches(self, motor, command):
+        if self.cmd.motor != 0 and self.cmd.motor != motor:
+            return False
+        return command == self.replyCommand or command == 255
+
+    def setReply(self, reply):
+        self.reply = reply
+        self.tReply = time.time()
+        with self.callbackLock:
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+    def addDoneCallback(self, fn):
+        ''' Calls fn(request) when the reply has arrived. The call is made from
+        the port reader thread, or immediately if the request is already done.
+        '''
+        with self.callbackLock:
+            if self.event.is_set() == False:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout = None):
+        ''' Waits for the reply. Returns the reply MotorCommand, or None on timeout.
+        '''
+        self.event.wait(timeout)
+        return self.reply
+
+class ZaberMoveRequest(ZaberRequest):
+    ''' A Home, Move Absolute or Move Relative command. The device replies with
+    the final position when the move is completed, so the request stays in
+    flight for the whole move and works as a completion future.
+    A Stop reply from the device completes the request with the Stop reply,
+    and a newer move to the same device completes it with reply None. In both
+    cases interrupted is set.
+    '''
+    isMove = True
+
+    def __init__(self, cmd):
+        ZaberRequest.__init__(self, cmd)
+        self.interrupted = False
+
+    def interrupt(self, reply):
+        self.interrupted = True
+        self.setReply(reply)
+
+class ZaberBroadcastMoveRequest(ZaberMoveRequest):
+    ''' A Home or move command sent to device 0, moving every device on the
+    chain. It completes when all devices in motors have sent their completion
+    reply, or a Stop reply, which are kept in a dict of device number: reply
+    MotorCommand. A newer move on one of the devices drops it from motors.
+    '''
+    collect = True
+
+    def __init__(self, cmd, motors):
+        ZaberMoveRequest.__init__(self, cmd)
+        self.motors = set(motors)
+        self.replies = {}
+
+    def setReply(self, reply):
+        if reply != None:
+            self.replies[reply.motor] = reply
+        if self.event.is_set() == False and (reply == None or self.motors.issubset(self.replies.keys()) == True):
+            ZaberRequest.setReply(self, reply)
+
+    def drop(self, motor):
+        self.motors.discard(motor)
+        if self.event.is_set() == False and self.motors.issubset(self.replies.keys()) == True:
+            ZaberRequest.setReply(self, self.reply)
+
+    def positions(self):
+        ''' Returns a dict of device number: final position, None for devices
+        that gave an error reply or no reply.
+        '''
+        positions = {}
+        for motor in self.motors:
+            rep = self.replies.get(motor)
+            if rep == None or rep.command == 255:
+                positions[motor] = None
+            else:
+                positions[motor] = rep.data
+        return positions
+
+    def completed(self):
+        ''' Returns the set of device numbers that sent the completion reply of
+        the move, not a Stop or error reply.
+        '''
+        return set([motor for motor in self.motors if self.replies.get(motor) != None
+                    and self.replies[motor].command == self.cmd.command])
+
+class ZaberMoveGroup(object):
+    ''' Moves on several devices, tracked together. Completes when all the
+    ZaberMoveRequests in requests are done. The devices moved are in motors,
+    like for a ZaberBroadcastMoveRequest.
+    '''
+    def __init__(self, requests):
+        self.requests = requests
+        self.motors = set([req.cmd.motor for req in requests])
+        self.lock = threading.Lock()
+        self.remaining = requests.__len__()
+        self.event = threading.Event()
+        self.callbacks = []
+        if self.remaining == 0:
+            self.event.set()
+        for req in requests:
+            req.addDoneCallback(self.requestDone)
+
+    def requestDone(self, request):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return
+            self.event.set()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+    def addDoneCallback(self, fn):
+        ''' Calls fn(group) when all moves are done, at once if they already are.
+        '''
+        with self.lock:
+            if self.event.is_set() == False:
+                self.callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout = None):
+        ''' Waits for all moves. Returns True if they are done.
+        '''
+        self.event.wait(timeout)
+        return self.event.is_set()
+
+    def positions(self):
+        ''' Returns a dict of device number: final position, None for devices
+        that gave an error reply or were superseded.
+        '''
+        positions = {}
+        for req in self.requests:
+            rep = req.reply
+            if rep == None or rep.command == 255:
+                positions[req.cmd.motor] = None
+            else:
+                positions[req.cmd.motor] = rep.data
+        return positions
+
+    def completed(self):
+        ''' Returns the set of device numbers that sent the completion reply of
+        their move, not a Stop or error reply.
+        '''
+        return set([req.cmd.motor for req in self.requests if req.reply != None
+                    and req.reply.command == req.cmd.command])
+
+class ZaberBroadcastRequest(ZaberRequest):
+    ''' A command sent to device 0 that collects the replies from every device
+    on the chain. It stays in flight until it is cancelled. The replies are
+    kept in a dict of device number: reply MotorCommand.
+    '''
+    collect = True
+
+    def __init__(self, cmd):
+        ZaberRequest.__init__(self, cmd)
+        self.replies = {}
+        self.tLast = None
+
+    def setReply(self, reply):
+        self.replies[reply.motor] = reply
+        self.reply = reply
+        self.tLast = time.time()
+        self.tReply = self.tLast
+        self.event.set()
+
+def decodeStatus(data):
+    ''' Returns the (status code, description) tuple for the data of a Return Status reply.
+    '''
+    if data == 0:
+        status = (0, 'idle')
+    elif data == 1:
+        status = (1, 'homing')
+    elif data == 10:
+        status = (10, 'manual move')
+    elif data == 18:
+        status = (18, 'move to stored pos')
+    elif data == 20:
+        status = (20, 'absolute move')
+    elif data == 21:
+        status = (21, 'relative move')
+    elif data == 22:
+        status = (22, 'constant move')
+    elif data == 23:
+        status = (23, 'stop')
+    else:
+        status = (None, None)
+    return status
+
+class MotionProfile(object):
+    ''' Trapezoidal velocity profile of a move from start to target, in
+    microsteps, started at time t0. speed and acceleration are in microsteps/s
+    and microsteps/s^2. Gives the duration of the move and the modelled
+    position during it.
+    '''
+    def __init__(self, start, target, speed, acceleration, t0 = 0.0):
+        self.start = start
+        self.target = target
+        self.t0 = t0
+        self.distance = abs(target - start)
+        if self.distance*acceleration < speed*speed:
+            # Triangular profile, never reaches the target speed
+            speed = math.sqrt(self.distance*acceleration)
+        self.peakSpeed = speed
+        self.acceleration = acceleration
+        if speed > 0:
+            self.accTime = speed/acceleration
+            self.cruiseTime = self.distance/speed - self.accTime
+        else:
+            self.accTime = 0.0
+            self.cruiseTime = 0.0
+        self.duration = 2*self.accTime + self.cruiseTime
+        self.tArrival = t0 + self.duration
+
+    def travelled(self, dt):
+        ''' Distance covered dt s after the start of the move.
+        '''
+        if dt <= 0:
+            return 0.0
+        elif dt < self.accTime:
+            return 0.5*self.acceleration*dt*dt
+        elif dt < self.accTime + self.cruiseTime:
+            return 0.5*self.peakSpeed*self.accTime + self.peakSpeed*(dt - self.accTime)
+        elif dt < self.duration:
+            tDec = self.duration - dt
+            return self.distance - 0.5*self.acceleration*tDec*tDec
+        return self.distance
+
+    def position(self, t):
+        s = self.travelled(t - self.t0)
+        if self.target < self.start:
+            return self.start - s
+        return self.start + s
+
+    def timeToArrival(self, t):
+        return max(0.0, self.tArrival - t)
+
+    def corrected(self, position, t):
+        ''' Returns a copy of the profile shifted in time so that it passes
+        through position, read at time t. Positions outside the move are
+        clamped to its start or end.
+        '''
+        if self.target < self.start:
+            s = self.start - position
+        else:
+            s = position - self.start
+        s = min(max(s, 0.0), self.distance)
+        # travelled is monotonic, find the time it reaches s by bisection
+        low = 0.0
+        high = self.duration
+        for i in range(30):
+            mid = 0.5*(low + high)
+            if self.travelled(mid) < s:
+                low = mid
+            else:
+                high = mid
+        profile = copy.copy(self)
+        profile.t0 = t - 0.5*(low + high)
+        profile.tArrival = profile.t0 + self.duration
+        return profile
+
+def moveDuration(cmd, settings, lastPositions):
+    ''' Upper bound of the time in s the move cmd on one device takes: the time
+    of a move from rest over the distance from the device position in the dict
+    lastPositions, with the speed and acceleration in the SettingsCache
+    settings. Returns None if they are not known.
+    '''
+    if cmd.motor == 0:
+        return None
+    if cmd.command == 1:
+        speedSetting = 41
+    else:
+        speedSetting = 42
+    # Any age will do, the deadline has a margin
+    speed = settings.get(cmd.motor, speedSetting)
+    acceleration = settings.get(cmd.motor, 43)
+    position = lastPositions.get(cmd.motor)
+    if speed == None or acceleration == None or speed <= 0 or acceleration <= 0:
+        return None
+    if cmd.command == 21:
+        distance = abs(cmd.data)
+    elif position == None:
+        return None
+    elif cmd.command == 1:
+        # The home sensor is near position 0
+        distance = abs(position)
+    else:
+        distance = abs(cmd.data - position)
+    return MotionProfile(0, distance, speed*SPEED_UNIT, acceleration*ACCELERATION_UNIT).duration
+
+def matchReply(pending, repCmd):
+    ''' Finds the request in the list pending that the reply repCmd answers and
+    removes it from the list, unless it collects several replies. Returns the
+    request, or None if the reply does not match any request in flight. An
+    error reply only goes to a move if it carries the command number of the
+    move.
+    '''
+    match = None
+    if repCmd.command == 255:
+        # Error replies carry the error code, which for most errors is
+        # the offending command number. Prefer that request.
+        for req in pending:
+            if req.matches(repCmd.motor, 255) == True and req.cmd.command == repCmd.data:
+                match = req
+                break
+        if match == None:
+            # Other codes, e.g. Busy, answer the oldest request that is not a
+            # move. A move stays in flight until it completes, so it is most
+            # likely not the command that was rejected.
+            for req in pending:
+                if req.isMove == False and req.matches(repCmd.motor, 255) == True:
+                    match = req
+                    break
+    else:
+        for req in pending:
+            if req.matches(repCmd.motor, repCmd.command) == True:
+                match = req
+                break
+    if match != None and match.collect == False:
+        pending.remove(match)
+    return match
+
+class LinkStatistics(object):
+    ''' Communication statistics of a port: round-trip latency histograms per
+    command number, counts of timeouts, short reads and error replies, and the
+    rate of commands written, and framing resyncs with the number of bytes
+    dropped. Recorded from the port reader thread and the threads sending
+    commands.
+
+    Also keeps a smoothed round-trip time and its mean deviation per command
+    number, as TCP does for its retransmission timeout, for choosing reply
+    timeouts. A timeout doubles the backoff factor of the command until the
+    next reply. The estimates are not cleared by reset.
+    '''
+    # Upper edges of the latency histogram bins in ms. The last bin counts
+    # everything slower.
+    latencyBins = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+    # Time in s over which the command rate is averaged
+    rateWindow = 1.0
+    # Gains of the round-trip time and deviation estimates
+    rttGain = 0.125
+    rttDeviationGain = 0.25
+    maxBackoff = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # command: [smoothed round trip, mean deviation, backoff]
+        self.roundTrips = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.timeouts = 0
+            self.shortReads = 0
+            self.errorReplies = 0
+            self.resyncs = 0
+            self.droppedBytes = 0
+            self.commandsSent = 0
+            self.tReset = time.time()
+            self.tWindow = self.tReset
+            self.windowCount = 0
+            self.lastRate = 0.0
+
+    def recordSent(self, n = 1):
+        t = time.time()
+        with self.lock:
+            self.commandsSent += n
+            self.windowCount += n
+            if t - self.tWindow >= self.rateWindow:
+                self.lastRate = self.windowCount/(t - self.tWindow)
+                self.tWindow = t
+                self.windowCount = 0
+
+    def recordReply(self, command, latency, error = False):
+        ''' Records the reply to a command. latency is the round-trip time in s,
+        None if it should not be counted, e.g. for the completion of a move.
+        '''
+        with self.lock:
+            if error == True:
+                self.errorReplies += 1
+            if latency != None:
+                h = self.histograms.get(command)
+                if h == None:
+                    h = [0] * (self.latencyBins.__len__() + 1)
+                    self.histograms[command] = h
+                h[bisect.bisect_left(self.latencyBins, latency*1e3)] += 1
+
+    def recordRoundTrip(self, command, rtt):
+        ''' Updates the round-trip estimate of command with the time rtt in s,
+        not counting time spent waiting behind other replies.
+        '''
+        with self.lock:
+            est = self.roundTrips.get(command)
+            if est == None:
+                self.roundTrips[command] = [rtt, 0.5*rtt, 1]
+            else:
+                est[1] += self.rttDeviationGain*(abs(rtt - est[0]) - est[1])
+                est[0] += self.rttGain*(rtt - est[0])
+                est[2] = 1
+
+    def roundTrip(self, command):
+        ''' Returns (smoothed round trip, mean deviation, backoff) of command,
+        or None if it has not been measured.
+        '''
+        with self.lock:
+            est = self.roundTrips.get(command)
+            if est == None:
+                return None
+            return tuple(est)
+
+    def recordTimeout(self, command):
+        with self.lock:
+            self.timeouts += 1
+            est = self.roundTrips.get(command)
+            if est != None:
+                est[2] = min(2*est[2], self.maxBackoff)
+
+    def recordShortRead(self):
+        with self.lock:
+            self.shortReads += 1
+
+    def recordResync(self, droppedBytes):
+        with self.lock:
+            self.resyncs += 1
+            self.droppedBytes += droppedBytes
+
+    def commandRate(self):
+        ''' Commands written per s, averaged over the last rateWindow.
+        '''
+        with self.lock:
+            dt = time.time() - self.tWindow
+            if dt >= self.rateWindow:
+                return self.windowCount/dt
+            return self.lastRate
+
+    def histogram(self, command = None):
+        ''' Returns the latency histogram of command, or the sum over all
+        commands if command is None.
+        '''
+        with self.lock:
+            if command != None:
+                return list(self.histograms.get(command, [0] * (self.latencyBins.__len__() + 1)))
+            total = [0] * (self.latencyBins.__len__() + 1)
+            for h in self.histograms.values():
+                total = [a + b for a, b in zip(total, h)]
+            return total
+
+    def commands(self):
+        ''' Command numbers with a latency histogram, sorted.
+        '''
+        with self.lock:
+            return sorted(self.histograms.keys())
+
+class SettingsCache(object):
+    ''' Last known data of the device settings, by device number and setting
+    command number, with the time it was known. Filled from the replies to set
+    commands, which carry the value that was applied, and to Return Setting.
+    '''
+    # Settings the device rescales when the microstep resolution is changed
+    resolutionScaled = (41, 42, 43, 44)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (device, setting): (data, time)
+        self.values = {}
+
+    def get(self, motor, setting, maxAge = None):
+        ''' Returns the data of setting on device motor, or None if it is not
+        known or was known more than maxAge s ago.
+        '''
+        entry = self.values.get((motor, setting))
+        if entry == None:
+            return None
+        if maxAge != None and time.time() - entry[1] > maxAge:
+            return None
+        return entry[0]
+
+    def put(self, motor, setting, data):
+        with self.lock:
+            self.values[(motor, setting)] = (data, time.time())
+
+    def invalidate(self, motor = 0, settings = None):
+        ''' Forgets the settings in the sequence settings, or all settings if
+        None, of device motor, or of all devices if motor is 0.
+        '''
+        with self.lock:
+            for key in self.values.keys():
+                if (motor == 0 or key[0] == motor) and (settings == None or key[1] in settings):
+                    del self.values[key]
+
+
+class ZaberPort(object):
+    ''' One serial handle to a Zaber daisy chain, shared by all ZaberControl
+    objects using the same port. Commands are submitted as ZaberRequests and
+    may be pipelined: several frames are written back-to-back and each request
+    is kept in flight until a reader thread matches a reply to it by device
+    number and reply command number. Requests in flight for the same device
+    and command are answered in order.
+    Replies that do not match any request in flight are unsolicited. They are
+    counted and kept in unmatchedReplies, and counted per kind in
+    unsolicitedCounts. Link statistics are collected in statistics.
+
+    The reader validates each frame before it is used: its device must have
+    a request in flight for that reply, or be known from earlier replies and
+    send a reply a device sends on its own, or a late reply to a request that
+    timed out. A frame that is not valid means the framing was lost, e.g. by
+    a dropped byte, and the reader slides one byte at a time until frames are
+    valid again. The start of a frame that is not completed within the read
+    timeout is dropped too, as the bytes of a frame arrive back-to-back.
+
+    The known device settings are kept in settings, a SettingsCache, and the
+    last position known from the replies of each device in lastPositions.
+
+    Reply deadlines are kept by a watchdog thread, see watch, so the threads
+    waiting for replies wait without a timeout and wake up as soon as the
+    reply is routed.
+    '''
+    # The Stop reply carries the final position
+    stopReplyPosition = True
+    # Time in s after a request to device 0 that replies of more devices are expected
+    extraReplyWindow = 1.0
+    # Replies devices send without a request: command: kind
+    unsolicitedKinds = {1: 'move done', 18: 'move done', 20: 'move done', 21: 'move done',
+                        8: 'move tracking', 10: 'manual move', 11: 'manual move',
+                        9: 'limit active', 13: 'slip', 14: 'unexpected position',
+                        23: 'stop', 255: 'error'}
+    # Replies carrying the position of the device
+    positionReplies = (1, 20, 21, 23, 45, 60)
+
+    def __init__(self, port, baudrate = 9600):
+        self.port = port
+        self.baudrate = baudrate
+        self.device = None
+        self.users = 0
+        self.writeLock = threading.Lock()
+        self.pendingLock = threading.Lock()
+        self.pending = []
+        self.unmatchedReplies = collections.deque(maxlen = 100)
+        self.unmatchedCount = 0
+        self.unsolicitedCounts = {}
+        # Devices that have replied to a request
+        self.knownDevices = set()
+        # Requests that timed out, to recognize their late replies
+        self.expired = collections.deque(maxlen = 16)
+        # Last position of each device known from the replies, by device number
+        self.lastPositions = {}
+        # Requests to device 0 answered by the first device, to recognize the
+        # replies of the other devices
+        self.answeredToAll = collections.deque(maxlen = 16)
+        self.statistics = LinkStatistics()
+        self.settings = SettingsCache()
+        self.readerThread = None
+        self.stopReaderFlag = False
+        # Set by resync, the reader drops what it holds
+        self.resyncFlag = False
+        # Heap of (deadline, sequence number, request) watched by the watchdog
+        self.deadlines = []
+        self.deadlineCount = 0
+        self.deadlineCondition = threading.Condition()
+        self.watchdogThread = None
+
+    def open(self):
+        self.device = serial.Serial(self.port, self.baudrate, timeout = 0.1, parity = serial.PARITY_NONE, bytesize = 8, stopbits = serial.STOPBITS_ONE)
+        self.stopReaderFlag = False
+        self.readerThread = threading.Thread(target = self.readerLoop, name = ''.join(('ZaberPort ', str(self.port))))
+        self.readerThread.daemon = True
+        self.readerThread.start()
+        self.watchdogThread = threading.Thread(target = self.watchdogLoop, name = ''.join(('ZaberPort watchdog ', str(self.port))))
+        self.watchdogThread.daemon = True
+        self.watchdogThread.start()
+
+    def close(self):
+        self.stopReaderFlag = True
+        with self.deadlineCondition:
+            self.deadlines = []
+            self.deadlineCondition.notify()
+        for thread in (self.readerThread, self.watchdogThread):
+            if thread != None and thread is not threading.current_thread():
+                thread.join(1.0)
+        self.readerThread = None
+        self.watchdogThread = None
+        with self.pendingLock:
+            pending = self.pending
+            self.pending = []
+        # Wake up everybody waiting, moves will never complete now
+        for req in pending:
+            if req.isMove == True:
+                req.interrupt(None)
+            elif req.collect == False:
+                req.setReply(None)
+        if self.device != None:
+            try:
+                self.device.close()
+            finally:
+                self.device = None
+
+    def isOpen(self):
+        ''' Returns True if the serial port is open and the reader thread is alive.
+        '''
+        return self.device != None and self.readerThread != None and self.readerThread.is_alive()
+
+    def resync(self):
+        ''' Drops the bytes waiting in the input buffer and the partial reply
+        held by the reader, so reading starts again at the next reply. The
+        requests whose replies are dropped time out.
+        '''
+        self.resyncFlag = True
+        self.device.flushInput()
+
+    def submit(self, cmd):
+        ''' Writes cmd and returns the ZaberRequest tracking its reply.
+        '''
+        return self.submitMany([cmd])[0]
+
+    def submitMany(self, cmdList):
+        ''' Writes all commands back-to-back in one write and returns a list
+        of ZaberRequests, one per command.
+        '''
+        return self.submitRequests([ZaberRequest(cmd) for cmd in cmdList])
+
+    def submitMove(self, cmd):
+        ''' Writes the move command cmd and returns the ZaberMoveRequest that
+        completes when the move is done. Older moves in flight for the same
+        device are interrupted.
+        '''
+        return self.submitMoves([cmd])[0]
+
+    def submitMoves(self, cmdList):
+        ''' Writes the move commands back-to-back in one write, so the moves
+        start with the least skew, and returns a list of ZaberMoveRequests.
+        Older moves in flight for the same devices are interrupted.
+        '''
+        self.supersede([cmd.motor for cmd in cmdList])
+        return self.submitRequests([ZaberMoveRequest(cmd) for cmd in cmdList])
+
+    def submitBroadcastMove(self, cmd, motors):
+        ''' Writes the move command cmd to device 0, moving all devices with one
+        frame, and returns the ZaberBroadcastMoveRequest that completes when
+        the devices in motors are done. All moves in flight are interrupted.
+        '''
+        self.supersede(None)
+        return self.submitRequests([ZaberBroadcastMoveRequest(cmd, motors)])[0]
+
+    def supersede(self, motors):
+        ''' Interrupts the moves in flight for the devices in motors, or all
+        moves if motors is None.
+        '''
+        with self.pendingLock:
+            superseded = []
+            for r in self.pending:
+                if r.isMove == False:
+                    continue
+                if motors == None or r.cmd.motor in motors:
+                    superseded.append(r)
+                elif r.collect == True:
+                    for motor in motors:
+                        r.drop(motor)
+            for r in superseded:
+                self.pending.remove(r)
+        for r in superseded:
+            r.interrupt(None)
+
+    def submitBroadcast(self, cmd):
+        ''' Writes cmd to device 0 and returns the ZaberBroadcastRequest
+        collecting the replies. Cancel it when done.
+        '''
+        return self.submitRequests([ZaberBroadcastRequest(cmd)])[0]
+
+    def submitRequests(self, requests):
+        with self.writeLock:
+            if self.device == None:
+                raise serial.SerialException(''.join(('Port ', str(self.port), ' not open')))
+            frames = ''.join([self.encodeRequest(req) for req in requests])
+            # Register the requests before writing so a fast reply is not dropped
+            t0 = time.time()
+            with self.pendingLock:
+                ahead = 0
+                for r in self.pending:
+                    if r.isMove == False:
+                        ahead += 1
+                for req in requests:
+                    req.t0 = t0
+                    req.ahead = ahead
+                    if req.isMove == False:
+                        ahead += 1
+                    self.pending.append(req)
+            try:
+                self.device.write(frames)
+            except Exception:
+                for req in requests:
+                    self.cancel(req)
+                raise
+        self.statistics.recordSent(requests.__len__())
+        return requests
+
+    def encodeRequest(self, req):
+        ''' Returns the bytes to write for the request.
+        '''
+        return req.cmd.cmd
+
+    def cancel(self, request):
+        ''' Stops tracking request. Returns False if it was no longer in flight.
+        '''
+        with self.pendingLock:
+            try:
+                self.pending.remove(request)
+            except ValueError:
+                return False
+        return True
+
+    def expire(self, request):
+        ''' Stops tracking request that got no reply in time. A late reply to it
+        is recognized as such. Returns False if it was no longer in flight.
+        '''
+        with self.pendingLock:
+            try:
+                self.pending.remove(request)
+            except ValueError:
+                return False
+            self.expired.append(request)
+        self.statistics.recordTimeout(request.cmd.command)
+        return True
+
+    def watch(self, request, deadline):
+        ''' Expires request at the time deadline if it is still in flight, and
+        completes it with reply None.
+        '''
+        with self.deadlineCondition:
+            self.deadlineCount += 1
+            heapq.heappush(self.deadlines, (deadline, self.deadlineCount, request))
+            if self.deadlines[0][2] is request:
+                self.deadlineCondition.notify()
+
+    def watchdogLoop(self):
+        while self.stopReaderFlag == False:
+            due = []
+            with self.deadlineCondition:
+                t = time.time()
+                while self.deadlines.__len__() > 0 and self.deadlines[0][0] <= t:
+                    due.append(heapq.heappop(self.deadlines)[2])
+                if due.__len__() == 0:
+                    if self.deadlines.__len__() > 0:
+                        self.deadlineCondition.wait(self.deadlines[0][0] - t)
+                    else:
+                        self.deadlineCondition.wait(1.0)
+            for req in due:
+                if req.done() == False and self.expire(req) == True:
+                    if req.isMove == True:
+                        req.interrupt(None)
+                    else:
+                        req.setReply(None)
+
+    def inFlight(self):
+        return self.pending.__len__()
+
+    def recordReply(self, request, repCmd):
+        ''' Adds the reply repCmd to request to the statistics. The completion
+        of a move is not a round trip and only counts if it is an error.
+        '''
+        error = repCmd.command == 255
+        if request.isMove == True and error == False:
+            latency = None
+        else:
+            latency = time.time() - request.t0
+            if error == False and request.collect == False:
+                self.statistics.recordRoundTrip(request.cmd.command, max(0.0, latency - request.ahead*self.transactionTime()))
+        self.statistics.recordReply(request.cmd.command, latency, error)
+        if error == False and repCmd.command in self.positionReplies:
+            self.lastPositions[repCmd.motor] = repCmd.data
+
+    def transactionTime(self):
+        ''' Wire time in s of one command and its reply.
+        '''
+        # 2 frames of 6 bytes, 10 bits per byte
+        return 120.0/self.baudrate
+
+    def classifyUnsolicited(self, repCmd):
+        ''' Returns the kind of a reply that matches no request in flight, or
+        None if it is not a valid frame. Call with pendingLock held.
+        '''
+        t = time.time()
+        for req in self.answeredToAll:
+            if req.matches(repCmd.motor, repCmd.command) == True and t - req.t0 < self.extraReplyWindow:
+                self.knownDevices.add(repCmd.motor)
+                return 'reply to all'
+        if repCmd.motor not in self.knownDevices:
+            return None
+        for req in self.expired:
+            if req.matches(repCmd.motor, repCmd.command) == True:
+                self.expired.remove(req)
+                if req.isMove == False and repCmd.command != 255:
+                    # The reply is unambiguous, so its round trip still counts
+                    self.statistics.recordRoundTrip(req.cmd.command, max(0.0, time.time() - req.t0 - req.ahead*self.transactionTime()))
+                return 'late reply'
+        return self.unsolicitedKinds.get(repCmd.command)
+
+    def routeReply(self, frame, offset = 0):
+        ''' Matches the reply frame at offset in the buffer frame to a request.
+        Returns False if the frame is not valid.
+        '''
+        motorId, motorCommand, data = codec.decodeFrame(frame, offset)
+        if motorId == 0:
+            # Devices never reply as device 0
+            return False
+        repCmd = MotorCommand(motorCommand, data, motorId)
+        interrupted = []
+        kind = None
+        with self.pendingLock:
+            match = matchReply(self.pending, repCmd)
+            if match != None:
+                self.knownDevices.add(motorId)
+                if match.cmd.motor == 0 and match.collect == False:
+                    self.answeredToAll.append(match)
+            else:
+                kind = self.classifyUnsolicited(repCmd)
+                if kind == None:
+                    return False
+            if motorCommand == 23:
+                # A stop ends the moves in flight on the device without their own reply
+                interrupted = [r for r in self.pending if r.isMove == True and r.cmd.motor in (0, motorId)]
+                for r in interrupted:
+                    if r.collect == False:
+                        self.pending.remove(r)
+        for r in interrupted:
+            r.interrupt(repCmd)
+        if match != None:
+            self.recordReply(match, repCmd)
+            match.setReply(repCmd)
+        else:
+            self.unmatchedCount += 1
+            self.unmatchedReplies.append(repCmd)
+            self.unsolicitedCounts[kind] = self.unsolicitedCounts.get(kind, 0) + 1
+        # Broadcast moves stay in flight until every device has replied
+        for r in interrupted + [match]:
+            if r != None and r.isMove == True and r.collect == True and r.done() == True:
+                self.cancel(r)
+        return True
+
+    def routeFrames(self, buf, n):
+        ''' Routes the complete frames in the first n bytes of buf. Slides one
+        byte past a frame that is not valid, to find the framing again. Returns
+        the number of bytes used, the rest is the start of a partial frame.
+        '''
+        frameSize = codec.FRAME_SIZE
+        offset = 0
+        dropped = 0
+        while n - offset >= frameSize:
+            if self.routeReply(buf, offset) == True:
+                offset += frameSize
+            else:
+                offset += 1
+                dropped += 1
+        if dropped > 0:
+            self.statistics.recordResync(dropped)
+        return offset
+
+    def readerLoop(self):
+        ''' Reads replies into a reused buffer. Waits for one frame at a time,
+        and takes all frames that are already waiting in one read. Resyncs the
+        framing when a frame is not valid or not completed in time.
+        '''
+        frameSize = codec.FRAME_SIZE
+        size = 64*frameSize
+        buf = bytearray(size)
+        view = memoryview(buf)
+        n = 0
+        while self.stopReaderFlag == False:
+            try:
+                want = frameSize - n % frameSize
+                waiting = self.device.inWaiting()
+                if waiting > want:
+                    want = min(waiting, size - n)
+                got = self.device.readinto(view[n:n + want])
+            except Exception, e:
+                if self.stopReaderFlag == False:
+                    print 'Serial error in ZaberPort reader: port = ', self.port, ' error ', e
+                break
+            if self.resyncFlag == True:
+                # Drop what was held before the resync. The bytes just read
+                # may be new replies, they are validated as usual.
+                self.resyncFlag = False
+                self.statistics.recordResync(n)
+                buf[0:got] = buf[n:n + got]
+                n = 0
+            if got < want and (got > 0 or n > 0):
+                # The read timed out in the middle of a frame
+                self.statistics.recordShortRead()
+                if got == 0:
+                    # Nothing more came, the rest of the frame is lost
+                    self.statistics.recordResync(n)
+                    n = 0
+                    continue
+            n += got
+            offset = self.routeFrames(buf, n)
+            if offset > 0:
+                # Keep the start of a partial frame
+                buf[0:n - offset] = buf[offset:n]
+                n -= offset
+
+class ZaberAsciiPort(ZaberPort):
+    ''' ZaberPort speaking the Zaber ASCII protocol, by default at 115200 baud.
+    The binary MotorCommands are translated to ASCII commands carrying a
+    message id. The replies are parsed line by line as they arrive, matched
+    by message id and translated back to binary style reply MotorCommands,
+    so ZaberControl works the same with both protocols.
+
+    Home, moves and stop are completed when the device sends an IDLE alert
+    (comm.alert is switched on when the port opens), with the position read
+    back by get pos, like the binary completion replies.
+
+    Binary device numbers are used as ASCII device numbers. Axis commands go
+    to axis 1 unless axisMap maps the device number to a (device, axis) tuple.
+    Status is reported as 0 (idle) or 20 (busy), since ASCII does not tell
+    what kind of move is running. Speed and acceleration are converted between
+    T-series binary units and ASCII units. Currents are scaled with
+    currentScale, the driver.current.run value at full current.
+    '''
+    asciiCommands = {0: 'system reset', 1: 'home', 20: 'move abs', 21: 'move rel', 23: 'stop',
+                     37: 'set resolution', 38: 'set driver.current.run', 39: 'set driver.current.hold',
+                     42: 'set maxspeed', 43: 'set accel', 45: 'set pos',
+                     50: 'get deviceid', 51: 'get version', 54: '', 60: 'get pos'}
+    asciiSettings = {37: 'resolution', 38: 'driver.current.run', 39: 'driver.current.hold', 42: 'maxspeed', 43: 'accel'}
+    # Commands with a data argument
+    dataCommands = (20, 21, 37, 38, 39, 42, 43, 45)
+    # Device scope commands, sent to axis 0
+    deviceCommands = (0, 50, 51)
+    # Commands that are completed by the IDLE alert
+    idleCommands = (1, 20, 21, 23)
+
+    # The stop reply comes before the device is idle and has no position
+    stopReplyPosition = False
+
+    def __init__(self, port, baudrate = 115200):
+        ZaberPort.__init__(self, port, baudrate)
+        self.axisMap = {}
+        self.currentScale = 100.0
+        self.nextMsgId = 0
+
+    def open(self):
+        ZaberPort.open(self)
+        # Have the devices report when a move is done
+        self.device.write('/0 0 set comm.alert 1\n')
+
+    def submitBroadcastMove(self, cmd, motors):
+        ''' Moves on device 0 are completed per device by the IDLE alerts, so
+        the move is written to each device in motors instead, back-to-back.
+        Returns a ZaberMoveGroup.
+        '''
+        return ZaberMoveGroup(self.submitMoves([MotorCommand(cmd.command, cmd.data, motor) for motor in motors]))
+
+    def toAsciiData(self, command, data):
+        if command == 42:
+            return int(round(data*SPEED_UNIT*ASCII_SPEED_UNIT))
+        elif command == 43:
+            return int(round(data*ACCELERATION_UNIT*ASCII_ACCELERATION_UNIT))
+        elif command in (38, 39):
+            if data == 0:
+                return 0
+            return int(round(10.0/data*self.currentScale))
+        return int(data)
+
+    def transactionTime(self):
+        ''' Wire time in s of a typical command and reply line.
+        '''
+        # About 20 + 30 characters, 10 bits per character
+        return 500.0/self.baudrate
+
+    def fromAsciiData(self, command, value):
+        if command == 42:
+            return int(round(value/(SPEED_UNIT*ASCII_SPEED_UNIT)))
+        elif command == 43:
+            return int(round(value/(ACCELERATION_UNIT*ASCII_ACCELERATION_UNIT)))
+        elif command in (38, 39):
+            if value == 0:
+                return 0
+            return int(round(10.0*self.currentScale/value))
+        return int(value)
+
+    def encodeRequest(self, req):
+        cmd = req.cmd
+        if cmd.motor == 0:
+            device, axis = 0, 0
+        else:
+            device, axis = self.axisMap.get(cmd.motor, (cmd.motor, 1))
+        if cmd.command in self.deviceCommands:
+            axis = 0
+        if cmd.command == 53:
+            try:
+                text = ' '.join(('get', self.asciiSettings[cmd.data]))
+            except KeyError:
+                raise ValueError(''.join(('Setting ', str(cmd.data), ' not supported with the ASCII protocol')))
+        else:
+            try:
+                text = self.asciiCommands[cmd.command]
+            except KeyError:
+                raise ValueError(''.join(('Command ', str(cmd.command), ' not supported with the ASCII protocol')))
+            if cmd.command in self.dataCommands:
+                text = ' '.join((text, str(self.toAsciiData(cmd.command, cmd.data))))
+        req.msgId = self.freeMsgId()
+        req.asciiDevice = device
+        req.awaitingIdle = False
+        return ''.join(('/', ' '.join((str(device), str(axis), '%02d' % req.msgId, text)).strip(), '\n'))
+
+    def freeMsgId(self):
+        ''' Returns the next message id that is not used by a request in flight,
+        e.g. a move waiting for IDLE, or by one that timed out and may still
+        get its late reply. Raises ValueError if all are used.
+        '''
+        with self.pendingLock:
+            used = set([getattr(r, 'msgId', None) for r in self.pending])
+            used.update([getattr(r, 'msgId', None) for r in self.expired])
+        for i in range(100):
+            msgId = self.nextMsgId
+            self.nextMsgId = (self.nextMsgId + 1) % 100
+            if msgId not in used:
+                return msgId
+        raise ValueError('No free ASCII message id')
+
+    def errorCode(self, cmd, reason):
+        ''' Binary error code for an ASCII rejection reason.
+        '''
+        if reason in ('BUSY', 'AGAIN'):
+            return 255
+        if reason == 'BADDATA' and cmd.command in errorDict:
+            return cmd.command
+        return 64
+
+    def replyData(self, cmd, status, data):
+        if cmd.command == 54:
+            if status == 'IDLE':
+                return 0
+            return 20
+        if cmd.command in self.dataCommands:
+            # Binary set commands reply with the value that was set
+            return cmd.data
+        try:
+            value = float(data.split()[0])
+        except (ValueError, IndexError):
+            return 0
+        if cmd.command == 51:
+            return int(round(value*100))
+        elif cmd.command == 53:
+            return self.fromAsciiData(cmd.data, value)
+        return int(value)
+
+    def readerLoop(self):
+        buf = ''
+        while self.stopReaderFlag == False:
+            try:
+                data = self.device.read(max(1, self.device.inWaiting()))
+            except Exception, e:
+                if self.stopReaderFlag == False:
+                    print 'Serial error in ZaberAsciiPort reader: port = ', self.port, ' error ', e
+                break
+            if self.resyncFlag == True:
+                # Drop the partial line held before the resync
+                self.resyncFlag = False
+                self.statistics.recordResync(buf.__len__())
+                buf = ''
+            buf = ''.join((buf, data))
+            while True:
+                i = buf.find('\n')
+                if i < 0:
+                    break
+                line = buf[:i].strip()
+                buf = buf[i+1:]
+                if line != '':
+                    self.routeLine(line)
+
+    def routeLine(self, line):
+        fields = line.split()
+        try:
+            device = int(fields[0][1:])
+        except ValueError:
+            self.unmatchedCount += 1
+            return
+        if line[0] == '!':
+            # Alert: !01 1 IDLE --
+            if fields[2:3] == ['IDLE']:
+                self.completeIdle(device)
+            return
+        if line[0] != '@':
+            # Info messages
+            return
+        try:
+            msgId = int(fields[2])
+            flag, status = fields[3], fields[4]
+        except (ValueError, IndexError):
+            # A reply without message id is not ours
+            self.unmatchedCount += 1
+            self.unmatchedReplies.append(line)
+            return
+        data = ' '.join(fields[6:])
+        with self.pendingLock:
+            match = None
+            for req in self.pending:
+                if getattr(req, 'awaitingIdle', False) == True:
+                    # Already acknowledged, completed by the IDLE alert
+                    continue
+                if getattr(req, 'msgId', None) == msgId and req.asciiDevice in (0, device):
+                    match = req
+                    break
+            if match != None:
+                waitIdle = flag == 'OK' and match.collect == False and match.cmd.command in self.idleCommands
+                if match.collect == False and waitIdle == False:
+                    self.pending.remove(match)
+        if match == None:
+            self.unmatchedCount += 1
+            self.unmatchedReplies.append(line)
+            return
+        motor = match.cmd.motor
+        if motor == 0:
+            motor = device
+        if flag != 'OK':
+            repCmd = MotorCommand(255, self.errorCode(match.cmd, data), motor)
+            self.recordReply(match, repCmd)
+            match.setReply(repCmd)
+        elif waitIdle == True:
+            match.awaitingIdle = True
+            if status == 'IDLE':
+                # Nothing to move, or already there
+                self.completeIdle(device)
+        else:
+            repCmd = MotorCommand(match.replyCommand, self.replyData(match.cmd, status, data), motor)
+            self.recordReply(match, repCmd)
+            match.setReply(repCmd)
+
+    def completeIdle(self, device):
+        ''' The ASCII device has become idle. Reads its position and completes
+        the home, move and stop requests waiting for it.
+        '''
+        with self.pendingLock:
+            waiting = [r for r in self.pending if getattr(r, 'awaitingIdle', False) == True and r.asciiDevice == device]
+        if waiting.__len__() == 0:
+            return
+        posReq = ZaberRequest(queryCommand(60, 0, waiting[0].cmd.motor))
+        posReq.addDoneCallback(lambda r: self.idleDone(waiting, r))
+        try:
+            self.submitRequests([posReq])
+        except Exception, e:
+            print 'Error in ZaberAsciiPort completeIdle: error ', e
+
+    def idleDone(self, waiting, posReq):
+        pos = posReq.reply
+        if pos != None and pos.command == 255:
+            pos = None
+        with self.pendingLock:
+            done = [r for r in waiting if r in self.pending]
+            for r in done:
+                self.pending.remove(r)
+        stopReply = None
+        for r in done:
+            if r.cmd.command == 23:
+                if pos != None:
+                    stopReply = MotorCommand(23, pos.data, pos.motor)
+                r.setReply(stopReply)
+        for r in done:
+            if r.cmd.command == 23:
+                continue
+            if stopReply != None and r.isMove == True:
+                r.interrupt(stopReply)
+            elif pos != None:
+                r.setReply(MotorCommand(r.replyCommand, pos.data, pos.motor))
+            else:
+                r.setReply(None)
+
+protocolDict = {'binary': ZaberPort, 'ascii': ZaberAsciiPort}
+
+class ZaberPortManager(object):
+    ''' Process wide registry of the open ZaberPorts, one per serial port name.
+    The port is opened by the first acquire and closed when the last user
+    has released it.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ports = {}
+
+    def acquire(self, port, protocol = 'binary'):
+        with self.lock:
+            p = self.ports.get(port)
+            if p == None:
+                p = protocolDict[protocol](port)
+            elif p.__class__ is not protocolDict[protocol]:
+                raise ValueError(''.join(('Port ', str(port), ' is already used with another protocol')))
+            if p.isOpen() == False:
+                # New port, or the reader died on a serial error: (re)open it
+                p.close()
+                p.open()
+            self.ports[port] = p
+            p.users += 1
+        return p
+
+    def release(self, zaberPort):
+        with self.lock:
+            zaberPort.users -= 1
+            if zaberPort.users <= 0:
+                if self.ports.get(zaberPort.port) is zaberPort:
+                    del self.ports[zaberPort.port]
+                zaberPort.close()
+
+portManager = ZaberPortManager()
 
 class ZaberControl(object):
-    def __init__(self, port):
+    def __init__(self, port, protocol = 'binary'):
+        ''' protocol is 'binary' (9600 baud) or 'ascii' (115200 baud).
+        '''
         self.port = port
+        self.protocol = protocol
         self.device = None
+        # Reply timeout before the round trip of a command has been measured,
+        # and the longest timeout it adapts to
+        self.timeout = 0.5
+        # Shortest reply timeout
+        self.minTimeout = 0.02
+        # Time without replies after which a broadcast is considered answered
+        self.quietTime = 0.05
+        # Settings known longer than this are read again, never if None
+        self.settingsMaxAge = None
+        # Move deadlines: modelled move time times moveTimeFactor plus
+        # moveTimeMargin s, or moveTimeout s if the move can not be modelled
+        self.moveTimeFactor = 1.5
+        self.moveTimeMargin = 1.0
+        self.moveTimeout = 120.0
         
-        self.errorDict = {1: ['Cannot home', 'Home - Device has traveled a long distance without triggering the home sensor. Device may be stalling or slipping.'],
-                     2: ['Device number invalid', 'Renumbering data out of range.'],
-                     14: ['Voltage low', 'Power supply data too low.'],
-                     15: ['Voltage high', 'Power supply data too high.'],
-                     18: ['Stored position invalid', 'The position stored in the requested register is no longer valid. This is probably because the maximum range was reduced.'],
-                     20: ['Absolute position invalid', 'Move Absolute - Target position out of range.'],
-                     21: ['Relative position invalid', 'Move Relative - Target position out of range.'],
-                     22: ['Velocity invalid', 'Constant velocity move. Velocity out of range.'],
-                     36: ['Peripheral ID invalid', 'Restore Settings - peripheral id is invalid. Please use one of the peripheral ids listed in the user manual, or 0 for default.'],
-                     37: ['Resolution invalid', 'Invalid microstep resolution. Resolution may only be 1, 2, 4, 8, 16, 32, 64, 128.'],
-                     38: ['Run current invalid', 'Run current out of range. See command 38 for allowable values.'],
-                     39: ['Hold current invalid', 'Hold current out of range. See command 39 for allowable values.'],
-                     40: ['Mode invalid', 'Set Device Mode - one or more of the mode bits is invalid'],
-                     41: ['Home speed invalid', 'Home speed out of range. The range of home speed is determined by the resolution.'],
-                     42: ['Speed invalid', 'Target speed out of range. The range of target speed is determined by the resolution.'],
-                     43: ['Acceleration invalid', 'Target acceleration out of range. The range of target acceleration is determined by the resolution'],
-                     44: ['Maximum range invalid', 'The maximum range may only be set between 1 and the resolution limit of the stepper controller, which is 16,777,215.'],
-                     45: ['Current position invalid', 'Current position out of range. Current position must be between 0 and the maximum range.'],
-                     46: ['Maximum relative move invalid', 'Max relative move out of range. Must be between 0 and 16,777,215.'],
-                     47: ['Offset invalid', 'Home offset out of range. Home offset must be between 0 and maximum range.'],
-                     48: ['Alias invalid', 'Alias out of range.'],
-                     49: ['Lock state invalid', 'Lock state must be 1 (locked) or 0 (unlocked).'],
-                     53: ['Setting invalid', 'Return Setting - data entered is not a valid setting command number. Valid setting command numbers are the command numbers of any "Set ..." instructions.'],
-                     64: ['Command invalid', 'Command number not valid in this firmware version.'],
-                     255: ['Busy', 'Another command is executing and cannot be pre-empted. Either stop the previous command or wait until it finishes before trying again.'],
-                     1600: ['Save position invalid', 'Save Current Position register out of range (must be 0-15).'],
-                     1601: ['Save position not homed', 'Save Current Position is not allowed unless the device has been homed.'],
-                     1700: ['Return position invalid', 'Return Stored Position register out of range (must be 0-15).'],
-                     1800: ['Move position invalid', 'Move to Stored Position register out of range (must be 0-15).'],
-                     1801: ['Move position not homed', 'Move to Stored Position is not allowed unless the device has been homed.'],
-                     2146: ['Relative position limited', 'Move Relative (command 20) exceeded maximum relative move range. Either move a shorter distance, or change the maximum relative move (command 46).'],
-                     3600: ['Settings locked', 'Must clear Lock State (command 49) first. See the Set Lock State command for details.'],
-                     4008: ['Disable auto home invalid', 'Set Device Mode - this is a linear actuator; Disable Auto Home is used for rotary actuators only.'],
-                     4010: ['Bit 10 invalid', 'Set Device Mode - bit 10 is reserved and must be 0.'],
-                     4012: ['Home switch invalid', 'Set Device Mode - this device has integrated home sensor with preset polarity; mode bit 12 cannot be changed by the user.'],
-                     4013: ['Bit 13 invalid', 'Set Device Mode - bit 13 is reserved and must be 0.']
-                     }
+        self.errorDict = errorDict
         
     def connect(self, port = None):
         if port != None:
@@ -64,78 +1368,321 @@ class ZaberControl(object):
         if self.device != None:
             self.close()
         try:
-            self.device = serial.Serial(self.port, 9600, timeout = 0.5, parity = serial.PARITY_NONE, bytesize = 8, stopbits = serial.STOPBITS_ONE)
+            self.device = portManager.acquire(self.port, self.protocol)
         except Exception, e:
             self.device =  None
             raise e
+        # The devices may have been reset, replaced or moved while disconnected
+        self.device.settings.invalidate()
+        self.device.lastPositions.clear()
         
     
     def close(self):
         if self.device != None:
             try:
-                self.device.close()
+                portManager.release(self.device)
                 self.device = None
             except Exception, e:
                 self.device = None
                 raise e
         
     
+    def resync(self):
+        ''' Restarts the reply framing on the open port, dropping the input
+        waiting. Returns False if the port is not open.
+        '''
+        if self.device == None or self.device.isOpen() == False:
+            return False
+        self.device.resync()
+        return True
+
+    def pollInterval(self, utilization = 0.5):
+        ''' Shortest poll period in s that gives each user of the port a fair
+        share of the link, keeping the total load below utilization.
+        '''
+        if self.device == None:
+            return 0.0
+        return self.device.users*self.device.transactionTime()/utilization
+
+    def getStatistics(self):
+        ''' Returns the LinkStatistics of the port, shared by all users of the
+        port, or None if not connected.
+        '''
+        if self.device == None:
+            return None
+        return self.device.statistics
+
+    def getUnsolicitedCounts(self):
+        ''' Returns a dict of the number of unsolicited replies on the port
+        per kind, empty if not connected.
+        '''
+        if self.device == None:
+            return {}
+        return dict(getattr(self.device, 'unsolicitedCounts', {}))
+
+    def resetStatistics(self):
+        if self.device != None:
+            self.device.statistics.reset()
+
+    def commandTimeout(self, request):
+        ''' Time in s after request was written that its reply is overdue. From
+        the measured round trips of the command, with a margin of one wire
+        transaction, plus the wire time of the replies queued ahead of it.
+        self.timeout for broadcasts, commands not measured yet, and Stop, whose
+        reply comes when the device has decelerated.
+        '''
+        command = request.cmd.command
+        est = self.device.statistics.roundTrip(command)
+        if est == None or command == 23 or request.cmd.motor == 0:
+            return self.timeout
+        wire = self.device.transactionTime()
+        rtt, deviation, backoff = est
+        timeout = backoff*(rtt + 4*deviation + wire)
+        return min(self.timeout, max(self.minTimeout, timeout)) + request.ahead*wire
+
     def sendCommand(self, cmd):
+        ''' Writes cmd to the chain and returns the ZaberRequest waiting for its
+        reply, which is completed with reply None if it does not come within
+        commandTimeout.
+        '''
         if self.device == None:
             self.connect()
         
+        req = None
         try:
-            self.device.write(cmd.cmd)
+            req = self.device.submit(cmd)
+            self.device.watch(req, req.t0 + self.commandTimeout(req))
         except serial.SerialException, e:
             print 'Error in sendCommand: cmd = ', cmd.cmd, ' error ', e
-            self.device = None
+            self.close()
         except Exception, e:
             print e
+        return req
     
-    def receiveData(self):
-        try:
-            reply = self.device.read(6)
-        except serial.SerialException, e:
-            print 'Serial Error in receiveData: reply = ', reply, ' error ', e
-            self.device = None
-        except Exception, e:
-            repCmd = MotorCommand(255, 255, 0)
-            print 'Error in receiveData: reply = ', repr(reply), ' error ', e
-        if reply.__len__() == 6:
-            motorId, motorCommand, data = struct.unpack('<2Bi', reply)
-            repCmd = MotorCommand(motorCommand, data, motorId)
-            if motorCommand == 255:
-                errorMsg = self.errorDict[data]
-                raise ValueError(''.join((errorMsg[0], ': ', errorMsg[1])))
-        else:
-            repCmd = None
+    def receiveData(self, request):
+        ''' Waits for the reply to request. Returns the reply MotorCommand, or
+        None on timeout. Raises ValueError on an error reply.
+        '''
+        if request == None:
+            return None
+        return self.checkReply(request.wait())
+
+    def checkReply(self, repCmd):
+        ''' Returns the reply MotorCommand repCmd. Raises ValueError if it is an
+        error reply.
+        '''
+        if repCmd != None and repCmd.command == 255:
+            errorMsg = self.errorDict[repCmd.data]
+            raise ValueError(''.join((errorMsg[0], ': ', errorMsg[1])))
         return repCmd
             
     def sendReceive(self, cmd):
-        self.sendCommand(cmd)
-        return self.receiveData()
+        return self.receiveData(self.sendCommand(cmd))
+
+    def sendMove(self, cmd):
+        ''' Writes the move command cmd and returns the ZaberMoveRequest that
+        completes when the move is done, without waiting.
+        '''
+        if self.device == None:
+            self.connect()
+        try:
+            return self.device.submitMove(cmd)
+        except serial.SerialException, e:
+            print 'Error in sendMove: cmd = ', cmd.cmd, ' error ', e
+            self.close()
+            raise
+
+    def sendMoves(self, cmdList):
+        ''' Writes the move commands back-to-back without waiting and returns a
+        ZaberMoveGroup that completes when all moves are done.
+        '''
+        if self.device == None:
+            self.connect()
+        try:
+            return ZaberMoveGroup(self.device.submitMoves(cmdList))
+        except serial.SerialException, e:
+            print 'Error in sendMoves: error ', e
+            self.close()
+            raise
+
+    def sendBroadcastMove(self, cmd, motors):
+        ''' Writes the move command cmd to all devices without waiting and
+        returns the request that completes when the devices in motors are done.
+        '''
+        if self.device == None:
+            self.connect()
+        try:
+            return self.device.submitBroadcastMove(MotorCommand(cmd.command, cmd.data, 0), motors)
+        except serial.SerialException, e:
+            print 'Error in sendBroadcastMove: cmd = ', cmd.cmd, ' error ', e
+            self.close()
+            raise
+
+    def sendPipelined(self, cmdList):
+        ''' Writes all commands back-to-back without waiting for replies in between.
+        Returns the list of ZaberRequests. Collect the replies with receiveData.
+        '''
+        if self.device == None:
+            self.connect()
+        try:
+            requests = self.device.submitMany(cmdList)
+            for req in requests:
+                self.device.watch(req, req.t0 + self.commandTimeout(req))
+            return requests
+        except serial.SerialException, e:
+            print 'Error in sendPipelined: error ', e
+            self.close()
+            return [None] * cmdList.__len__()
+
+    def sendReceivePipelined(self, cmdList):
+        ''' Pipelined sendReceive. Returns a list with, for each command, the reply
+        MotorCommand, None on timeout, or the exception raised by receiveData.
+        '''
+        replies = []
+        for req in self.sendPipelined(cmdList):
+            try:
+                replies.append(self.receiveData(req))
+            except Exception, e:
+                replies.append(e)
+        return replies
             
+    def broadcastReceive(self, cmd):
+        ''' Sends cmd to all devices on the chain and collects the replies until
+        the chain has been quiet for self.quietTime s, or self.timeout if nothing
+        answers. Returns a dict of device number: reply MotorCommand. Error
+        replies are included.
+        '''
+        cmd = MotorCommand(cmd.command, cmd.data, 0)
+        if self.device == None:
+            self.connect()
+        try:
+            req = self.device.submitBroadcast(cmd)
+        except serial.SerialException, e:
+            print 'Error in broadcastReceive: cmd = ', cmd.cmd, ' error ', e
+            self.close()
+            return {}
+        # The first reply sets the event, so the wait ends as soon as it arrives
+        req.event.wait(max(0.0, req.t0 + self.timeout - time.time()))
+        # Then wait until the chain has been quiet for quietTime, starting over
+        # whenever another reply arrives
+        while req.tLast != None:
+            waitTime = req.tLast + self.quietTime - time.time()
+            if waitTime <= 0:
+                break
+            time.sleep(waitTime)
+        if self.device != None:
+            self.device.cancel(req)
+        return dict(req.replies)
+
+    def moveDuration(self, cmd):
+        ''' Upper bound of the time in s the move cmd on one device takes, see
+        moveDuration. Nothing is read from the device.
+        '''
+        if self.device == None:
+            return None
+        return moveDuration(cmd, self.device.settings, self.device.lastPositions)
+
+    def receiveMove(self, request):
+        ''' Waits for the move request to complete, with a deadline from
+        moveDuration. Returns the reply MotorCommand, or None if the deadline
+        passed or the move was superseded. Raises ValueError on an error reply.
+        '''
+        if request == None:
+            return None
+        duration = self.moveDuration(request.cmd)
+        if duration == None:
+            deadline = request.t0 + self.moveTimeout
+        else:
+            deadline = request.t0 + self.moveTimeFactor*duration + self.moveTimeMargin
+        if self.device != None:
+            self.device.watch(request, deadline)
+        return self.checkReply(request.wait())
+
+    def sendReceiveMove(self, cmd):
+        return self.receiveMove(self.sendMove(cmd))
+
+    def getSetting(self, setting, motor = 0):
+        ''' Returns the data of setting on device motor from the settings cache,
+        or read with Return Setting if it is not known or older than
+        settingsMaxAge. None on timeout.
+        '''
+        if self.device == None:
+            self.connect()
+        if motor != 0:
+            data = self.device.settings.get(motor, setting, self.settingsMaxAge)
+            if data != None:
+                return data
+        out = self.sendReceive(queryCommand(53, setting, motor))
+        if out == None:
+            return None
+        if self.device != None:
+            self.device.settings.put(out.motor, setting, out.data)
+        return out.data
+
+    def setSetting(self, setting, data, motor = 0):
+        ''' Writes setting on device motor and caches the applied data from the
+        reply. Returns the reply MotorCommand, None on timeout.
+        '''
+        out = self.sendReceive(MotorCommand(setting, int(data), motor))
+        if self.device == None:
+            return out
+        cache = self.device.settings
+        if setting == 37:
+            # The device rescales the speeds and range with the resolution
+            cache.invalidate(motor, cache.resolutionScaled)
+        # Unknown what was applied without a reply, and only one of the
+        # devices is heard when writing to all
+        cache.invalidate(motor, (setting,))
+        if out != None:
+            cache.put(out.motor, setting, out.data)
+        return out
+
+    def invalidateSettings(self, motor = 0):
+        ''' Forgets the cached settings of device motor, or all devices if 0.
+        '''
+        if self.device != None:
+            self.device.settings.invalidate(motor)
+
+    def readDevice(self, names, motor = 0):
+        ''' Reads the items names of deviceQueries from device motor with one
+        pipelined write. The settings read are cached. Returns a dict of name:
+        reply data of the items that were read, leaving out the items that
+        timed out or got an error reply.
+        '''
+        cmdList = [queryCommand(deviceQueries[name][0], deviceQueries[name][1], motor) for name in names]
+        replies = self.sendReceivePipelined(cmdList)
+        data = {}
+        for name, cmd, rep in zip(names, cmdList, replies):
+            if isinstance(rep, MotorCommand) == False:
+                continue
+            if cmd.command == 53 and self.device != None:
+                self.device.settings.put(rep.motor, cmd.data, rep.data)
+            data[name] = rep.data
+        return data
+
 #### Command list:
     def resetMotor(self, motor = 0):
         cmd = MotorCommand(0, 0, motor)
         self.sendReceive(cmd)
+        # Reset restores the default settings
+        self.invalidateSettings(motor)
         
     def homeMotor(self, motor = 0):
         cmd = MotorCommand(1, 0, motor)
-        self.sendReceive(cmd)
+        self.sendReceiveMove(cmd)
         
     def getDeviceId(self, motor = 0):
-        cmd = MotorCommand(50, 0, motor)
+        cmd = queryCommand(50, 0, motor)
         devId = self.sendReceive(cmd)
         return devId.data
 
     def getFirmwareVersion(self, motor = 0):
-        cmd = MotorCommand(51, 0, motor)
+        cmd = queryCommand(51, 0, motor)
         fw = self.sendReceive(cmd)
         return fw.data
     
     def getPosition(self, motor = 0):
-        cmd = MotorCommand(60, 0, motor)
+        cmd = queryCommand(60, 0, motor)
         pos = self.sendReceive(cmd)
         if pos == None:
             return None
@@ -144,7 +1691,7 @@ class ZaberControl(object):
     
     def setPositionAbsolute(self, pos, motor = 0):
         cmd = MotorCommand(20, int(pos), motor)
-        pos = self.sendReceive(cmd)
+        pos = self.sendReceiveMove(cmd)
         if pos == None:
             return None
         else:
@@ -152,43 +1699,92 @@ class ZaberControl(object):
     
     def setPositionRelative(self, relPos, motor = 0):
         cmd = MotorCommand(21, int(relPos), motor)
-        pos = self.sendReceive(cmd)
+        pos = self.sendReceiveMove(cmd)
         if pos == None:
             return None
         else:
             return pos.data
         
+    def startHome(self, motor = 0):
+        ''' Starts homing without waiting. Returns a ZaberMoveRequest that
+        completes with the final position when homing is done.
+        '''
+        return self.sendMove(MotorCommand(1, 0, motor))
+
+    def startPositionAbsolute(self, pos, motor = 0):
+        ''' Starts a move to pos without waiting. Returns a ZaberMoveRequest that
+        completes with the final position when the move is done.
+        '''
+        return self.sendMove(MotorCommand(20, int(pos), motor))
+
+    def startPositionRelative(self, relPos, motor = 0):
+        ''' Starts a move by relPos without waiting. Returns a ZaberMoveRequest
+        that completes with the final position when the move is done.
+        '''
+        return self.sendMove(MotorCommand(21, int(relPos), motor))
+
+    def startMoveMulti(self, positions):
+        ''' Starts absolute moves on several devices with minimum skew, without
+        waiting. positions is a dict of device number: position. Returns a
+        ZaberMoveGroup that completes when all moves are done.
+        '''
+        return self.sendMoves([MotorCommand(20, int(pos), motor) for motor, pos in sorted(positions.items())])
+
+    def moveMulti(self, positions, timeout = None):
+        ''' Moves several devices to the positions in the dict of device number:
+        position and waits until all are done, or timeout s. Returns a dict of
+        device number: final position, None if not reached.
+        '''
+        group = self.startMoveMulti(positions)
+        group.wait(timeout)
+        return group.positions()
+
+    def startHomeAll(self, motors = None):
+        ''' Homes all devices on the chain with one broadcast frame, without
+        waiting. Completion is tracked for the devices in motors, found with a
+        broadcast position read if None. Returns the request, with done(),
+        wait() and positions() like a ZaberMoveGroup.
+        '''
+        if motors == None:
+            motors = self.getAllPositions().keys()
+        return self.sendBroadcastMove(MotorCommand(1, 0, 0), motors)
+
+    def homeAll(self, motors = None, timeout = None):
+        ''' Homes all devices and waits until they are done, or timeout s.
+        Returns a dict of device number: final position, None if not homed.
+        '''
+        req = self.startHomeAll(motors)
+        req.wait(timeout)
+        return req.positions()
+
+    def stopAll(self):
+        ''' Stops all devices on the chain with one broadcast frame. Returns a
+        dict of device number: final position.
+        '''
+        replies = self.broadcastReceive(MotorCommand(23, 0, 0))
+        if self.device != None and self.device.stopReplyPosition == False:
+            return self.getAllPositions()
+        return dict([(motor, rep.data) for motor, rep in replies.items() if rep.command != 255])
+
     def setTargetSpeed(self, speed, motor = 0):
-        cmd = MotorCommand(42, int(speed), motor)
-        out = self.sendReceive(cmd)
+        out = self.setSetting(42, speed, motor)
         if out == None:
             return None
         else:
             return out.data
     
     def getTargetSpeed(self, motor = 0):
-        cmd = MotorCommand(53, 42, motor)
-        out = self.sendReceive(cmd)
-        if out == None:
-            return None
-        else:
-            return out.data
+        return self.getSetting(42, motor)
         
     def setAcceleration(self, data, motor = 0):
-        cmd = MotorCommand(43, int(data), motor)
-        out = self.sendReceive(cmd)
+        out = self.setSetting(43, data, motor)
         if out == None:
             return None
         else:
             return out.data
     
     def getAcceleration(self, motor = 0):
-        cmd = MotorCommand(53, 43, motor)
-        out = self.sendReceive(cmd)
-        if out == None:
-            return None
-        else:
-            return out.data
+        return self.getSetting(43, motor)
         
     def setCurrentPosition(self, data, motor = 0):
         cmd = MotorCommand(45, int(data), motor)
@@ -199,20 +1795,14 @@ class ZaberControl(object):
             return out.data
     
     def setMicrostepResolution(self, data, motor = 0):
-        cmd = MotorCommand(37, int(data), motor)
-        out = self.sendReceive(cmd)
+        out = self.setSetting(37, data, motor)
         if out == None:
             return None
         else:
             return out.data
     
     def getMicrostepResolution(self, motor = 0):
-        cmd = MotorCommand(53, 37, motor)
-        out = self.sendReceive(cmd)
-        if out == None:
-            return None
-        else:
-            return out.data
+        return self.getSetting(37, motor)
         
     def stop(self, motor = 0):
         ''' Stops motor and returns final postition
@@ -224,13 +1814,24 @@ class ZaberControl(object):
         else:
             return out.data
     
+    def stopNow(self, motor = 0):
+        ''' Writes Stop at once without waiting for the reply. The port is
+        thread safe, so this preempts commands waiting in other threads.
+        Moves in flight are interrupted when the reply arrives. Raises
+        SerialException if the port is not connected.
+        '''
+        if self.device == None:
+            raise serial.SerialException(''.join(('Port ', str(self.port), ' not open, can not stop')))
+        req = self.device.submit(MotorCommand(23, 0, motor))
+        self.device.watch(req, req.t0 + self.commandTimeout(req))
+        return req
+
     def setRunningCurrent(self, data, motor = 0):
         if data > 10.0/127:
             d = int(10.0/data)
         else:
             d = 0
-        cmd = MotorCommand(38, d, motor)
-        out = self.sendReceive(cmd)
+        out = self.setSetting(38, d, motor)
         if out == None:
             return None
         else:
@@ -248,23 +1849,20 @@ class ZaberControl(object):
         print out.data
     
     def getRunningCurrent(self, motor = 0):
-        cmd = MotorCommand(53, 38, motor)
-        out = self.sendReceive(cmd)
-        if out == None:
+        data = self.getSetting(38, motor)
+        if data == None:
             return None
+        elif data == 0:
+            return 0
         else:
-            if out.data == 0:
-                return 0
-            else:
-                return 10.0/out.data
+            return 10.0/data
         
     def setHoldCurrent(self, data, motor = 0):
         if data > 10.0/127:
             d = int(10.0/data)
         else:
             d = 0
-        cmd = MotorCommand(39, d, motor)
-        out = self.sendReceive(cmd)
+        out = self.setSetting(39, d, motor)
         if out == None:
             return None
         else:
@@ -274,42 +1872,38 @@ class ZaberControl(object):
                 return 10.0/out.data
     
     def getHoldCurrent(self, motor = 0):
-        cmd = MotorCommand(53, 39, motor)
-        out = self.sendReceive(cmd)
-        if out == None:
+        data = self.getSetting(39, motor)
+        if data == None:
             return None
+        elif data == 0:
+            return 0
         else:
-            if out.data == 0:
-                return 0
-            else:
-                return 10.0/out.data
+            return 10.0/data
         
     def getStatus(self, motor = 0):
-        cmd = MotorCommand(54, 0, motor)
+        cmd = queryCommand(54, 0, motor)
         out = self.sendReceive(cmd)
         status = (None, None)
         if out != None:
-            if out.data == 0:
-                status = (0, 'idle')
-            elif out.data == 1:
-                status = (1, 'homing')
-            elif out.data == 10:
-                status = (10, 'manual move')
-            elif out.data == 18:
-                status = (18, 'move to stored pos')
-            elif out.data == 20:
-                status = (20, 'absolute move')
-            elif out.data == 21:
-                status = (21, 'relative move')
-            elif out.data == 22:
-                status = (22, 'constant move')
-            elif out.data == 23:
-                status = (23, 'stop')
-            else:
+            status = decodeStatus(out.data)
+            if status[0] == None:
                 print out.data
-                self.receiveData()
         return status
 
+    def getAllPositions(self):
+        ''' Reads the position of every device on the chain with one broadcast
+        frame. Returns a dict of device number: position.
+        '''
+        replies = self.broadcastReceive(MotorCommand(60, 0, 0))
+        return dict([(motor, rep.data) for motor, rep in replies.items() if rep.command != 255])
+
+    def getAllStatus(self):
+        ''' Reads the status of every device on the chain with one broadcast
+        frame. Returns a dict of device number: status tuple as in getStatus.
+        '''
+        replies = self.broadcastReceive(MotorCommand(54, 0, 0))
+        return dict([(motor, decodeStatus(rep.data)) for motor, rep in replies.items() if rep.command != 255])
+
 if __name__ == '__main__':
     m = ZaberControl('com4')
     m.setPositionAbsolute(1e5)
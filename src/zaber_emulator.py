@@ -0,0 +1,374 @@
+'''
+Emulator of a chain of Zaber T-series devices speaking the binary protocol on
+a pseudo-terminal, for testing and benchmarking without hardware (linux).
+
+    emu = ZaberEmulator(devices = 2)
+    emu.start()
+    m = zaber_control.ZaberControl(emu.port)
+
+All commands used by zaber_control are implemented: 0, 1, 20, 21, 23, 37-49,
+50, 51, 53, 54 and 60. Other commands get error reply 64. Of the errorDict
+error replies, those these commands can cause are given: invalid data
+(the command number, 53 for Return Setting), 1 when homing fails, 14 and 15
+when moving with the supply voltage out of range, 255 (Busy) when changing
+the resolution or range during a move, 2146 when a relative move exceeds
+setting 46, 3600 when the settings are locked and the 40xx mode bit errors.
+Those of the commands the emulator does not have, 2 (renumber), 18 and the
+16xx-18xx (stored positions), 22 (constant speed move) and 36 (restore
+settings), are never given.
+Moves follow a trapezoidal velocity profile set by the target speed and
+acceleration, and reply when they are done. With wireTiming the commands
+and replies are delayed by the time the frames take on the wire at
+baudrate, one frame after the other in each direction.
+
+Run as a script to serve an emulated chain until interrupted.
+
+@author: Filip Lindau
+'''
+
+import os
+import pty
+import tty
+import select
+import struct
+import threading
+import time
+import heapq
+import argparse
+from zaber_control import SPEED_UNIT, ACCELERATION_UNIT, MotionProfile
+
+
+class SimulatedDevice(object):
+    ''' State and kinematics of one emulated device. Positions in microsteps.
+    Faults are emulated by setting homeSensor to False, so homing fails, or
+    voltage outside supplyRange, so moves are rejected.
+    '''
+    # Power supply voltage range in V
+    supplyRange = (10.0, 16.0)
+
+    def __init__(self, number, deviceId = 4012, firmwareVersion = 600):
+        self.number = number
+        self.deviceId = deviceId
+        self.firmwareVersion = firmwareVersion
+        self.homeSensor = True
+        self.voltage = 12.0
+        # Linear actuator, mode bit 8 (disable auto home) is not allowed
+        self.linear = True
+        self.reset()
+
+    def reset(self):
+        self.settings = {37: 64,        # microstep resolution
+                         38: 10,        # running current
+                         39: 20,        # hold current
+                         40: 0,         # device mode
+                         41: 2000,      # home speed
+                         42: 2000,      # target speed
+                         43: 4,         # acceleration
+                         44: 3000000,   # maximum range
+                         46: 3000000,   # maximum relative move
+                         47: 0,         # home offset
+                         48: 0,         # alias
+                         49: 0,         # lock state
+                         }
+        self.startPosition = 0
+        self.targetPosition = 0
+        self.moveCommand = None
+        self.moveStart = 0.0
+        self.moveTime = 0.0
+        self.motion = None
+        self.moveId = 0
+
+    def position(self, t):
+        if self.moveCommand == None:
+            return self.targetPosition
+        return int(round(self.motion.position(t)))
+
+    def startMove(self, command, target, t):
+        ''' Starts a move from the current position, superseding the current one.
+        Returns the move id and the time the move is done.
+        '''
+        self.startPosition = self.position(t)
+        self.targetPosition = target
+        self.moveCommand = command
+        self.moveStart = t
+        if command == 1:
+            speed = self.settings[41]*SPEED_UNIT
+        else:
+            speed = self.settings[42]*SPEED_UNIT
+        self.motion = MotionProfile(self.startPosition, target, speed, self.settings[43]*ACCELERATION_UNIT, t)
+        self.moveTime = self.motion.duration
+        self.moveId += 1
+        return self.moveId, t + self.moveTime
+
+    def stop(self, t):
+        self.targetPosition = self.position(t)
+        self.moveCommand = None
+        self.moveId += 1
+        return self.targetPosition
+
+    def moveDone(self, moveId):
+        ''' Ends the move moveId. Returns False if it was superseded.
+        '''
+        if moveId != self.moveId or self.moveCommand == None:
+            return False
+        self.moveCommand = None
+        return True
+
+    def status(self, t):
+        if self.moveCommand == None or t >= self.moveStart + self.moveTime:
+            return 0
+        return self.moveCommand
+
+
+class ZaberEmulator(object):
+    # Set commands, refused while the settings are locked (setting 49)
+    settingCommands = (37, 38, 39, 40, 41, 42, 43, 44, 46, 47, 48, 49)
+
+    def __init__(self, devices = 1, baudrate = 9600, wireTiming = False):
+        ''' Emulates devices 1..devices. Connect to the pseudo-terminal named
+        self.port after start().
+        '''
+        self.devices = [SimulatedDevice(n + 1) for n in range(devices)]
+        self.baudrate = baudrate
+        self.wireTiming = wireTiming
+        # 6 bytes of 10 bits on the wire
+        self.frameTime = 60.0/baudrate
+        # Times the wire is free again in each direction
+        self.rxFreeTime = 0.0
+        self.txFreeTime = 0.0
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.events = []
+        self.eventSeq = 0
+        self.framesReceived = 0
+        self.thread = None
+        self.stopFlag = False
+
+    def start(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stopFlag = False
+        self.thread = threading.Thread(target = self.run, name = 'ZaberEmulator')
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stopFlag = True
+        if self.thread != None:
+            self.thread.join(1.0)
+        for fd in (self.master, self.slave):
+            if fd != None:
+                os.close(fd)
+        self.master = None
+        self.slave = None
+
+    def getDevice(self, number):
+        return self.devices[number - 1]
+
+    def schedule(self, t, fn, *args):
+        self.eventSeq += 1
+        heapq.heappush(self.events, (t, self.eventSeq, fn, args))
+
+    def reply(self, device, command, data, t = None):
+        ''' Writes a reply frame, at time t or when the wire is free.
+        '''
+        if t == None:
+            t = time.time()
+        if self.wireTiming == True:
+            t = max(t, self.txFreeTime) + self.frameTime
+            self.txFreeTime = t
+            self.schedule(t, self.write, struct.pack('<2Bi', device.number, command, data))
+        else:
+            self.write(struct.pack('<2Bi', device.number, command, data))
+
+    def write(self, frame):
+        try:
+            os.write(self.master, frame)
+        except OSError:
+            pass
+
+    def run(self):
+        buf = ''
+        while self.stopFlag == False:
+            timeout = 0.05
+            if self.events.__len__() > 0:
+                timeout = max(0.0, min(timeout, self.events[0][0] - time.time()))
+            try:
+                r, w, x = select.select([self.master], [], [], timeout)
+            except (select.error, ValueError):
+                break
+            if r.__len__() > 0:
+                try:
+                    data = os.read(self.master, 1024)
+                except OSError:
+                    break
+                buf = ''.join((buf, data))
+                while buf.__len__() >= 6:
+                    frame = buf[:6]
+                    buf = buf[6:]
+                    t = time.time()
+                    if self.wireTiming == True:
+                        # The frames of a burst arrive one after the other,
+                        # each one frame time after the one before
+                        t = max(t, self.rxFreeTime) + self.frameTime
+                        self.rxFreeTime = t
+                        self.schedule(t, self.handleFrame, frame)
+                    else:
+                        self.handleFrame(frame)
+            now = time.time()
+            while self.events.__len__() > 0 and self.events[0][0] <= now:
+                t, seq, fn, args = heapq.heappop(self.events)
+                fn(*args)
+
+    def handleFrame(self, frame):
+        self.framesReceived += 1
+        number, command, data = struct.unpack('<2Bi', frame)
+        if number == 0:
+            targets = self.devices
+        elif number <= self.devices.__len__():
+            targets = [self.getDevice(number)]
+        else:
+            # Nobody on the chain with that number
+            targets = []
+        t = time.time()
+        for dev in targets:
+            self.handleCommand(dev, command, data, t)
+
+    def moveDone(self, dev, moveId, command):
+        if dev.moveDone(moveId) == True:
+            self.reply(dev, command, dev.targetPosition)
+
+    def homeFailed(self, dev, moveId):
+        if dev.moveDone(moveId) == True:
+            self.reply(dev, 255, 1)
+
+    def handleCommand(self, dev, command, data, t):
+        moving = dev.status(t) != 0
+        if command in self.settingCommands and command != 49 and dev.settings[49] == 1:
+            self.reply(dev, 255, 3600)
+        elif command == 0:
+            # Reset gives no reply
+            dev.reset()
+        elif command in (1, 20, 21):
+            if dev.voltage < dev.supplyRange[0]:
+                self.reply(dev, 255, 14)
+                return
+            if dev.voltage > dev.supplyRange[1]:
+                self.reply(dev, 255, 15)
+                return
+            if command == 1:
+                if dev.homeSensor == False:
+                    # Travels the whole range without finding the sensor
+                    moveId, tDone = dev.startMove(1, dev.position(t) - dev.settings[44], t)
+                    self.schedule(tDone, self.homeFailed, dev, moveId)
+                    return
+                target = 0
+            elif command == 20:
+                target = data
+            else:
+                if abs(data) > dev.settings[46]:
+                    self.reply(dev, 255, 2146)
+                    return
+                target = dev.position(t) + data
+            if target < 0 or target > dev.settings[44]:
+                self.reply(dev, 255, command)
+                return
+            moveId, tDone = dev.startMove(command, target, t)
+            self.schedule(tDone, self.moveDone, dev, moveId, command)
+        elif command == 23:
+            self.reply(dev, 23, dev.stop(t))
+        elif command == 37:
+            if data not in (1, 2, 4, 8, 16, 32, 64, 128):
+                self.reply(dev, 255, 37)
+            elif moving == True:
+                self.reply(dev, 255, 255)
+            else:
+                dev.settings[37] = data
+                self.reply(dev, 37, data)
+        elif command in (38, 39):
+            if data != 0 and (data < 10 or data > 127):
+                self.reply(dev, 255, command)
+            else:
+                dev.settings[command] = data
+                self.reply(dev, command, data)
+        elif command == 40:
+            if data & (1 << 8) and dev.linear == True:
+                self.reply(dev, 255, 4008)
+            elif data & (1 << 10):
+                self.reply(dev, 255, 4010)
+            elif (data ^ dev.settings[40]) & (1 << 12):
+                self.reply(dev, 255, 4012)
+            elif data & (1 << 13):
+                self.reply(dev, 255, 4013)
+            elif data < 0 or data > 0xffff:
+                self.reply(dev, 255, 40)
+            else:
+                dev.settings[40] = data
+                self.reply(dev, 40, data)
+        elif command in (41, 42, 43):
+            if data < 1 or data > 8000:
+                self.reply(dev, 255, command)
+            else:
+                dev.settings[command] = data
+                self.reply(dev, command, data)
+        elif command == 44:
+            if data < 1 or data > 16777215:
+                self.reply(dev, 255, 44)
+            elif moving == True:
+                self.reply(dev, 255, 255)
+            else:
+                dev.settings[44] = data
+                self.reply(dev, 44, data)
+        elif command == 45:
+            if data < 0 or data > dev.settings[44]:
+                self.reply(dev, 255, 45)
+            else:
+                dev.stop(t)
+                dev.targetPosition = data
+                self.reply(dev, 45, data)
+        elif command in (46, 47, 48, 49):
+            if command == 46:
+                valid = 0 <= data <= 16777215
+            elif command == 47:
+                valid = 0 <= data <= dev.settings[44]
+            elif command == 48:
+                valid = 0 <= data <= 254
+            else:
+                valid = data in (0, 1)
+            if valid == False:
+                self.reply(dev, 255, command)
+            else:
+                dev.settings[command] = data
+                self.reply(dev, command, data)
+        elif command == 50:
+            self.reply(dev, 50, dev.deviceId)
+        elif command == 51:
+            self.reply(dev, 51, dev.firmwareVersion)
+        elif command == 53:
+            if data in dev.settings:
+                self.reply(dev, data, dev.settings[data])
+            else:
+                self.reply(dev, 255, 53)
+        elif command == 54:
+            self.reply(dev, 54, dev.status(t))
+        elif command == 60:
+            self.reply(dev, 60, dev.position(t))
+        else:
+            self.reply(dev, 255, 64)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Emulate a chain of Zaber devices on a pseudo-terminal')
+    parser.add_argument('-n', '--devices', type = int, default = 1, help = 'number of devices on the chain')
+    parser.add_argument('-b', '--baudrate', type = int, default = 9600, help = 'baud rate for the wire timing')
+    parser.add_argument('-t', '--timing', action = 'store_true', help = 'simulate the wire timing')
+    args = parser.parse_args()
+    emu = ZaberEmulator(args.devices, args.baudrate, args.timing)
+    print 'Zaber emulator with ', args.devices, ' devices on ', emu.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emu.stop()
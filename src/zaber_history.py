@@ -0,0 +1,79 @@
+'''
+Position history of an axis in a fixed size numpy ring buffer.
+
+Each sample is a record of host time, raw position in microsteps, calibrated
+position and status code, written in place into a preallocated structured
+array. The buffer is either in memory or memory mapped to a .npy file, so a
+long run is kept on disk as it is recorded. In the file the samples are in
+ring order, sort them on time to get them in order.
+
+@author: Filip Lindau
+'''
+
+import threading
+import numpy as np
+
+historyDtype = np.dtype([('time', '<f8'), ('steps', '<i4'), ('position', '<f8'), ('status', '<i2')])
+
+
+class PositionHistory(object):
+    def __init__(self, capacity = 100000, filename = None):
+        ''' Keeps the last capacity samples. If filename is given the buffer is
+        memory mapped to that .npy file, which is overwritten.
+        '''
+        self.capacity = capacity
+        self.filename = filename
+        if filename == None:
+            self.buffer = np.zeros(capacity, dtype = historyDtype)
+        else:
+            self.buffer = np.lib.format.open_memmap(filename, mode = 'w+', dtype = historyDtype, shape = (capacity,))
+        # Field views made once, so appending a sample allocates nothing
+        self.times = self.buffer['time']
+        self.steps = self.buffer['steps']
+        self.positions = self.buffer['position']
+        self.status = self.buffer['status']
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, t, steps, position, status):
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = t
+            self.steps[i] = steps
+            self.positions[i] = position
+            self.status[i] = status
+            self.count += 1
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+
+    def flush(self):
+        ''' Writes a memory mapped buffer to its file.
+        '''
+        if self.filename != None:
+            self.buffer.flush()
+
+    def last(self, n = None):
+        ''' Returns a copy of the last n samples, oldest first. All stored
+        samples if n is None.
+        '''
+        with self.lock:
+            stored = min(self.count, self.capacity)
+            if n == None or n > stored:
+                n = stored
+            start = (self.count - n) % self.capacity
+            if start + n <= self.capacity:
+                return self.buffer[start:start + n].copy()
+            return np.concatenate((self.buffer[start:], self.buffer[:start + n - self.capacity]))
+
+    def since(self, t):
+        ''' Returns a copy of the samples taken after time t, oldest first.
+        '''
+        samples = self.last()
+        return samples[np.searchsorted(samples['time'], t, side = 'right'):]
+
+    def save(self, filename):
+        ''' Writes the stored samples, oldest first, to the .npy file filename.
+        '''
+        np.save(filename, self.last())
@@ -0,0 +1,57 @@
+'''
+Disk cache of the identity of the devices on a chain: device id and firmware
+version, by port and device number.
+
+The identity of a device does not change while it is connected, so a device
+server restarting on the same chain can take it from the cache instead of
+reading it from the device. The cache is a json file shared by all servers on
+the host. It is rewritten whole through a temporary file and a rename, so a
+reader never sees a partly written file. An entry lost to two servers writing
+at the same time is just read from the device again next time.
+
+@author: Filip Lindau
+'''
+
+import os
+import json
+
+
+class IdentityCache(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def key(self, port, motor):
+        return ''.join((str(port), ':', str(motor)))
+
+    def load(self):
+        ''' Returns the dict of key: [device id, firmware version] in the file,
+        empty if it can not be read.
+        '''
+        try:
+            with open(self.filename) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if isinstance(entries, dict) == False:
+            return {}
+        return entries
+
+    def get(self, port, motor):
+        ''' Returns (device id, firmware version) of device motor on port, or
+        None if it is not in the cache.
+        '''
+        entry = self.load().get(self.key(port, motor))
+        if entry == None or entry.__len__() != 2:
+            return None
+        return entry[0], entry[1]
+
+    def put(self, port, motor, deviceId, firmwareVersion):
+        entries = self.load()
+        entries[self.key(port, motor)] = [deviceId, firmwareVersion]
+        self.write(entries)
+
+    def write(self, entries):
+        tmpName = ''.join((self.filename, '.', str(os.getpid()), '.tmp'))
+        with open(tmpName, 'w') as f:
+            json.dump(entries, f, indent = 1, sort_keys = True)
+        os.rename(tmpName, self.filename)
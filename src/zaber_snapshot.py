@@ -0,0 +1,79 @@
+'''
+Last known state of an axis, kept in a small memory mapped .npy file so a
+restarted device server can serve it before the hardware has answered.
+
+The file holds two slots of snapshotDtype. A save writes the older slot and
+then its sequence number, so the newest slot with a sequence number is always
+complete, even if the server died in the middle of a save. Values are stored
+as doubles, NaN for unknown.
+
+@author: Filip Lindau
+'''
+
+import os
+import numpy as np
+
+snapshotDtype = np.dtype([('sequence', '<u8'), ('time', '<f8'), ('port', 'S64'), ('motor', '<f8'),
+                          ('position', '<f8'), ('targetPosition', '<f8'), ('status', '<f8'), ('homed', '<f8'),
+                          ('stepPerUnit', '<f8'), ('microstepResolution', '<f8'), ('speed', '<f8'),
+                          ('acceleration', '<f8'), ('runningCurrent', '<f8'), ('holdCurrent', '<f8'),
+                          ('deviceId', '<f8'), ('firmwareVersion', '<f8')])
+
+# Fields given to save and returned by load
+valueFields = [name for name in snapshotDtype.names if name not in ('sequence', 'port', 'motor')]
+
+
+class StateSnapshot(object):
+    def __init__(self, filename):
+        ''' Opens the snapshot file filename, or creates it if it does not exist
+        or has another layout.
+        '''
+        self.filename = filename
+        opened = False
+        if os.path.exists(filename) == True:
+            try:
+                self.buffer = np.load(filename, mmap_mode = 'r+')
+                opened = self.buffer.dtype == snapshotDtype and self.buffer.shape == (2,)
+            except (IOError, ValueError):
+                pass
+        if opened == False:
+            self.buffer = np.lib.format.open_memmap(filename, mode = 'w+', dtype = snapshotDtype, shape = (2,))
+        # Field views made once
+        self.fields = dict([(name, self.buffer[name]) for name in snapshotDtype.names])
+        self.sequence = int(self.fields['sequence'].max())
+
+    def load(self, port, motor):
+        ''' Returns the newest snapshot saved for device motor on port as a dict
+        of field: value, None for unknown values. None if there is none.
+        '''
+        if self.sequence == 0:
+            return None
+        slot = int(self.fields['sequence'].argmax())
+        if self.fields['port'][slot] != str(port) or self.fields['motor'][slot] != motor:
+            return None
+        values = {}
+        for name in valueFields:
+            value = float(self.fields[name][slot])
+            if np.isnan(value) == True:
+                value = None
+            values[name] = value
+        return values
+
+    def save(self, port, motor, values):
+        ''' Saves the dict values of field: value, None for unknown, for device
+        motor on port. Fields not in values are unknown.
+        '''
+        slot = (self.sequence + 1) % 2
+        self.fields['port'][slot] = str(port)
+        self.fields['motor'][slot] = motor
+        for name in valueFields:
+            value = values.get(name)
+            if value == None:
+                value = np.nan
+            self.fields[name][slot] = value
+        # Written last, marks the slot complete
+        self.sequence += 1
+        self.fields['sequence'][slot] = self.sequence
+
+    def flush(self):
+        self.buffer.flush()
@@ -0,0 +1,242 @@
+'''
+State thread helpers shared by the Zaber device servers ZaberMotorDS and
+ZaberChainDS: the commands and priority command queue of the state thread,
+the MotorData snapshot of an axis, the step scan sequence and the poll
+scheduler. Nothing here talks to Tango or the hardware.
+
+@author: Filip Lindau
+'''
+
+import threading
+import Queue
+import time
+import numpy as np
+import copy
+import collections
+
+class ZaberCommand:
+    def __init__(self, command, data=None):
+        self.command = command
+        self.data = data
+
+class ZaberCommandQueue():
+    '''
+    Command queue of the state thread, with the same interface as Queue.Queue.
+    Commands are taken by priority: stop first, then the move completions,
+    then the writes and other commands of the clients in the order they were
+    issued, then the polled reads. A write to an attribute that is already
+    queued replaces the data of the queued write, unless another command such
+    as a move was queued after it, and a read that is already queued is not
+    queued again. Each command is stamped with the time it was queued in
+    tQueued.
+    '''
+    priorities = {'stop': 0, 'standby': 0,
+                  'moveDone': 1, 'groupMoveDone': 1}
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.size = 0
+        self.queues = [collections.deque() for i in range(4)]
+        self.cond = threading.Condition()
+
+    def priority(self, command):
+        p = self.priorities.get(command)
+        if p != None:
+            return p
+        if command.startswith('read') == True:
+            return 3
+        return 2
+
+    def put(self, cmd, block=True, timeout=None):
+        '''
+        Queues cmd. Never blocks, raises Queue.Full if the queue is full.
+        '''
+        p = self.priority(cmd.command)
+        with self.cond:
+            if p == 3 or cmd.command.startswith('write') == True:
+                # Search back only past writes, so a write is never moved
+                # ahead of a move queued after it
+                for queued in reversed(self.queues[p]):
+                    if queued.command == cmd.command:
+                        queued.data = cmd.data
+                        return
+                    if p == 2 and queued.command.startswith('write') == False:
+                        break
+            if self.size >= self.maxsize:
+                raise Queue.Full
+            cmd.tQueued = time.time()
+            self.queues[p].append(cmd)
+            self.size += 1
+            self.cond.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            if block == True:
+                if timeout != None:
+                    endTime = time.time() + timeout
+                while self.size == 0:
+                    if timeout == None:
+                        self.cond.wait()
+                    else:
+                        remaining = endTime - time.time()
+                        if remaining <= 0:
+                            raise Queue.Empty
+                        self.cond.wait(remaining)
+            elif self.size == 0:
+                raise Queue.Empty
+            for q in self.queues:
+                if q.__len__() > 0:
+                    self.size -= 1
+                    return q.popleft()
+
+    def purge(self, commands):
+        '''
+        Removes the queued commands with names in commands.
+        '''
+        with self.cond:
+            for i, q in enumerate(self.queues):
+                kept = collections.deque([cmd for cmd in q if cmd.command not in commands])
+                self.size -= q.__len__() - kept.__len__()
+                self.queues[i] = kept
+
+    def oldestAge(self):
+        '''
+        Returns the time in s the oldest queued command has been waiting, 0 if
+        the queue is empty.
+        '''
+        with self.cond:
+            heads = [q[0].tQueued for q in self.queues if q.__len__() > 0]
+        if heads.__len__() == 0:
+            return 0.0
+        return time.time() - min(heads)
+
+    def empty(self):
+        return self.size == 0
+
+    def qsize(self):
+        return self.size
+
+class MotorData():
+    '''
+    Snapshot of the motor state. Published snapshots are never changed,
+    a new one is made with replace.
+    '''
+    def __init__(self):
+            self.position = [None]
+            self.speed = [None]
+            self.acceleration = [None]
+            self.runningCurrent = [None]
+            self.holdCurrent = [None]
+            self.microstepResolution = [None]
+            self.deviceId = [None]    
+            self.firmwareVersion = [None]
+            self.serial = [None]
+            self.status = [None,None]
+            self.stepPerUnit = [1.0]
+            self.targetPosition = [None]
+            # Homed since the device was last powered, as far as known
+            self.homed = [False]
+            # MotionProfile of the move in progress, None when not modelled
+            self.profile = None
+            # True while the values are restored from the state snapshot and
+            # not yet verified against the hardware
+            self.restored = False
+
+    def replace(self, **kwargs):
+        '''
+        Returns a copy with the fields in kwargs replaced.
+        '''
+        md = copy.copy(self)
+        md.__dict__.update(kwargs)
+        return md
+
+class ScanSequence():
+    '''
+    A step scan run by the state thread: a move to each target position in
+    turn, waiting dwellTimes[i] s at point i before moving to the next. The
+    position and time the move to each point completed are recorded in
+    arrivalPositions and arrivalTimes, NaN for points not reached.
+    '''
+    def __init__(self, positions, dwellTimes):
+        self.positions = np.array(positions, dtype=np.double)
+        self.dwellTimes = np.array(dwellTimes, dtype=np.double)
+        self.arrivalPositions = np.nan*np.ones(self.positions.shape[0])
+        self.arrivalTimes = np.nan*np.ones(self.positions.shape[0])
+        # Index of the next point to move to
+        self.index = 0
+        self.pointsDone = 0
+        # ZaberMoveRequest of the move in progress
+        self.moveRequest = None
+        # Time to move to the next point, None while moving
+        self.nextTime = None
+        self.running = True
+        # Set by Stop from another thread
+        self.aborted = False
+
+    def finished(self):
+        return self.index >= self.positions.shape[0]
+
+    def arrived(self, position, t):
+        i = self.index - 1
+        self.arrivalPositions[i] = position
+        self.arrivalTimes[i] = t
+        self.pointsDone = self.index
+        self.nextTime = t + self.dwellTimes[i]
+
+class PollScheduler():
+    '''
+    Decides which read command onHandler issues next. Each read command has a
+    poll period while moving and one while idle. After a move the idle period
+    starts at the moving period and doubles with each poll, so an idle axis
+    backs off quickly. The most overdue command is issued first.
+    '''
+    def __init__(self, periods):
+        # periods: dict of command: (movingPeriod, idlePeriod). Period 0 is never polled.
+        self.periods = periods
+        self.lastPoll = {}
+        self.idlePeriod = {}
+        for cmd, (movingPeriod, idlePeriod) in periods.items():
+            self.lastPoll[cmd] = 0.0
+            self.idlePeriod[cmd] = movingPeriod
+
+    def stagger(self, commands, t):
+        '''
+        Marks commands as polled at times spread over the last period, so that
+        they do not all fall due at once.
+        '''
+        for i, cmd in enumerate(commands):
+            self.lastPoll[cmd] = t - self.periods[cmd][1]*i/len(commands)
+            self.idlePeriod[cmd] = self.periods[cmd][1]
+
+    def nextCommand(self, moving, t, minInterval=0.0, skip=()):
+        '''
+        Returns (command, 0) for the command to poll now, or (None, waitTime)
+        with the time until the next command is due. No command is polled more
+        often than minInterval, to share the link with other axes.
+        '''
+        nextCmd = None
+        nextDue = None
+        for cmd, (movingPeriod, idlePeriod) in self.periods.items():
+            if cmd in skip:
+                continue
+            if moving == True:
+                period = movingPeriod
+                self.idlePeriod[cmd] = movingPeriod
+            else:
+                period = self.idlePeriod[cmd]
+            if period <= 0:
+                continue
+            due = self.lastPoll[cmd] + max(period, minInterval)
+            if nextDue == None or due < nextDue:
+                nextCmd = cmd
+                nextDue = due
+        if nextDue == None:
+            return None, 1.0
+        if nextDue > t:
+            return None, nextDue - t
+        return nextCmd, 0.0
+
+    def polled(self, cmd, t, moving):
+        self.lastPoll[cmd] = t
+        if moving == False:
+            self.idlePeriod[cmd] = min(2*self.idlePeriod[cmd], self.periods[cmd][1])
@@ -0,0 +1,72 @@
+'''
+Low overhead event trace for the hot paths of the device server.
+
+Events are stored as (time, level, event, data) tuples in a preallocated ring
+buffer of fixed capacity, overwriting the oldest ones. Recording an event above
+the current level is a single comparison, so tracing can stay in the code at
+full polling rates and be switched on at runtime when needed.
+
+Recording is not locked. With several threads recording at once an event can
+occasionally be overwritten, which is acceptable for a diagnostic trace.
+
+@author: Filip Lindau
+'''
+
+import time
+
+TRACE_OFF = 0
+# Commands, writes and moves
+TRACE_EVENTS = 1
+# Every hardware transaction and poll
+TRACE_IO = 2
+# Attribute reads and queue handling
+TRACE_DEBUG = 3
+
+levelNames = {TRACE_OFF: 'OFF', TRACE_EVENTS: 'EVENTS', TRACE_IO: 'IO', TRACE_DEBUG: 'DEBUG'}
+
+
+class TraceBuffer(object):
+    def __init__(self, capacity = 4096, level = TRACE_OFF):
+        self.capacity = capacity
+        self.level = level
+        self.buffer = [None] * capacity
+        self.count = 0
+
+    def record(self, level, event, data = None):
+        if level > self.level:
+            return
+        i = self.count
+        self.buffer[i % self.capacity] = (time.time(), level, event, data)
+        self.count = i + 1
+
+    def clear(self):
+        self.buffer = [None] * self.capacity
+        self.count = 0
+
+    def entries(self, n = None):
+        ''' Returns the last n entries, oldest first. All stored entries if n is None.
+        '''
+        count = self.count
+        stored = min(count, self.capacity)
+        if n == None or n > stored:
+            n = stored
+        return [self.buffer[i % self.capacity] for i in range(count - n, count)]
+
+    def formatEntry(self, entry):
+        t, level, event, data = entry
+        s = ''.join((time.strftime('%H:%M:%S', time.localtime(t)), ('%.6f' % (t % 1))[1:], ' ',
+                     levelNames.get(level, str(level)), ' ', event))
+        if data != None:
+            s = ''.join((s, ' ', str(data)))
+        return s
+
+    def lines(self, n = None):
+        return [self.formatEntry(entry) for entry in self.entries(n)]
+
+    def dump(self, filename):
+        ''' Writes the stored entries to the text file filename, oldest first.
+        '''
+        with open(filename, 'w') as f:
+            for line in self.lines():
+                f.write(line)
+                f.write('\n')
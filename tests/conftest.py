@@ -0,0 +1,31 @@
+'''
+Fixtures of the tests: an emulated chain of two devices on a pseudo-terminal
+and a ZaberControl connected to it.
+
+@author: Filip Lindau
+'''
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import zaber_control as zc
+import zaber_emulator as ze
+
+
+@pytest.fixture
+def emulator():
+    em = ze.ZaberEmulator(devices = 2)
+    em.start()
+    yield em
+    em.stop()
+
+
+@pytest.fixture
+def control(emulator):
+    m = zc.ZaberControl(emulator.port)
+    m.connect()
+    yield m
+    m.close()
@@ -0,0 +1,57 @@
+'''
+Message ids of the ASCII protocol port.
+
+@author: Filip Lindau
+'''
+
+import time
+import pytest
+import zaber_control as zc
+from zaber_control import MotorCommand
+
+
+def submitted(port, cmd):
+    ''' Encodes and registers a request like submitRequests, without writing.
+    '''
+    req = zc.ZaberRequest(cmd)
+    if cmd.command in (1, 20, 21):
+        req = zc.ZaberMoveRequest(cmd)
+    port.encodeRequest(req)
+    req.t0 = time.time()
+    port.pending.append(req)
+    return req
+
+
+def test_move_waiting_for_idle_keeps_its_id():
+    port = zc.ZaberAsciiPort('none')
+    move = submitted(port, MotorCommand(20, 1000, 1))
+    port.routeLine(''.join(('@01 0 ', '%02d' % move.msgId, ' OK BUSY -- 0')))
+    assert move.awaitingIdle == True
+    # Wrap the message ids around past the move
+    ids = []
+    for i in range(150):
+        query = submitted(port, zc.queryCommand(60, 0, 1))
+        ids.append(query.msgId)
+        port.routeLine(''.join(('@01 0 ', '%02d' % query.msgId, ' OK BUSY -- 500')))
+        assert query.reply.data == 500
+    assert move.msgId not in ids
+    assert move in port.pending
+    assert move.done() == False
+
+
+def test_no_free_id():
+    port = zc.ZaberAsciiPort('none')
+    for i in range(100):
+        submitted(port, zc.queryCommand(60, 0, 1))
+    with pytest.raises(ValueError):
+        port.freeMsgId()
+
+
+def test_rejection_is_an_error_reply():
+    port = zc.ZaberAsciiPort('none')
+    req = submitted(port, MotorCommand(42, 1000, 1))
+    port.routeLine(''.join(('@01 0 ', '%02d' % req.msgId, ' RJ IDLE -- BADDATA')))
+    assert (req.reply.command, req.reply.data) == (255, 42)
+    req = submitted(port, zc.queryCommand(60, 0, 1))
+    port.routeLine(''.join(('@01 0 ', '%02d' % req.msgId, ' RJ BUSY -- AGAIN')))
+    assert (req.reply.command, req.reply.data) == (255, 255)
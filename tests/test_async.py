@@ -0,0 +1,60 @@
+'''
+AsyncZaberControl against the emulated chain.
+
+@author: Filip Lindau
+'''
+
+import pytest
+
+asyncio = pytest.importorskip('trollius')
+from trollius import From, Return
+import zaber_async as za
+
+
+@pytest.fixture
+def asyncControl(emulator):
+    loop = asyncio.new_event_loop()
+    m = za.AsyncZaberControl(emulator.port, loop)
+    m.connect()
+    yield m
+    m.close()
+    loop.close()
+
+
+def test_gather_and_broadcast(asyncControl):
+    m = asyncControl
+    positions = m.loop.run_until_complete(asyncio.gather(m.getPosition(1), m.getPosition(2), loop = m.loop))
+    assert positions == [0, 0]
+    replies = m.loop.run_until_complete(m.broadcastReceive(za.MotorCommand(50, 0, 0)))
+    assert sorted(replies.keys()) == [1, 2]
+
+
+def test_stray_byte_and_stop(emulator, asyncControl):
+    m = asyncControl
+
+    @asyncio.coroutine
+    def moveAndStop():
+        move = m.loop.create_task(m.setPositionAbsolute(200000, 1))
+        yield From(asyncio.sleep(0.1, loop = m.loop))
+        emulator.write('\x07')
+        stopPosition = yield From(m.stop(1))
+        movePosition = yield From(move)
+        position = yield From(m.getPosition(1))
+        raise Return((stopPosition, movePosition, position))
+
+    stopPosition, movePosition, position = m.loop.run_until_complete(moveAndStop())
+    assert 0 < stopPosition < 200000
+    assert movePosition == stopPosition
+    assert position == stopPosition
+    assert m.getStatistics().resyncs == 1
+
+
+def test_lost_reply_times_out(emulator, asyncControl):
+    m = asyncControl
+    m.timeout = 0.1
+    handleFrame = emulator.handleFrame
+    emulator.handleFrame = lambda frame: None
+    assert m.loop.run_until_complete(m.getPosition(1)) == None
+    assert m.device.pending == []
+    emulator.handleFrame = handleFrame
+    assert m.loop.run_until_complete(m.getPosition(1)) == 0
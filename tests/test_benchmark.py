@@ -0,0 +1,32 @@
+'''
+Link benchmark, run short against the emulator.
+
+@author: Filip Lindau
+'''
+
+import zaber_benchmark as zb
+
+
+def test_short_run():
+    bench = zb.LinkBenchmark(devices = 2, wireTiming = False, iterations = 3, duration = 0.1)
+    bench.setUp()
+    try:
+        bench.benchCommandLatency()
+        bench.benchThroughput()
+        bench.benchMoveCompletion(distance = 200, waitTime = 0.02)
+    finally:
+        bench.tearDown()
+    metrics = bench.metrics
+    for name in ('latency_getPosition_p50_ms', 'axis_sequential_qps', 'chain_pipelined_qps',
+                 'chain_broadcast_qps', 'move_detect_reply_p50_ms', 'move_detect_poll_p50_ms'):
+        assert metrics[name] > 0
+    # Detected from the reply time, not the wake up of the wait
+    assert metrics['move_detect_reply_p50_ms'] < 20
+
+
+def test_compare_baseline():
+    baseline = {'metrics': {'latency_stop_p50_ms': 10.0, 'axis_sequential_qps': 100.0, 'gone_ms': 1.0}}
+    results = {'metrics': {'latency_stop_p50_ms': 13.0, 'axis_sequential_qps': 90.0}}
+    assert zb.compareBaseline(results, baseline, 0.2) == [('latency_stop_p50_ms', 10.0, 13.0)]
+    results = {'metrics': {'latency_stop_p50_ms': 9.0, 'axis_sequential_qps': 70.0}}
+    assert zb.compareBaseline(results, baseline, 0.2) == [('axis_sequential_qps', 100.0, 70.0)]
@@ -0,0 +1,25 @@
+'''
+Binary frame codec.
+
+@author: Filip Lindau
+'''
+
+import zaber_codec as codec
+
+
+def test_frame_round_trip():
+    for motor, command, data in [(1, 60, 0), (255, 255, -1), (3, 20, 2**31 - 1), (2, 21, -2**31)]:
+        frame = codec.encodeFrame(motor, command, data)
+        assert frame.__len__() == codec.FRAME_SIZE
+        assert codec.decodeFrame(frame) == (motor, command, data)
+        assert codec.decodeFrame(bytearray(''.join(('xx', frame))), 2) == (motor, command, data)
+
+
+def test_frames_round_trip():
+    buf = codec.encodeFrames([1, 2, 3], 20, [100, -200, 300])
+    assert buf == ''.join([codec.encodeFrame(m, 20, d) for m, d in [(1, 100), (2, -200), (3, 300)]])
+    # A partial frame at the end is left out
+    frames = codec.decodeFrames(''.join((buf, 'abc')))
+    assert frames.__len__() == 3
+    assert list(frames['motor']) == [1, 2, 3]
+    assert list(frames['data']) == [100, -200, 300]
@@ -0,0 +1,253 @@
+'''
+ZaberControl against the emulated chain.
+
+@author: Filip Lindau
+'''
+
+import time
+import pytest
+import zaber_control as zc
+import zaber_emulator as ze
+from zaber_control import MotorCommand
+
+
+def test_move_future(emulator, control):
+    req = control.startPositionAbsolute(3000, 1)
+    assert req.done() == False
+    rep = req.wait(5.0)
+    assert (rep.command, rep.data) == (20, 3000)
+    assert req.interrupted == False
+    assert emulator.getDevice(1).status(time.time()) == 0
+    assert control.getPosition(1) == 3000
+
+
+def test_stop_interrupts_move(control):
+    req = control.startPositionAbsolute(200000, 1)
+    time.sleep(0.1)
+    pos = control.stop(1)
+    assert req.wait(1.0).command == 23
+    assert req.interrupted == True
+    assert 0 < pos < 200000
+    assert control.getPosition(1) == pos
+
+
+def test_newer_move_supersedes(control):
+    first = control.startPositionAbsolute(200000, 1)
+    second = control.startPositionAbsolute(1000, 1)
+    assert first.wait(1.0) == None
+    assert first.interrupted == True
+    assert second.wait(5.0).data == 1000
+
+
+def test_setting_written_during_move(emulator, control):
+    move = control.startPositionAbsolute(200000, 1)
+    time.sleep(0.05)
+    # The device rejects it as busy. The error answers the write, not the move.
+    with pytest.raises(ValueError):
+        control.setMicrostepResolution(32, 1)
+    assert move.done() == False
+    assert emulator.getDevice(1).status(time.time()) == 20
+    assert control.getMicrostepResolution(1) == 64
+    pos = control.stop(1)
+    assert move.wait(1.0).data == pos
+    assert move.interrupted == True
+
+
+def test_error_reply_with_move_command_ends_move(control):
+    move = control.startPositionAbsolute(10**8, 1)
+    rep = move.wait(1.0)
+    assert (rep.command, rep.data) == (255, 20)
+    with pytest.raises(ValueError):
+        control.checkReply(rep)
+
+
+def test_match_reply_errors_skip_moves():
+    move = zc.ZaberMoveRequest(MotorCommand(20, 1000, 1))
+    query = zc.ZaberRequest(zc.queryCommand(60, 0, 1))
+    pending = [move, query]
+    # Busy goes to the oldest request that is not a move
+    assert zc.matchReply(pending, MotorCommand(255, 255, 1)) is query
+    assert pending == [move]
+    assert zc.matchReply(pending, MotorCommand(255, 64, 1)) == None
+    assert zc.matchReply(pending, MotorCommand(255, 20, 1)) is move
+    broadcast = zc.ZaberBroadcastMoveRequest(MotorCommand(1, 0, 0), [1, 2])
+    pending = [broadcast]
+    assert zc.matchReply(pending, MotorCommand(255, 255, 2)) == None
+    assert broadcast.replies == {}
+
+
+def test_port_shared_by_controls(emulator, control):
+    other = zc.ZaberControl(emulator.port)
+    other.connect()
+    try:
+        assert other.device is control.device
+        assert control.device.users == 2
+        assert other.getPosition(2) == 0
+    finally:
+        other.close()
+    # Still open for the remaining user
+    assert control.device.users == 1
+    assert control.getPosition(1) == 0
+
+
+def test_pipelined_replies_in_order(control):
+    cmdList = [zc.queryCommand(60, 0, 1), zc.queryCommand(50, 0, 2), MotorCommand(37, 3, 1),
+               zc.queryCommand(53, 42, 2)]
+    replies = control.sendReceivePipelined(cmdList)
+    assert replies[0].data == 0
+    assert replies[1].data == 4012
+    # The error is returned in its place
+    assert isinstance(replies[2], ValueError) == True
+    assert (replies[3].command, replies[3].data) == (42, 2000)
+    assert control.device.inFlight() == 0
+
+
+def test_broadcast_snapshot(emulator, control):
+    control.setPositionAbsolute(1500, 2)
+    t0 = time.time()
+    assert control.getAllPositions() == {1: 0, 2: 1500}
+    # The first reply ends the wait for the reply timeout
+    assert time.time() - t0 < control.timeout
+    assert control.getAllStatus() == {1: (0, 'idle'), 2: (0, 'idle')}
+
+
+def test_broadcast_without_reply(emulator, control):
+    emulator.handleFrame = lambda frame: None
+    control.timeout = 0.2
+    t0 = time.time()
+    assert control.getAllPositions() == {}
+    assert time.time() - t0 < 2*control.timeout
+
+
+def test_statistics_of_the_link(emulator, control):
+    for i in range(5):
+        control.getPosition(1)
+    stats = control.getStatistics()
+    assert sum(stats.histogram(60)) == 5
+    assert stats.roundTrip(60)[0] > 0
+    emulator.handleFrame = lambda frame: None
+    control.timeout = 0.1
+    control.minTimeout = 0.1
+    assert control.getPosition(1) == None
+    assert stats.timeouts == 1
+
+
+def test_move_group(control):
+    group = control.startMoveMulti({1: 1000, 2: 2000})
+    assert group.wait(5.0) == True
+    assert group.positions() == {1: 1000, 2: 2000}
+    assert control.moveMulti({1: 0, 2: 500}, 5.0) == {1: 0, 2: 500}
+
+
+def test_home_and_stop_all(control):
+    control.moveMulti({1: 3000, 2: 4000}, 5.0)
+    assert control.homeAll([1, 2], 10.0) == {1: 0, 2: 0}
+    control.startMoveMulti({1: 200000, 2: 200000})
+    time.sleep(0.1)
+    positions = control.stopAll()
+    assert sorted(positions.keys()) == [1, 2]
+    assert 0 < positions[1] < 200000
+    assert control.getAllPositions() == positions
+
+
+def test_resync_after_stray_byte(emulator, control):
+    assert control.getPosition(1) == 0
+    emulator.write('\x07')
+    control.setPositionAbsolute(500, 2)
+    assert control.getPosition(2) == 500
+    assert control.getPosition(1) == 0
+
+
+def test_move_duration_models_the_device():
+    settings = zc.SettingsCache()
+    dev = ze.SimulatedDevice(1)
+    for setting in (41, 42, 43):
+        settings.put(1, setting, dev.settings[setting])
+    assert zc.moveDuration(MotorCommand(20, 5000, 1), settings, {}) == None
+    duration = zc.moveDuration(MotorCommand(20, 5000, 1), settings, {1: 0})
+    moveId, tDone = dev.startMove(20, 5000, 0.0)
+    assert duration == pytest.approx(tDone)
+    assert zc.moveDuration(MotorCommand(21, -5000, 1), settings, {}) == pytest.approx(tDone)
+    settings.invalidate(1, (43,))
+    assert zc.moveDuration(MotorCommand(21, 5000, 1), settings, {}) == None
+
+
+def test_lost_move_completion_times_out(emulator, control):
+    control.getTargetSpeed(1)
+    control.getAcceleration(1)
+    assert control.getPosition(1) == 0
+    # The device moves but its completion reply is lost
+    emulator.moveDone = lambda dev, moveId, command: dev.moveDone(moveId)
+    cmd = MotorCommand(20, 20000, 1)
+    deadline = control.moveTimeFactor*control.moveDuration(cmd) + control.moveTimeMargin
+    t0 = time.time()
+    assert control.sendReceiveMove(cmd) == None
+    assert time.time() - t0 == pytest.approx(deadline, abs=0.3)
+    assert control.getPosition(1) == 20000
+
+
+def test_settings_cache_invalidation(emulator, control):
+    assert control.getTargetSpeed(1) == 2000
+    # Not read again while cached
+    emulator.getDevice(1).settings[42] = 1500
+    assert control.getTargetSpeed(1) == 2000
+    control.setMicrostepResolution(64, 1)
+    assert control.getTargetSpeed(1) == 1500
+    emulator.getDevice(1).settings[42] = 1000
+    control.invalidateSettings(1)
+    assert control.getTargetSpeed(1) == 1000
+
+
+def test_read_device_pipelined(emulator, control):
+    names = ['deviceId', 'microstepResolution', 'targetSpeed', 'acceleration', 'position']
+    data = control.readDevice(names, 1)
+    assert data == {'deviceId': 4012, 'microstepResolution': 64, 'targetSpeed': 2000,
+                    'acceleration': emulator.getDevice(1).settings[43], 'position': 0}
+    # The settings read are cached
+    emulator.getDevice(1).settings[42] = 1500
+    assert control.getTargetSpeed(1) == 2000
+    # An item with an error reply is left out
+    handleCommand = emulator.handleCommand
+    def failAcceleration(dev, command, data, t):
+        if command == 53 and data == 43:
+            emulator.reply(dev, 255, 53)
+        else:
+            handleCommand(dev, command, data, t)
+    emulator.handleCommand = failAcceleration
+    data = control.readDevice(names, 1)
+    assert sorted(data.keys()) == ['deviceId', 'microstepResolution', 'position', 'targetSpeed']
+
+
+def test_stopped_home_all_is_not_completed(control):
+    control.moveMulti({1: 5000, 2: 5000}, 10.0)
+    group = control.startHomeAll([1, 2])
+    time.sleep(0.05)
+    control.stopAll()
+    group.wait(1.0)
+    assert group.done() == True
+    assert group.completed() == set()
+    group = control.startHomeAll([1, 2])
+    group.wait(10.0)
+    assert group.completed() == set([1, 2])
+    assert group.positions() == {1: 0, 2: 0}
+
+
+def test_resync_open_port(emulator, control):
+    assert control.resync() == True
+    assert control.getPosition(1) == 0
+    control.setPositionAbsolute(700, 1)
+    assert control.getPosition(1) == 700
+    m = zc.ZaberControl(emulator.port)
+    assert m.resync() == False
+
+
+def test_move_group_completed_axes(control):
+    group = control.startMoveMulti({1: 1000, 2: 200000})
+    assert group.motors == set([1, 2])
+    time.sleep(0.5)
+    control.stop(2)
+    assert group.wait(5.0) == True
+    assert group.completed() == set([1])
+    group = control.startMoveMulti({1: 0, 2: 0})
+    group.wait(10.0)
+    assert group.completed() == set([1, 2])
@@ -0,0 +1,113 @@
+'''
+The emulated chain and its wire timing.
+
+@author: Filip Lindau
+'''
+
+import os
+import time
+import zaber_codec as codec
+import zaber_control as zc
+import zaber_emulator as ze
+from zaber_control import MotorCommand
+
+
+def test_queries(control):
+    assert control.getDeviceId(1) == 4012
+    assert control.getFirmwareVersion(2) == 600
+    assert control.getMicrostepResolution(1) == 64
+    assert control.getStatus(2) == (0, 'idle')
+
+
+def test_move_and_range_error(emulator, control):
+    assert control.setPositionAbsolute(2000, 1) == 2000
+    assert emulator.getDevice(1).position(time.time()) == 2000
+    assert emulator.getDevice(2).position(time.time()) == 0
+    # Beyond the maximum range
+    req = control.sendCommand(MotorCommand(20, 10**8, 1))
+    out = req.wait(1.0)
+    assert (out.command, out.data) == (255, 20)
+
+
+def test_no_reply_from_missing_device(control):
+    control.timeout = 0.1
+    assert control.sendReceive(zc.queryCommand(60, 0, 5)) == None
+
+
+def test_burst_is_received_frame_by_frame():
+    em = ze.ZaberEmulator(devices = 1, baudrate = 9600, wireTiming = True)
+    em.start()
+    try:
+        handled = []
+        handleFrame = em.handleFrame
+
+        def record(frame):
+            handled.append(time.time())
+            handleFrame(frame)
+        em.handleFrame = record
+        frames = 10
+        t0 = time.time()
+        os.write(em.slave, codec.encodeFrames(1, 60, [0]*frames))
+        deadline = time.time() + 2.0
+        while handled.__len__() < frames and time.time() < deadline:
+            time.sleep(0.01)
+        assert handled.__len__() == frames
+        # One frame time each, not all one frame time after the write
+        assert handled[-1] - t0 >= 0.9*frames*em.frameTime
+        assert handled[-1] - handled[0] >= 0.9*(frames - 1)*em.frameTime
+    finally:
+        em.stop()
+
+
+def errorOf(control, cmd):
+    ''' Error code of the reply to cmd, None if it was accepted.
+    '''
+    rep = control.sendCommand(cmd).wait(1.0)
+    if rep.command != 255:
+        return None
+    return rep.data
+
+
+def test_setting_errors(control):
+    assert errorOf(control, MotorCommand(37, 3, 1)) == 37
+    assert errorOf(control, MotorCommand(38, 5, 1)) == 38
+    assert errorOf(control, MotorCommand(42, 0, 1)) == 42
+    assert errorOf(control, MotorCommand(44, 2**24, 1)) == 44
+    assert errorOf(control, MotorCommand(48, 300, 1)) == 48
+    assert errorOf(control, MotorCommand(49, 2, 1)) == 49
+    assert errorOf(control, MotorCommand(53, 99, 1)) == 53
+    assert errorOf(control, MotorCommand(40, 1 << 8, 1)) == 4008
+    assert errorOf(control, MotorCommand(40, 1 << 10, 1)) == 4010
+    assert errorOf(control, MotorCommand(40, 1 << 12, 1)) == 4012
+    assert errorOf(control, MotorCommand(40, 1 << 13, 1)) == 4013
+    assert errorOf(control, MotorCommand(99, 0, 1)) == 64
+    # Locked settings
+    assert errorOf(control, MotorCommand(49, 1, 1)) == None
+    assert errorOf(control, MotorCommand(42, 1000, 1)) == 3600
+    assert errorOf(control, MotorCommand(49, 0, 1)) == None
+    assert errorOf(control, MotorCommand(42, 1000, 1)) == None
+
+
+def test_move_errors(emulator, control):
+    assert errorOf(control, MotorCommand(46, 1000, 1)) == None
+    assert errorOf(control, MotorCommand(21, 2000, 1)) == 2146
+    assert errorOf(control, MotorCommand(21, -10, 1)) == 21
+    dev = emulator.getDevice(1)
+    dev.voltage = 8.0
+    assert errorOf(control, MotorCommand(20, 1000, 1)) == 14
+    dev.voltage = 20.0
+    assert errorOf(control, MotorCommand(20, 1000, 1)) == 15
+    dev.voltage = 12.0
+    move = control.startPositionAbsolute(100000, 1)
+    time.sleep(0.05)
+    assert errorOf(control, MotorCommand(37, 32, 1)) == 255
+    control.stop(1)
+    assert move.interrupted == True
+
+
+def test_home_fails_without_sensor(emulator, control):
+    control.setSetting(44, 2000, 1)
+    emulator.getDevice(1).homeSensor = False
+    rep = control.startHome(1).wait(5.0)
+    assert (rep.command, rep.data) == (255, 1)
+    assert emulator.getDevice(1).status(time.time()) == 0
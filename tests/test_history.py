@@ -0,0 +1,34 @@
+'''
+Position history ring buffer.
+
+@author: Filip Lindau
+'''
+
+import numpy as np
+import zaber_history as zh
+
+
+def test_ring_buffer():
+    h = zh.PositionHistory(capacity = 4)
+    assert h.last().__len__() == 0
+    for i in range(6):
+        h.append(float(i), 10*i, 0.5*i, 0)
+    # The two oldest samples are overwritten
+    assert list(h.last()['time']) == [2.0, 3.0, 4.0, 5.0]
+    assert list(h.last(2)['steps']) == [40, 50]
+    assert list(h.since(3.0)['position']) == [2.0, 2.5]
+    h.clear()
+    assert h.last().__len__() == 0
+
+
+def test_memory_mapped_and_saved(tmpdir):
+    filename = str(tmpdir.join('history.npy'))
+    h = zh.PositionHistory(capacity = 8, filename = filename)
+    h.append(1.0, 100, 1.0, 20)
+    h.flush()
+    assert np.load(filename)['steps'][0] == 100
+    saved = str(tmpdir.join('saved.npy'))
+    h.save(saved)
+    samples = np.load(saved)
+    assert samples.__len__() == 1
+    assert samples['status'][0] == 20
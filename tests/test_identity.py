@@ -0,0 +1,29 @@
+'''
+Disk cache of the device identities.
+
+@author: Filip Lindau
+'''
+
+import zaber_identity as zi
+
+
+def test_put_get(tmpdir):
+    filename = str(tmpdir.join('identity.json'))
+    cache = zi.IdentityCache(filename)
+    assert cache.get('/dev/ttyS0', 1) == None
+    cache.put('/dev/ttyS0', 1, 4012, 600)
+    cache.put('/dev/ttyS0', 2, 4013, 601)
+    assert zi.IdentityCache(filename).get('/dev/ttyS0', 1) == (4012, 600)
+    assert zi.IdentityCache(filename).get('/dev/ttyS0', 2) == (4013, 601)
+    assert zi.IdentityCache(filename).get('/dev/ttyS1', 1) == None
+    assert tmpdir.listdir().__len__() == 1
+
+
+def test_unreadable_file(tmpdir):
+    filename = str(tmpdir.join('identity.json'))
+    with open(filename, 'w') as f:
+        f.write('[1, 2')
+    cache = zi.IdentityCache(filename)
+    assert cache.get('/dev/ttyS0', 1) == None
+    cache.put('/dev/ttyS0', 1, 4012, 600)
+    assert cache.get('/dev/ttyS0', 1) == (4012, 600)
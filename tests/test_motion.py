@@ -0,0 +1,54 @@
+'''
+Trapezoidal move model.
+
+@author: Filip Lindau
+'''
+
+import time
+import pytest
+import zaber_control as zc
+
+
+def test_trapezoidal_profile():
+    # Accelerates for 1 s over 50 steps, cruises for 1 s, decelerates for 1 s
+    p = zc.MotionProfile(0, 200, 100.0, 100.0, 10.0)
+    assert (p.accTime, p.cruiseTime, p.duration, p.tArrival) == pytest.approx((1.0, 1.0, 3.0, 13.0))
+    assert p.position(9.0) == 0
+    assert p.position(11.0) == pytest.approx(50.0)
+    assert p.position(11.5) == pytest.approx(100.0)
+    assert p.position(14.0) == 200
+    assert p.timeToArrival(12.0) == pytest.approx(1.0)
+    back = zc.MotionProfile(200, 0, 100.0, 100.0, 10.0)
+    assert back.position(11.0) == pytest.approx(150.0)
+
+
+def test_triangular_profile():
+    p = zc.MotionProfile(0, 100, 1000.0, 100.0)
+    assert p.cruiseTime == pytest.approx(0.0)
+    assert p.peakSpeed == pytest.approx(100.0)
+    assert p.duration == pytest.approx(2.0)
+    assert zc.MotionProfile(5, 5, 100.0, 100.0).duration == 0.0
+
+
+def test_corrected_profile():
+    p = zc.MotionProfile(0, 200, 100.0, 100.0, 10.0)
+    # Read 50 steps at 12 s: running 1 s late
+    c = p.corrected(50.0, 12.0)
+    assert c.t0 == pytest.approx(11.0, abs = 1e-6)
+    assert c.tArrival == pytest.approx(14.0, abs = 1e-6)
+    assert p.t0 == 10.0
+    assert p.corrected(500.0, 12.0).position(12.0) == pytest.approx(200.0)
+
+
+def test_emulator_follows_the_model(emulator, control):
+    req = control.startPositionAbsolute(5000, 1)
+    t0 = time.time()
+    dev = emulator.getDevice(1)
+    speed = dev.settings[42]*zc.SPEED_UNIT
+    acceleration = dev.settings[43]*zc.ACCELERATION_UNIT
+    p = zc.MotionProfile(0, 5000, speed, acceleration, dev.moveStart)
+    time.sleep(0.2)
+    t = time.time()
+    assert abs(control.getPosition(1) - p.position(t)) < 0.05*5000
+    req.wait(5.0)
+    assert time.time() - t0 == pytest.approx(p.duration, abs = 0.2)
@@ -0,0 +1,64 @@
+'''
+Reply matching and framing of ZaberPort, without a serial port.
+
+@author: Filip Lindau
+'''
+
+import time
+import zaber_codec as codec
+import zaber_control as zc
+from zaber_control import MotorCommand
+
+
+def test_match_reply_in_order():
+    pending = [zc.ZaberRequest(MotorCommand(60, 0, 1)), zc.ZaberRequest(MotorCommand(60, 0, 2)),
+               zc.ZaberRequest(MotorCommand(60, 0, 1))]
+    first, second, third = pending
+    assert zc.matchReply(pending, MotorCommand(60, 5, 1)) is first
+    assert zc.matchReply(pending, MotorCommand(60, 5, 1)) is third
+    assert zc.matchReply(pending, MotorCommand(60, 5, 1)) == None
+    assert pending == [second]
+
+
+def test_match_reply_setting_and_error():
+    getRes = zc.ZaberRequest(zc.queryCommand(53, 37, 1))
+    setSpeed = zc.ZaberRequest(MotorCommand(42, 1000, 1))
+    pending = [getRes, setSpeed]
+    # Return Setting is answered with the setting number as command
+    assert zc.matchReply(pending, MotorCommand(37, 64, 1)) is getRes
+    pending = [getRes, setSpeed]
+    # An error reply goes to the request of the offending command
+    assert zc.matchReply(pending, MotorCommand(255, 42, 1)) is setSpeed
+    assert pending == [getRes]
+
+
+def test_link_statistics():
+    stats = zc.LinkStatistics()
+    stats.recordReply(60, 0.0015)
+    stats.recordReply(60, 0.0015)
+    stats.recordReply(54, 2.0, error = True)
+    stats.recordReply(20, None)
+    stats.recordTimeout(60)
+    assert stats.histogram(60)[1] == 2
+    assert stats.histogram(54)[-1] == 1
+    assert sum(stats.histogram()) == 3
+    assert stats.commands() == [54, 60]
+    assert (stats.errorReplies, stats.timeouts) == (1, 1)
+    stats.reset()
+    assert stats.histogram() == [0]*(stats.latencyBins.__len__() + 1)
+    assert stats.timeouts == 0
+
+
+def test_route_frames_resync():
+    port = zc.ZaberPort('none')
+    req = zc.ZaberRequest(MotorCommand(60, 0, 1))
+    req.t0 = time.time()
+    port.pending.append(req)
+    frame = codec.encodeFrame(1, 60, 1234)
+    buf = bytearray(''.join(('\x07', frame, frame[:3])))
+    used = port.routeFrames(buf, buf.__len__())
+    # The stray byte is dropped and the partial frame is kept
+    assert used == 7
+    assert req.reply.data == 1234
+    assert port.statistics.resyncs == 1
+    assert port.statistics.droppedBytes == 1
@@ -0,0 +1,45 @@
+'''
+State snapshot file.
+
+@author: Filip Lindau
+'''
+
+import numpy as np
+import zaber_snapshot as zs
+
+
+def test_save_load(tmpdir):
+    filename = str(tmpdir.join('axis.npy'))
+    snap = zs.StateSnapshot(filename)
+    assert snap.load('/dev/ttyS0', 1) == None
+    snap.save('/dev/ttyS0', 1, {'position': 1.5, 'homed': 1, 'deviceId': 4012})
+    snap.save('/dev/ttyS0', 1, {'position': 2.5, 'homed': 0, 'deviceId': 4012})
+    snap.flush()
+    values = zs.StateSnapshot(filename).load('/dev/ttyS0', 1)
+    assert values['position'] == 2.5
+    assert values['homed'] == 0
+    assert values['deviceId'] == 4012
+    assert values['speed'] == None
+    # Not the axis it was saved for
+    assert zs.StateSnapshot(filename).load('/dev/ttyS0', 2) == None
+    assert zs.StateSnapshot(filename).load('/dev/ttyS1', 1) == None
+
+
+def test_interrupted_save_keeps_last_complete(tmpdir):
+    filename = str(tmpdir.join('axis.npy'))
+    snap = zs.StateSnapshot(filename)
+    snap.save('/dev/ttyS0', 1, {'position': 1.5})
+    # A save that died before its sequence number was written
+    slot = (snap.sequence + 1) % 2
+    snap.fields['position'][slot] = 9.5
+    snap.flush()
+    assert zs.StateSnapshot(filename).load('/dev/ttyS0', 1)['position'] == 1.5
+
+
+def test_other_layout_is_replaced(tmpdir):
+    filename = str(tmpdir.join('axis.npy'))
+    np.save(filename, np.zeros(3))
+    snap = zs.StateSnapshot(filename)
+    assert snap.load('/dev/ttyS0', 1) == None
+    snap.save('/dev/ttyS0', 1, {'position': 1.0})
+    assert snap.load('/dev/ttyS0', 1)['position'] == 1.0
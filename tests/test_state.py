@@ -0,0 +1,127 @@
+'''
+State thread helpers shared by the device servers.
+
+@author: Filip Lindau
+'''
+
+import Queue
+import numpy as np
+import pytest
+import zaber_state as zst
+
+
+def drain(q):
+    cmds = []
+    while q.empty() == False:
+        cmds.append(q.get(block=False))
+    return cmds
+
+
+def test_queue_priorities():
+    q = zst.ZaberCommandQueue()
+    for name in ['readPosition', 'writePosition', 'home', 'moveDone', 'stop']:
+        q.put(zst.ZaberCommand(name))
+    assert [cmd.command for cmd in drain(q)] == ['stop', 'moveDone', 'writePosition', 'home', 'readPosition']
+    with pytest.raises(Queue.Empty):
+        q.get(block=False)
+    with pytest.raises(Queue.Empty):
+        q.get(timeout=0.01)
+
+
+def test_queue_keeps_client_order():
+    q = zst.ZaberCommandQueue()
+    q.put(zst.ZaberCommand('writePosition', 1.0))
+    q.put(zst.ZaberCommand('home'))
+    # Not merged into the write before the home
+    q.put(zst.ZaberCommand('writePosition', 2.0))
+    cmds = drain(q)
+    assert [(cmd.command, cmd.data) for cmd in cmds] == [('writePosition', 1.0), ('home', None),
+                                                          ('writePosition', 2.0)]
+
+
+def test_queue_coalescing():
+    q = zst.ZaberCommandQueue()
+    q.put(zst.ZaberCommand('writePosition', 1.0))
+    q.put(zst.ZaberCommand('readPosition'))
+    q.put(zst.ZaberCommand('writeSpeed', 5.0))
+    q.put(zst.ZaberCommand('writePosition', 2.0))
+    q.put(zst.ZaberCommand('readPosition'))
+    # Moves are never merged
+    q.put(zst.ZaberCommand('home', 1))
+    q.put(zst.ZaberCommand('home', 2))
+    assert q.qsize() == 5
+    cmds = drain(q)
+    assert [(cmd.command, cmd.data) for cmd in cmds] == [('writePosition', 2.0), ('writeSpeed', 5.0),
+                                                          ('home', 1), ('home', 2), ('readPosition', None)]
+
+
+def test_queue_purge_and_full():
+    q = zst.ZaberCommandQueue(maxsize=3)
+    q.put(zst.ZaberCommand('readPosition'))
+    q.put(zst.ZaberCommand('readStatus'))
+    q.put(zst.ZaberCommand('home'))
+    assert q.oldestAge() >= 0.0
+    with pytest.raises(Queue.Full):
+        q.put(zst.ZaberCommand('stop'))
+    q.purge(['readPosition', 'readStatus'])
+    assert q.qsize() == 1
+    q.put(zst.ZaberCommand('stop'))
+    assert [cmd.command for cmd in drain(q)] == ['stop', 'home']
+    assert q.oldestAge() == 0.0
+
+
+def test_motor_data_snapshots():
+    md = zst.MotorData()
+    new = md.replace(position=[1.5], homed=[True])
+    # The published snapshot is not changed
+    assert md.position == [None] and md.homed == [False]
+    assert new.position == [1.5] and new.homed == [True]
+    assert new.stepPerUnit is md.stepPerUnit
+
+
+def test_poll_scheduler_backs_off_when_idle():
+    s = zst.PollScheduler({'readPosition': (0.1, 1.0)})
+    t = 100.0
+    assert s.nextCommand(True, t) == ('readPosition', 0.0)
+    s.polled('readPosition', t, True)
+    assert s.nextCommand(True, t)[1] == pytest.approx(0.1)
+    # The idle period doubles from the moving period up to the idle period
+    waits = []
+    for i in range(6):
+        cmd, waitTime = s.nextCommand(False, t)
+        waits.append(waitTime)
+        t += waitTime
+        s.polled('readPosition', t, False)
+    assert waits == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+    # Moving again polls at the moving period at once
+    assert s.nextCommand(True, t)[1] == pytest.approx(0.1)
+
+
+def test_poll_scheduler_min_interval_and_stagger():
+    s = zst.PollScheduler({'readPosition': (0.1, 1.0), 'readSettings': (0, 0)})
+    s.polled('readPosition', 0.0, True)
+    assert s.nextCommand(True, 0.1, minInterval=0.3) == (None, pytest.approx(0.2))
+    assert s.nextCommand(True, 0.3, minInterval=0.3) == ('readPosition', 0.0)
+    assert s.nextCommand(True, 0.3, skip=['readPosition']) == (None, 1.0)
+    s = zst.PollScheduler({'readSpeed': (10.0, 10.0), 'readAcceleration': (10.0, 10.0)})
+    s.stagger(['readSpeed', 'readAcceleration'], 0.0)
+    assert s.nextCommand(False, 5.0) == ('readAcceleration', 0.0)
+    s.polled('readAcceleration', 5.0, False)
+    assert s.nextCommand(False, 5.0) == (None, pytest.approx(5.0))
+
+
+def test_scan_sequence():
+    scan = zst.ScanSequence([1.0, 2.0, 3.0], [0.5, 0.5, 0.0])
+    assert scan.finished() == False
+    assert np.isnan(scan.arrivalPositions).all()
+    # The state thread advances the index when it starts the move to a point
+    scan.index = 1
+    scan.arrived(1.01, 10.0)
+    assert scan.pointsDone == 1
+    assert scan.nextTime == 10.5
+    assert scan.arrivalPositions[0] == 1.01
+    assert np.isnan(scan.arrivalTimes[1])
+    scan.index = 3
+    scan.arrived(3.0, 12.0)
+    assert scan.finished() == True
+    assert scan.nextTime == 12.0
@@ -0,0 +1,24 @@
+'''
+Trace ring buffer.
+
+@author: Filip Lindau
+'''
+
+import zaber_trace as zt
+
+
+def test_level_filter_and_ring(tmpdir):
+    trace = zt.TraceBuffer(capacity = 3, level = zt.TRACE_EVENTS)
+    trace.record(zt.TRACE_IO, 'poll', 'readPosition')
+    assert trace.entries() == []
+    for i in range(5):
+        trace.record(zt.TRACE_EVENTS, 'move', i)
+    # The oldest entries are overwritten
+    assert [entry[3] for entry in trace.entries()] == [2, 3, 4]
+    assert [entry[3] for entry in trace.entries(2)] == [3, 4]
+    assert trace.lines(1)[0].endswith('EVENTS move 4')
+    filename = str(tmpdir.join('trace.txt'))
+    trace.dump(filename)
+    assert open(filename).read().count('\n') == 3
+    trace.clear()
+    assert trace.entries() == []